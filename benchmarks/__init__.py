@@ -0,0 +1 @@
+# benchmarks - Замеры производительности (запуск: python -m benchmarks.<имя>)
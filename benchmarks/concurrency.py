@@ -0,0 +1,105 @@
+# concurrency.py - Замер потолка одновременных SSE-стримов
+#
+# Открывает N одновременных запросов /get_response к запущенному серверу и
+# меряет время до первого байта (TTFB) и до конца стрима. Уровень считается
+# выдержанным, если все стримы завершились и p95 TTFB не выше
+# --ttfb-factor * TTFB одиночного запроса: запросы сверх потолка ждут
+# свободный поток, и их TTFB растёт на длину целого стрима.
+#
+# Сервер для замера (ответы Gemini имитируются, авторизация отключена):
+#   GEMINI_BACKEND=fake FAKE_GEMINI_LATENCY_MS=1000 FAKE_GEMINI_CHUNK_DELAY_MS=500 \
+#   DEV_MODE=true gunicorn -c gunicorn.conf.py src.app:app
+# Запуск: python -m benchmarks.concurrency --levels 16,32,64,96
+import sys
+import time
+import uuid
+import argparse
+import threading
+import statistics
+
+import requests
+
+
+def _percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def open_stream(url: str, message: str, barrier: threading.Barrier, results: list) -> None:
+    """Один SSE-запрос: (TTFB, длительность) или ошибка"""
+    session = requests.Session()
+    payload = {'user_input': message, 'doc_id': '0', 'session_id': f"bench-{uuid.uuid4()}"}
+    barrier.wait()
+    start = time.perf_counter()
+    ttfb = None
+    try:
+        with session.post(f"{url}/get_response", json=payload, stream=True, timeout=300) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if ttfb is None and line.startswith(b'data:'):
+                    ttfb = time.perf_counter() - start
+        results.append((ttfb, time.perf_counter() - start, None))
+    except Exception as e:
+        results.append((ttfb, time.perf_counter() - start, str(e)))
+    finally:
+        session.close()
+
+
+def run_level(url: str, message: str, concurrency: int) -> dict:
+    results = []
+    barrier = threading.Barrier(concurrency)
+    threads = [
+        threading.Thread(target=open_stream, args=(url, message, barrier, results))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ok = [r for r in results if r[2] is None and r[0] is not None]
+    ttfbs = [r[0] for r in ok] or [float('inf')]
+    return {
+        'concurrency': concurrency,
+        'ok': len(ok),
+        'errors': len(results) - len(ok),
+        'ttfb_p50': statistics.median(ttfbs),
+        'ttfb_p95': _percentile(ttfbs, 0.95),
+        'total_p95': _percentile([r[1] for r in ok] or [float('inf')], 0.95),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Потолок одновременных SSE-стримов")
+    parser.add_argument('--url', default='http://127.0.0.1:5001')
+    parser.add_argument('--message', default='привет', help="Сообщение (по умолчанию — общий чат без поиска)")
+    parser.add_argument('--levels', default='8,16,32,48,64,80,96,128')
+    parser.add_argument('--ttfb-factor', type=float, default=1.5)
+    args = parser.parse_args(argv)
+
+    baseline = run_level(args.url, args.message, 1)
+    if baseline['errors']:
+        print("ОШИБКА: Одиночный запрос не выполнен — сервер запущен с DEV_MODE=true?")
+        return 1
+    limit = baseline['ttfb_p50'] * args.ttfb_factor
+    print(f"Одиночный запрос: TTFB {baseline['ttfb_p50'] * 1000:.0f} мс, порог p95 TTFB {limit * 1000:.0f} мс")
+    print(f"{'N':>5} {'ok':>5} {'ошибки':>7} {'TTFB p50':>9} {'TTFB p95':>9} {'стрим p95':>10}")
+
+    ceiling = 1
+    for level in [int(x) for x in args.levels.split(',') if x.strip()]:
+        result = run_level(args.url, args.message, level)
+        print(
+            f"{level:>5} {result['ok']:>5} {result['errors']:>7} "
+            f"{result['ttfb_p50'] * 1000:>7.0f}мс {result['ttfb_p95'] * 1000:>7.0f}мс "
+            f"{result['total_p95'] * 1000:>8.0f}мс"
+        )
+        if result['errors'] or result['ttfb_p95'] > limit:
+            break
+        ceiling = level
+
+    print(f"\nПотолок одновременных стримов: {ceiling}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# pipeline.py - Сквозной замер /get_response: время до первого байта и до конца SSE-стрима
+#
+# Запросы идут в приложение внутри процесса, без сети: wsgi — Flask
+# (тестовый клиент, тело ответа читается по мере генерации), asgi —
+# src.asgi:app (вызов ASGI-приложения напрямую). Ответы Gemini — fake-клиент
+# с задаваемой задержкой; хранилище — static/vector_store с fake-эмбеддингами,
+# так что RAG-запросы проходят поиск, расширение и стрим ответа целиком.
+#
+# Метрики на сценарий: ttfb (первый байт, у RAG это статус «поиск»),
+# first_content (первая часть ответа), total (конец стрима), ошибки, запр/с.
+# Каждый запрос — новая сессия и уникальный текст: кеши ответов не скрывают
+# работу конвейера.
+#
+# Запуск: python -m benchmarks.pipeline [--modes wsgi,asgi] [--latency-ms 200] [--output out.json]
+import io
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from benchmarks.report import latency_metrics, result, use_fake_backend, build_binary_store, write_report
+
+CONTENT_MARKER = b'"type": "content"'
+ERROR_MARKER = b'"type": "error"'
+
+
+class StreamTimer:
+    """Отметки времени одного SSE-ответа"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.ttfb = None
+        self.first_content = None
+        self.total = None
+        self.error = None
+
+    def feed(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        now = time.perf_counter() - self.start
+        if self.ttfb is None:
+            self.ttfb = now
+        if self.first_content is None and CONTENT_MARKER in chunk:
+            self.first_content = now
+        if self.error is None and ERROR_MARKER in chunk:
+            self.error = 'error event'
+
+    def finish(self, status: int) -> 'StreamTimer':
+        self.total = time.perf_counter() - self.start
+        if status != 200:
+            self.error = f'HTTP {status}'
+        elif self.error is None and self.first_content is None:
+            self.error = 'no content'
+        return self
+
+
+def rag_queries(count: int) -> List[str]:
+    """Вопросы по документам: пути разделов оглавления.
+
+    Метка вызова делает текст уникальным и между вызовами (прогрев, режимы):
+    иначе эмбеддинги и расширения следующего режима берутся из кешей.
+    """
+    from src.vector_index import get_vector_index
+
+    paths = [sec['full_path'] for sec in get_vector_index().toc_sections]
+    salt = uuid.uuid4().hex[:8]
+    return [f"{paths[i % len(paths)]} — какие требования? #{salt}-{i}" for i in range(count)]
+
+
+def make_payloads(scenario: str, count: int) -> List[bytes]:
+    if scenario == 'rag':
+        messages = rag_queries(count)
+    else:
+        # Общий чат: распознаётся по точному совпадению, без поиска
+        messages = ['привет'] * count
+    return [
+        json.dumps({'user_input': message, 'doc_id': '0', 'session_id': f"bench-{uuid.uuid4()}"}).encode('utf-8')
+        for message in messages
+    ]
+
+
+# --- WSGI ---
+
+def wsgi_request(flask_app, body: bytes) -> StreamTimer:
+    timer = StreamTimer()
+    client = flask_app.test_client()
+    response = client.post('/get_response', data=body, content_type='application/json', buffered=False)
+    try:
+        for chunk in response.response:
+            timer.feed(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+    finally:
+        response.close()
+    return timer.finish(response.status_code)
+
+
+def run_wsgi(payloads: List[bytes], concurrency: int) -> List[StreamTimer]:
+    from src.app import app as flask_app
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda body: wsgi_request(flask_app, body), payloads))
+
+
+# --- ASGI ---
+
+async def asgi_request(asgi_app, body: bytes) -> StreamTimer:
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': '/get_response',
+        'raw_path': b'/get_response',
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('127.0.0.1', 80),
+    }
+    timer = StreamTimer()
+    done = asyncio.Event()
+    status = 0
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # Клиент «на связи», пока ответ не дочитан
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            timer.feed(message.get('body', b''))
+            if not message.get('more_body'):
+                done.set()
+
+    try:
+        await asgi_app(scope, receive, send)
+    finally:
+        done.set()
+    return timer.finish(status)
+
+
+def run_asgi(payloads: List[bytes], concurrency: int) -> List[StreamTimer]:
+    from src.asgi import app as asgi_app
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(body):
+            async with semaphore:
+                return await asgi_request(asgi_app, body)
+        return await asyncio.gather(*(one(body) for body in payloads))
+
+    return asyncio.run(run_all())
+
+
+MODES = {'wsgi': run_wsgi, 'asgi': run_asgi}
+
+
+def summarize(timers: List[StreamTimer], elapsed: float) -> dict:
+    ok = [t for t in timers if t.error is None]
+    metrics = {
+        'requests': len(timers),
+        'errors': len(timers) - len(ok),
+        'rps': round(len(timers) / elapsed, 2) if elapsed else None,
+    }
+    metrics.update(latency_metrics([t.ttfb for t in ok], 'ttfb_'))
+    metrics.update(latency_metrics([t.first_content for t in ok], 'first_content_'))
+    metrics.update(latency_metrics([t.total for t in ok], 'total_'))
+    return metrics
+
+
+def measure(runner: Callable, scenario: str, requests: int, concurrency: int) -> dict:
+    # Прогрев: ленивые импорты, индекс, роутер, пулы потоков
+    runner(make_payloads(scenario, 2), 1)
+    payloads = make_payloads(scenario, requests)
+    started = time.perf_counter()
+    timers = runner(payloads, concurrency)
+    return summarize(timers, time.perf_counter() - started)
+
+
+def run(modes: List[str], scenarios: List[str], requests: int, concurrency: int,
+        latency_ms: float, chunk_delay_ms: float, verbose: bool = False) -> List[dict]:
+    results = []
+    for mode in modes:
+        for scenario in scenarios:
+            # Журнал сервиса (этапы, роутер) на каждый запрос — только с --verbose
+            log = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+            with log:
+                metrics = measure(MODES[mode], scenario, requests, concurrency)
+            key = {
+                'mode': mode, 'scenario': scenario, 'concurrency': concurrency,
+                'latency_ms': latency_ms, 'chunk_delay_ms': chunk_delay_ms,
+            }
+            results.append(result('pipeline', key, metrics))
+            print(
+                f"  {mode:<5} {scenario:<8} TTFB p50 {metrics.get('ttfb_p50_ms', 0):>8.1f} мс  "
+                f"ответ p50 {metrics.get('first_content_p50_ms', 0):>8.1f} мс  "
+                f"стрим p95 {metrics.get('total_p95_ms', 0):>8.1f} мс  "
+                f"{metrics['rps']:>7.1f} запр/с  ошибок {metrics['errors']}"
+            )
+    return results
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--modes', default='wsgi,asgi', help="wsgi, asgi через запятую")
+    parser.add_argument('--scenarios', default='general,rag', help="general, rag через запятую")
+    parser.add_argument('--requests', type=int, default=30, help="Запросов на сценарий")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=200, help="Задержка fake Gemini до ответа")
+    parser.add_argument('--chunk-delay-ms', type=float, default=20, help="Задержка между частями стрима")
+    parser.add_argument('--verbose', action='store_true', help="Печатать журнал сервиса")
+
+
+def _split(value: str) -> List[str]:
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сквозной замер /get_response")
+    add_arguments(parser)
+    parser.add_argument('--output', help="JSON-отчёт")
+    args = parser.parse_args(argv)
+
+    modes = _split(args.modes)
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"неизвестный режим: {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        use_fake_backend(workdir, args.latency_ms, args.chunk_delay_ms)
+        build_binary_store(fake_embeddings=True)
+        print(f"Сквозной замер (fake Gemini: {args.latency_ms:g} мс, части через {args.chunk_delay_ms:g} мс):")
+        results = run(
+            modes, _split(args.scenarios), args.requests, args.concurrency, args.latency_ms, args.chunk_delay_ms,
+            args.verbose
+        )
+
+    if args.output:
+        write_report(args.output, results, vars(args))
+    return 1 if any(r['metrics']['errors'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,455 @@
+# replay.py - Нагрузочный прогон: воспроизведение диалогов /get_response на запущенном сервере
+#
+# Запись — *.jsonl из TRAFFIC_RECORD_DIR сервиса (src/traffic.py): форма
+# запросов без текста, ходы диалога связаны псевдонимом сессии. Текст хода
+# подбирается по виду: вопрос по разделу оглавления, шаги предписания, вопрос
+# по документу, общий чат. Без --recording нагрузка синтетическая: --sessions
+# диалогов в смеси SYNTH_MIX.
+#
+# Сервер запускается здесь же (gunicorn — как в продакшене, или uvicorn
+# src.asgi:app) с fake Gemini: --latency-ms до первой части ответа, части
+# через --chunk-delay-ms. Сессии — SQLite, общие для воркеров, как в продакшене.
+# Вместо этого можно задать --url (RSS воркеров — при --server-pid).
+#
+# Диалоги начинаются по записанному времени (ускорение --speed) или потоком
+# Пуассона --rate диалогов/с. Одновременно идут не больше --concurrency
+# диалогов; ходы диалога — по очереди, с записанной паузой (не больше
+# --max-think-s). Диалог, который ждал свободного места, учитывается в
+# start_lag: большой lag — упор в клиент, а не в сервер.
+#
+# Отчёт: запр/с, доля ошибок, TTFB, первая часть ответа и конец стрима
+# (p50/p95/p99) — всего и по видам; RSS каждого воркера после прогрева,
+# пиковый и в конце прогона.
+#
+# Запуск: python -m benchmarks.replay [--recording .cache/traffic] [--rate 2] [--concurrency 64]
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from benchmarks.report import ROOT_DIR, result, use_fake_backend, build_binary_store, write_report
+from benchmarks.pipeline import StreamTimer, summarize
+
+# Синтетическая смесь: вид диалога -> доля
+SYNTH_MIX = (('rag', 0.55), ('prescription', 0.2), ('grounding', 0.15), ('general', 0.1))
+# Пауза между ходами синтетического диалога (с)
+SYNTH_THINK = (3.0, 20.0)
+# Как часто снимать RSS воркеров (с)
+MEMORY_INTERVAL = 1.0
+
+
+# --- Нагрузка ---
+
+def load_recording(path) -> List[dict]:
+    """Диалоги из записи (файл или каталог *.jsonl): [{start, turns}], start — от начала записи"""
+    path = Path(path)
+    files = sorted(path.glob('*.jsonl')) if path.is_dir() else [path]
+    by_session = {}
+    for file in files:
+        with open(file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                by_session.setdefault(record['session'], []).append(record)
+    if not by_session:
+        return []
+
+    origin = min(turn['t'] for turns in by_session.values() for turn in turns)
+    dialogs = []
+    for turns in by_session.values():
+        turns.sort(key=lambda turn: turn['t'])
+        previous = turns[0]['t']
+        for turn in turns:
+            turn['gap'] = turn['t'] - previous
+            previous = turn['t']
+        dialogs.append({'start': turns[0]['t'] - origin, 'turns': turns})
+    return sorted(dialogs, key=lambda dialog: dialog['start'])
+
+
+def _turn(kind: str, step: str = '', doc_id: str = '0') -> dict:
+    return {'kind': kind, 'step': step, 'doc_id': doc_id, 'category_doc_ids': None}
+
+
+def synth_workload(count: int, rng: random.Random, documents: List[str]) -> List[dict]:
+    """Синтетические диалоги в смеси SYNTH_MIX; start задаётся schedule()"""
+    from src.traffic import GENERAL, RAG, GROUNDING, PRESCRIPTION, STEP_START, STEP_START_DETAILS, STEP_DETAILS, STEP_CONFIRM
+
+    kinds, weights = zip(*SYNTH_MIX)
+    dialogs = []
+    for _ in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == GROUNDING and not documents:
+            kind = RAG
+        if kind == PRESCRIPTION:
+            opening = [_turn(kind, STEP_START), _turn(kind, STEP_DETAILS)] if rng.random() < 0.5 \
+                else [_turn(kind, STEP_START_DETAILS)]
+            turns = opening + [_turn(kind, STEP_CONFIRM)]
+        elif kind == GROUNDING:
+            doc_id = rng.choice(documents)
+            turns = [_turn(kind, doc_id=doc_id) for _ in range(rng.randint(1, 3))]
+        elif kind == GENERAL:
+            turns = [_turn(kind)]
+        else:
+            turns = [_turn(kind) for _ in range(rng.randint(1, 4))]
+        for i, turn in enumerate(turns):
+            turn['gap'] = rng.uniform(*SYNTH_THINK) if i else 0.0
+        dialogs.append({'start': 0.0, 'turns': turns})
+    return dialogs
+
+
+def schedule(dialogs: List[dict], rate: Optional[float], speed: float, max_think: float,
+             rng: random.Random) -> List[dict]:
+    """Время начала диалогов (поток Пуассона или запись / speed) и пауз между ходами"""
+    moment = 0.0
+    for dialog in dialogs:
+        if rate:
+            dialog['start'] = moment
+            moment += rng.expovariate(rate)
+        else:
+            dialog['start'] = dialog['start'] / speed
+        for turn in dialog['turns']:
+            turn['pause'] = min(turn['gap'], max_think) / speed
+    return sorted(dialogs, key=lambda dialog: dialog['start'])
+
+
+class Messages:
+    """Текст ходов: разделы оглавления вместо записанных вопросов"""
+
+    def __init__(self, rng: random.Random):
+        from src.vector_index import get_vector_index
+
+        self.rng = rng
+        self.topics = [sec['full_path'] for sec in get_vector_index().toc_sections] or ['Требования охраны труда']
+
+    def text(self, turn: dict) -> str:
+        from src.traffic import GENERAL, PRESCRIPTION, STEP_START, STEP_START_DETAILS, STEP_DETAILS
+
+        topic = self.rng.choice(self.topics)
+        if turn['kind'] == GENERAL:
+            return 'привет'
+        if turn['kind'] == PRESCRIPTION:
+            if turn['step'] == STEP_START:
+                return 'выдать предписание'
+            if turn['step'] == STEP_START_DETAILS:
+                return f"выдать предписание по {topic}"
+            if turn['step'] == STEP_DETAILS:
+                return topic
+            return 'Нарушения подтверждаю: пункты 1 и 2'
+        return f"{topic} — какие требования? #{self.rng.randrange(10 ** 6)}"
+
+
+def grounding_documents() -> List[str]:
+    """id документов манифеста, файлы которых есть (режим одного документа)"""
+    from src.config import TEXT_INSTRUCTIONS_DIR
+    from src.rag import get_document_metadata
+
+    return [
+        doc['id'] for doc in get_document_metadata()
+        if doc.get('filename') and (TEXT_INSTRUCTIONS_DIR / doc['filename']).exists()
+    ]
+
+
+# --- Клиент ---
+
+def send_turn(http: requests.Session, url: str, session_id: str, turn: dict, text: str) -> StreamTimer:
+    payload = {
+        'user_input': text, 'doc_id': turn['doc_id'], 'session_id': session_id,
+        'category_doc_ids': turn.get('category_doc_ids'),
+    }
+    timer = StreamTimer()
+    try:
+        with http.post(f"{url}/get_response", json=payload, stream=True, timeout=300) as response:
+            for chunk in response.iter_content(chunk_size=None):
+                timer.feed(chunk)
+            return timer.finish(response.status_code)
+    except requests.RequestException as e:
+        timer.finish(200)
+        timer.error = type(e).__name__
+        return timer
+
+
+def run_dialog(url: str, dialog: dict, messages: Messages, scheduled: float) -> Tuple[float, List[tuple]]:
+    """Ходы диалога по очереди: (задержка начала, [(вид, StreamTimer)])"""
+    lag = time.perf_counter() - scheduled
+    session_id = f"replay-{uuid.uuid4()}"
+    results = []
+    with requests.Session() as http:
+        for i, turn in enumerate(dialog['turns']):
+            if i and turn['pause']:
+                time.sleep(turn['pause'])
+            results.append((turn['kind'], send_turn(http, url, session_id, turn, messages.text(turn))))
+    return lag, results
+
+
+def replay(url: str, dialogs: List[dict], messages: Messages, concurrency: int) -> Tuple[list, list, float]:
+    """Прогон: ([(вид, StreamTimer)], [задержки начала], длительность)"""
+    records, lags = [], []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='replay') as executor:
+        futures = []
+        for dialog in dialogs:
+            delay = dialog['start'] - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(run_dialog, url, dialog, messages, started + dialog['start']))
+        for future in futures:
+            lag, results = future.result()
+            lags.append(lag)
+            records.extend(results)
+    return records, lags, time.perf_counter() - started
+
+
+# --- Сервер и память воркеров ---
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode: str, workers: int, threads: int, port: int, log) -> subprocess.Popen:
+    env = dict(
+        os.environ, FLASK_HOST='127.0.0.1', FLASK_PORT=str(port),
+        GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads), GUNICORN_LOG_LEVEL='warning'
+    )
+    if mode == 'wsgi':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'src.app:app']
+    else:
+        command = [
+            sys.executable, '-m', 'uvicorn', 'src.asgi:app', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(workers), '--log-level', 'warning',
+        ]
+    return subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 120) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"сервер завершился с кодом {process.returncode}")
+        try:
+            requests.get(f"{url}/", timeout=2, allow_redirects=False)
+            return
+        except requests.RequestException:
+            time.sleep(0.5)
+    raise RuntimeError(f"сервер не ответил за {timeout:.0f} с")
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def worker_pids(server_pid: int) -> List[int]:
+    """Дочерние процессы сервера (воркеры); без них — сам сервер"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                stat = f.read()
+            with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                cmdline = f.read()
+        except OSError:
+            continue
+        if int(stat.rsplit(')', 1)[1].split()[1]) == server_pid and b'resource_tracker' not in cmdline:
+            children.append(int(entry))
+    return sorted(children) or [server_pid]
+
+
+class MemoryMonitor:
+    """RSS воркеров: первое значение после start(), пик и последнее"""
+
+    def __init__(self, server_pid: int):
+        self.server_pid = server_pid
+        self.workers: Dict[int, dict] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='memory-monitor', daemon=True)
+
+    def sample(self) -> None:
+        for pid in worker_pids(self.server_pid):
+            rss = _rss_mb(pid)
+            if rss is None:
+                continue
+            worker = self.workers.setdefault(pid, {'start': rss, 'peak': rss, 'end': rss})
+            worker['peak'] = max(worker['peak'], rss)
+            worker['end'] = rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(MEMORY_INTERVAL):
+            self.sample()
+
+    def start(self) -> None:
+        self.sample()
+        self._thread.start()
+
+    def stop(self) -> Dict[int, dict]:
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        return self.workers
+
+
+# --- Отчёт ---
+
+def report_results(key: dict, records: list, lags: list, elapsed: float,
+                   memory: Optional[Dict[int, dict]]) -> List[dict]:
+    metrics = summarize([timer for _, timer in records], elapsed)
+    metrics['error_rate'] = round(metrics['errors'] / metrics['requests'], 4) if metrics['requests'] else 0.0
+    metrics['dialogs'] = len(lags)
+    if lags:
+        lags = sorted(lags)
+        metrics['start_lag_p95_ms'] = round(lags[min(len(lags) - 1, int(round(0.95 * (len(lags) - 1))))] * 1000, 3)
+    results = [result('replay', key, metrics)]
+    print(
+        f"  всего        {metrics['requests']:>5} запр.  {metrics['rps']:>6.2f} запр/с  "
+        f"ошибок {metrics['error_rate'] * 100:5.1f}%  TTFB p95 {metrics.get('ttfb_p95_ms', 0):>8.1f} мс  "
+        f"ответ p50/p95 {metrics.get('first_content_p50_ms', 0):>7.0f}/{metrics.get('first_content_p95_ms', 0):<7.0f} мс"
+    )
+
+    for kind in sorted({kind for kind, _ in records}):
+        kind_metrics = summarize([timer for k, timer in records if k == kind], elapsed)
+        results.append(result('replay', {**key, 'kind': kind}, kind_metrics))
+        print(
+            f"  {kind:<12} {kind_metrics['requests']:>5} запр.  ошибок {kind_metrics['errors']:>4}  "
+            f"ответ p50/p95 {kind_metrics.get('first_content_p50_ms', 0):>7.0f}/"
+            f"{kind_metrics.get('first_content_p95_ms', 0):<7.0f} мс"
+        )
+
+    for index, (pid, rss) in enumerate(sorted((memory or {}).items())):
+        worker = {
+            'rss_start_mb': round(rss['start'], 1),
+            'rss_peak_mb': round(rss['peak'], 1),
+            'rss_end_mb': round(rss['end'], 1),
+            'rss_growth_mb': round(rss['end'] - rss['start'], 1),
+        }
+        results.append(result('replay', {**key, 'worker': index}, worker))
+        print(
+            f"  воркер {pid:<6} RSS {worker['rss_start_mb']:>7.1f} -> {worker['rss_end_mb']:>7.1f} МБ "
+            f"(пик {worker['rss_peak_mb']:.1f}, рост {worker['rss_growth_mb']:+.1f})"
+        )
+    return results
+
+
+def run(args, url: str, server_pid: Optional[int]) -> List[dict]:
+    rng = random.Random(args.seed)
+    messages = Messages(rng)
+    if args.recording:
+        dialogs = load_recording(args.recording)
+        source = Path(args.recording).name
+    else:
+        dialogs = synth_workload(args.sessions, rng, grounding_documents())
+        source = f"synth-{args.sessions}"
+    if not dialogs:
+        raise RuntimeError(f"в записи {args.recording} нет запросов")
+    rate = args.rate if args.rate is not None else (None if args.recording else 1.0)
+    dialogs = schedule(dialogs, rate, args.speed, args.max_think_s, rng)
+    turns = sum(len(dialog['turns']) for dialog in dialogs)
+    print(f"Нагрузка {source}: {len(dialogs)} диалогов, {turns} запросов, "
+          f"{'поток ' + format(rate, 'g') + ' диалогов/с' if rate else 'время записи / ' + format(args.speed, 'g')}, "
+          f"до {args.concurrency} одновременно")
+
+    # Прогрев: индекс, роутер, тексты документов. Воркер gthread с занятыми
+    # потоками не принимает соединения — workers * threads диалогов сразу
+    # достаются всем воркерам
+    warmup_count = max(8, args.workers * args.threads)
+    warmup = schedule(synth_workload(warmup_count, random.Random(0), grounding_documents()), None, 1.0, 0.0, rng)
+    replay(url, warmup, messages, warmup_count)
+
+    monitor = MemoryMonitor(server_pid) if server_pid and os.path.isdir('/proc') else None
+    if monitor:
+        monitor.start()
+    records, lags, elapsed = replay(url, dialogs, messages, args.concurrency)
+    memory = monitor.stop() if monitor else None
+
+    key = {
+        'workload': source, 'server': args.server if not args.url else 'external',
+        'workers': args.workers, 'threads': args.threads, 'concurrency': args.concurrency,
+        'rate': rate, 'speed': args.speed, 'latency_ms': args.latency_ms, 'chunk_delay_ms': args.chunk_delay_ms,
+    }
+    return report_results(key, records, lags, elapsed, memory)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон записанных или синтетических диалогов")
+    parser.add_argument('--recording', help="Запись: файл или каталог *.jsonl (TRAFFIC_RECORD_DIR)")
+    parser.add_argument('--sessions', type=int, default=40, help="Синтетических диалогов (без --recording)")
+    parser.add_argument('--rate', type=float, help="Новых диалогов в секунду (по умолчанию — как в записи; синтетика — 1)")
+    parser.add_argument('--speed', type=float, default=1.0, help="Ускорение времени записи и пауз между ходами")
+    parser.add_argument('--max-think-s', type=float, default=60.0, help="Предел паузы между ходами (с)")
+    parser.add_argument('--concurrency', type=int, default=64, help="Одновременных диалогов")
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi', help="gunicorn src.app или uvicorn src.asgi")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=32, help="Потоков воркера gunicorn")
+    parser.add_argument('--latency-ms', type=float, default=1000, help="Задержка fake Gemini до ответа")
+    parser.add_argument('--chunk-delay-ms', type=float, default=50, help="Задержка между частями стрима")
+    parser.add_argument('--url', help="Уже запущенный сервер (DEV_MODE) вместо своего")
+    parser.add_argument('--server-pid', type=int, help="PID сервера --url для замера RSS воркеров")
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help="Доля ошибок, выше которой код 1")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="Печатать журнал сервиса")
+    parser.add_argument('--output', help="JSON-отчёт")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='bench-replay-') as workdir:
+        use_fake_backend(workdir, args.latency_ms, args.chunk_delay_ms)
+        # Ходы диалога попадают в разные воркеры: сессии — в общем SQLite
+        os.environ['SESSION_BACKEND'] = 'sqlite'
+        log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with log:
+            build_binary_store(fake_embeddings=True)
+
+        if args.url:
+            results = run(args, args.url.rstrip('/'), args.server_pid)
+        else:
+            port = _free_port()
+            url = f"http://127.0.0.1:{port}"
+            log_path = Path(workdir) / 'server.log'
+            with open(log_path, 'wb') as server_log:
+                process = start_server(args.server, args.workers, args.threads, port, None if args.verbose else server_log)
+                try:
+                    wait_ready(url, process)
+                    print(f"Сервер {args.server}: {args.workers} воркер(а), fake Gemini "
+                          f"{args.latency_ms:g} мс, части через {args.chunk_delay_ms:g} мс")
+                    results = run(args, url, process.pid)
+                except Exception:
+                    if not args.verbose:
+                        sys.stdout.write(log_path.read_text(encoding='utf-8', errors='replace')[-4000:])
+                    raise
+                finally:
+                    process.terminate()
+                    try:
+                        process.wait(timeout=30)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+
+    if args.output:
+        write_report(args.output, results, vars(args))
+    return 1 if results[0]['metrics']['error_rate'] > args.max_error_rate else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
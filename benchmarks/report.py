@@ -0,0 +1,137 @@
+# report.py - Общее для замеров: окружение с fake-клиентом, статистика, JSON-отчёт
+#
+# Отчёт — JSON {"meta": {...}, "results": [{"benchmark", "key", "metrics"}]}:
+# key определяет сценарий (масштаб, набор документов, режим сервера),
+# metrics — числа (мс, запросов/с). Два отчёта сравниваются по key:
+#   python -m benchmarks.suite compare old.json new.json
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def use_fake_backend(workdir, latency_ms: float = 0, chunk_delay_ms: float = 0) -> None:
+    """Окружение замера: fake Gemini без хвоста задержек и ошибок, DEV_MODE,
+    кеши и бинарное хранилище во workdir. Вызывать до импорта модулей src."""
+    if 'src.config' in sys.modules:
+        raise RuntimeError("use_fake_backend нужно вызвать до импорта src")
+    workdir = Path(workdir)
+    os.environ.update({
+        'GEMINI_BACKEND': 'fake',
+        'FAKE_GEMINI_LATENCY_MS': str(int(latency_ms)),
+        'FAKE_GEMINI_CHUNK_DELAY_MS': str(int(chunk_delay_ms)),
+        'FAKE_GEMINI_SLOW_RATE': '0',
+        'FAKE_GEMINI_FAIL_RATE': '0',
+        'DEV_MODE': 'true',
+        'SESSION_BACKEND': 'memory',
+        'DOC_TEXT_WARMUP': 'false',
+        'CACHE_DIR': str(workdir / 'cache'),
+        'VECTOR_BINARY_DIR': str(workdir / 'vector_index'),
+    })
+
+
+def build_binary_store(fake_embeddings: bool = False) -> None:
+    """Бинарное хранилище из static/vector_store во VECTOR_BINARY_DIR замера.
+
+    fake_embeddings — векторы фрагментов и оглавления пересчитываются
+    fake-клиентом: тогда текстовые запросы находят фрагменты, как в сервисе.
+    """
+    from src.config import VECTOR_STORE_DIR, VECTOR_BINARY_DIR
+    from src.vector_store import convert_json_store, load_vector_index, save_binary_store, source_fingerprint
+
+    if not fake_embeddings:
+        convert_json_store(VECTOR_STORE_DIR, VECTOR_BINARY_DIR)
+        return
+
+    import numpy as np
+    from src.fake_gemini import fake_embedding
+
+    index = load_vector_index(VECTOR_STORE_DIR)
+    index.matrix = np.array([fake_embedding(chunk['text']) for chunk in index.chunks], dtype=np.float32)
+    index.toc_matrix = np.array([
+        fake_embedding(f"{sec['full_path']}\n{index.chunks[sec['row_start']]['text']}")
+        for sec in index.toc_sections
+    ], dtype=np.float32)
+    save_binary_store(index, VECTOR_BINARY_DIR, sources=source_fingerprint(VECTOR_STORE_DIR))
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def latency_metrics(seconds: List[float], prefix: str = '') -> Dict[str, float]:
+    """p50/p95/p99/mean в мс"""
+    if not seconds:
+        return {}
+    ms = [s * 1000 for s in seconds]
+    return {
+        f'{prefix}p50_ms': round(percentile(ms, 0.5), 3),
+        f'{prefix}p95_ms': round(percentile(ms, 0.95), 3),
+        f'{prefix}p99_ms': round(percentile(ms, 0.99), 3),
+        f'{prefix}mean_ms': round(sum(ms) / len(ms), 3),
+    }
+
+
+def result(benchmark: str, key: dict, metrics: dict) -> dict:
+    return {'benchmark': benchmark, 'key': key, 'metrics': metrics}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, timeout=10
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def meta(args: Optional[dict] = None) -> dict:
+    import numpy as np
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': args or {},
+    }
+
+
+def write_report(path, results: List[dict], args: Optional[dict] = None) -> dict:
+    report = {'meta': meta(args), 'results': results}
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"INFO: Отчёт записан: {path}")
+    return report
+
+
+def _record_id(record: dict) -> str:
+    return record['benchmark'] + ' ' + json.dumps(record['key'], ensure_ascii=False, sort_keys=True)
+
+
+def compare_reports(old: dict, new: dict) -> List[dict]:
+    """Изменения метрик по совпадающим сценариям: [{id, metric, old, new, change}]"""
+    old_records = {_record_id(r): r['metrics'] for r in old.get('results', [])}
+    rows = []
+    for record in new.get('results', []):
+        record_id = _record_id(record)
+        before = old_records.get(record_id)
+        if before is None:
+            continue
+        for metric, value in record['metrics'].items():
+            if metric not in before or not isinstance(value, (int, float)):
+                continue
+            change = (value - before[metric]) / before[metric] if before[metric] else None
+            rows.append({'id': record_id, 'metric': metric, 'old': before[metric], 'new': value, 'change': change})
+    return rows
@@ -0,0 +1,176 @@
+# retrieval.py - Замер поиска фрагментов (rag._search_with_embeddings) на реальном и синтетическом корпусе
+#
+# Базовый корпус — static/vector_store (через бинарное хранилище, как в
+# сервисе). Синтетический корпус в N раз больше: копии документов с шумом
+# в векторах (новые doc_id), так что поиск по всем документам растёт
+# линейно, а по выбранным роутером — нет. Запросы — зашумлённые векторы
+# разделов оглавления (фиксированный seed): у реальных эмбеддингов корпуса
+# и fake-эмбеддингов текста нет общей геометрии, и текстовые запросы не
+# проходили бы порог схожести.
+#
+# Сценарии: docs=routed (3 документа, как после роутера) / all (весь корпус),
+# path=toc (поиск по оглавлению) / flat (по фрагментам, если оглавления нет).
+#
+# Запуск: python -m benchmarks.retrieval [--scales 1,10,100,1000] [--output out.json]
+import sys
+import copy
+import time
+import argparse
+import tempfile
+from typing import List
+
+import numpy as np
+
+from benchmarks.report import latency_metrics, result, use_fake_backend, build_binary_store, write_report
+
+# Норма шума относительно единичного вектора: запрос ~0.7 по косинусу к
+# своему разделу, копия документа ~0.95 к оригиналу
+QUERY_NOISE = 1.0
+COPY_NOISE = 0.3
+ROUTED_DOCS = 3
+
+
+def _noise(rng, shape, norm: float) -> np.ndarray:
+    """Гауссов шум с ожидаемой нормой строки norm"""
+    return rng.standard_normal(shape, dtype=np.float32) * np.float32(norm / np.sqrt(shape[-1]))
+
+
+def synthetic_index(base, scale: int, noise: float = COPY_NOISE, seed: int = 0):
+    """Корпус из scale копий base; копии 2..scale — с шумом в векторах"""
+    from src.vector_index import VectorIndex, normalize_rows
+
+    if scale == 1:
+        return base
+
+    rng = np.random.default_rng(seed)
+    n, t = base.matrix.shape[0], base.toc_matrix.shape[0]
+    index = VectorIndex()
+    index.matrix = np.empty((n * scale, base.matrix.shape[1]), dtype=np.float32)
+    index.toc_matrix = np.empty((t * scale, base.toc_matrix.shape[1]), dtype=np.float32)
+    toc_doc = []
+
+    for copy_num in range(scale):
+        suffix = '' if copy_num == 0 else f'__x{copy_num}'
+        row_off, toc_off, doc_off = copy_num * n, copy_num * t, copy_num * len(base.doc_ids)
+
+        for target, source, off, size in (
+            (index.matrix, base.matrix, row_off, n), (index.toc_matrix, base.toc_matrix, toc_off, t)
+        ):
+            block = np.asarray(source, dtype=np.float32)
+            if copy_num:
+                block = normalize_rows(block + _noise(rng, block.shape, noise))
+            target[off:off + size] = block
+
+        for doc_id in base.doc_ids:
+            new_id = doc_id + suffix
+            start, end = base.doc_ranges[doc_id]
+            index.doc_ranges[new_id] = (start + row_off, end + row_off)
+            start, end = base.toc_ranges[doc_id]
+            index.toc_ranges[new_id] = (start + toc_off, end + toc_off)
+            index.metadata[new_id] = base.metadata[doc_id]
+            index.doc_ids.append(new_id)
+
+        index.chunks.extend(dict(chunk, doc_id=chunk['doc_id'] + suffix) for chunk in base.chunks)
+        index.toc_sections.extend(
+            dict(sec, doc_id=sec['doc_id'] + suffix, row_start=sec['row_start'] + row_off, row_end=sec['row_end'] + row_off)
+            for sec in base.toc_sections
+        )
+        toc_doc.append(np.asarray(base.toc_doc) + doc_off)
+
+    index.toc_doc = np.concatenate(toc_doc).astype(np.int32)
+    index.build_sections()
+    return index
+
+
+def make_queries(base, count: int, seed: int = 1) -> List[List[float]]:
+    from src.vector_index import normalize_rows
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(base.toc_matrix.shape[0], size=count, replace=count > base.toc_matrix.shape[0])
+    vectors = np.asarray(base.toc_matrix[rows], dtype=np.float32)
+    vectors = normalize_rows(vectors + _noise(rng, vectors.shape, QUERY_NOISE))
+    return [v.tolist() for v in vectors]
+
+
+def without_toc(index):
+    """Тот же корпус без оглавления: поиск идёт по фрагментам"""
+    flat = copy.copy(index)
+    flat.toc_ranges = {}
+    return flat
+
+
+def measure(index, doc_ids: List[str], queries: List[List[float]], repeat: int, top_k: int = 8) -> dict:
+    from src.rag import _search_with_embeddings
+
+    # Прогрев: страницы memmap и кеши numpy
+    for query in queries[:5]:
+        _search_with_embeddings(doc_ids, query, [], top_k, 0.4, index=index)
+
+    timings, found = [], 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            t0 = time.perf_counter()
+            sources, _, _ = _search_with_embeddings(doc_ids, query, [], top_k, 0.4, index=index)
+            timings.append(time.perf_counter() - t0)
+            found += len(sources or [])
+    elapsed = time.perf_counter() - started
+    return {
+        **latency_metrics(timings),
+        'qps': round(len(timings) / elapsed, 1),
+        'sources_per_query': round(found / len(timings), 2),
+    }
+
+
+def run(scales: List[int], queries: int = 50, repeat: int = 3) -> List[dict]:
+    from src.vector_index import get_vector_index
+
+    base = get_vector_index()
+    query_vectors = make_queries(base, queries)
+    results = []
+
+    for scale in scales:
+        t0 = time.perf_counter()
+        index = synthetic_index(base, scale)
+        build_s = time.perf_counter() - t0
+        routed = index.doc_ids[:ROUTED_DOCS]
+
+        for path, view in (('toc', index), ('flat', without_toc(index))):
+            for docs, doc_ids in (('routed', routed), ('all', index.doc_ids)):
+                metrics = measure(view, doc_ids, query_vectors, repeat)
+                metrics.update(chunks=index.num_chunks, toc_sections=len(index.toc_sections), build_s=round(build_s, 3))
+                key = {'scale': scale, 'docs': docs, 'path': path}
+                results.append(result('retrieval', key, metrics))
+                print(
+                    f"  x{scale:<5} {docs:<7} {path:<5} p50 {metrics['p50_ms']:>8.2f} мс  "
+                    f"p95 {metrics['p95_ms']:>8.2f} мс  {metrics['qps']:>8.1f} запр/с  ({index.num_chunks} фрагм.)"
+                )
+        del index
+    return results
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--scales', default='1,10,100,1000', help="Множители корпуса через запятую")
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Замер поиска фрагментов")
+    add_arguments(parser)
+    parser.add_argument('--output', help="JSON-отчёт")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        use_fake_backend(workdir)
+        build_binary_store()
+        print("Поиск фрагментов:")
+        results = run([int(s) for s in args.scales.split(',') if s.strip()], args.queries, args.repeat)
+
+    if args.output:
+        write_report(args.output, results, vars(args))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
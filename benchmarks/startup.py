@@ -0,0 +1,82 @@
+# startup.py - Замер холодного старта приложения (python -X importtime)
+#
+# Запускает чистый интерпретатор, импортирует модуль приложения (по умолчанию
+# src.app: импорт + create_app + загрузка индекса) и печатает время старта
+# и самые дорогие импорты. Тяжёлые модули, которые должны подгружаться
+# лениво, при старте импортироваться не должны — иначе код возврата 1.
+#
+# Запуск: python -m benchmarks.startup [--runs 5] [--top 20]
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Модули, которых не должно быть в графе импортов при старте
+LAZY_MODULES = ('google.genai', 'docx', 'sklearn', 'scipy')
+
+_LINE_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def run_once(module: str) -> tuple:
+    """Один холодный старт: (секунды, [(модуль, self мкс, cumulative мкс, глубина)])"""
+    # Фоновый прогрев кеша текста импортирует python-docx и искажает замер
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1', DOC_TEXT_WARMUP='false')
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Импорт {module} завершился с ошибкой:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return elapsed, imports
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Замер холодного старта")
+    parser.add_argument('--module', default='src.app', help="Импортируемый модуль")
+    parser.add_argument('--runs', type=int, default=5, help="Число запусков")
+    parser.add_argument('--top', type=int, default=20, help="Сколько импортов показать")
+    args = parser.parse_args(argv)
+
+    timings = []
+    imports = []
+    for _ in range(args.runs):
+        elapsed, imports = run_once(args.module)
+        timings.append(elapsed)
+
+    by_cumulative = sorted(imports, key=lambda item: item[2], reverse=True)
+    total_us = sum(self_us for _, self_us, _, _ in imports)
+
+    print(f"Модуль: {args.module}, запусков: {args.runs}")
+    print(f"Старт процесса: медиана {statistics.median(timings) * 1000:.0f} мс, "
+          f"мин {min(timings) * 1000:.0f} мс, макс {max(timings) * 1000:.0f} мс")
+    print(f"Импорты (последний запуск): {len(imports)} модулей, {total_us / 1000:.0f} мс")
+    print()
+    print(f"{'cumulative, мс':>15} {'self, мс':>9}  модуль")
+    for name, self_us, cumulative_us, depth in by_cumulative[:args.top]:
+        print(f"{cumulative_us / 1000:>15.1f} {self_us / 1000:>9.1f}  {'  ' * depth}{name}")
+
+    loaded = {name for name, _, _, _ in imports}
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    if eager:
+        print(f"\nWARN: При старте импортированы тяжёлые модули: {', '.join(eager)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
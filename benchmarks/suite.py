@@ -0,0 +1,128 @@
+# suite.py - Набор замеров в один JSON-отчёт и сравнение двух отчётов
+#
+# run: retrieval, pipeline и replay запускаются отдельными процессами (у каждого
+# своё окружение: векторы хранилища настоящие или fake, свой сервер),
+# результаты сводятся в benchmarks/results/<время>-<коммит>.json (или --output).
+# compare: изменения метрик по совпадающим сценариям; строки, изменившиеся
+# больше чем на --threshold, помечаются. Для *_ms, доли ошибок и роста RSS
+# рост — хуже, для qps/rps — лучше.
+#
+# Запуск: python -m benchmarks.suite run [--quick]
+#         python -m benchmarks.suite compare old.json new.json
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+
+from benchmarks.report import ROOT_DIR, compare_reports, meta
+
+RESULTS_DIR = ROOT_DIR / 'benchmarks' / 'results'
+BENCHMARKS = ('retrieval', 'pipeline', 'replay')
+# Метрики, которые сравнивает compare, кроме *_ms
+COMPARED_METRICS = ('qps', 'rps', 'error_rate', 'rss_growth_mb')
+
+
+def run_benchmark(name: str, extra_args: list, output: Path) -> dict:
+    command = [sys.executable, '-m', f'benchmarks.{name}', '--output', str(output), *extra_args]
+    completed = subprocess.run(command, cwd=ROOT_DIR)
+    if completed.returncode != 0:
+        print(f"WARN: benchmarks.{name} завершился с кодом {completed.returncode}")
+    if not output.exists():
+        return {'results': []}
+    with open(output, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def cmd_run(args) -> int:
+    retrieval_args = ['--scales', '1,10' if args.quick else args.scales]
+    pipeline_args = ['--requests', '10' if args.quick else str(args.requests)]
+    # Синтетические диалоги, паузы между ходами ускорены в 10 раз
+    replay_args = ['--sessions', '10' if args.quick else '40', '--rate', '2', '--speed', '10']
+    if args.latency_ms is not None:
+        pipeline_args += ['--latency-ms', str(args.latency_ms)]
+        replay_args += ['--latency-ms', str(args.latency_ms)]
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bench-suite-') as tmp:
+        for name, extra in (('retrieval', retrieval_args), ('pipeline', pipeline_args), ('replay', replay_args)):
+            if name in args.only:
+                results.extend(run_benchmark(name, extra, Path(tmp) / f'{name}.json')['results'])
+
+    report = {'meta': meta(vars(args)), 'results': results}
+    output = Path(args.output) if args.output else (
+        RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{report['meta']['commit'] or 'nogit'}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"INFO: Отчёт записан: {output}")
+    return 0
+
+
+def _worse(metric: str, change: float) -> bool:
+    if metric in ('qps', 'rps'):
+        return change < 0
+    return (metric.endswith('_ms') or metric in COMPARED_METRICS) and change > 0
+
+
+def cmd_compare(args) -> int:
+    with open(args.old, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    print(f"Было: {old['meta'].get('commit')} ({old['meta'].get('timestamp')})")
+    print(f"Стало: {new['meta'].get('commit')} ({new['meta'].get('timestamp')})")
+    rows = [r for r in compare_reports(old, new) if r['metric'].endswith('_ms') or r['metric'] in COMPARED_METRICS]
+    if not rows:
+        print("WARN: Общих сценариев нет")
+        return 0
+
+    regressions = 0
+    current = None
+    for row in rows:
+        if row['id'] != current:
+            current = row['id']
+            print(f"\n{current}")
+        change = row['change']
+        mark = ''
+        if change is not None and abs(change) >= args.threshold:
+            mark = '  ХУЖЕ' if _worse(row['metric'], change) else '  лучше'
+            regressions += mark == '  ХУЖЕ'
+        change_text = f"{change * 100:+7.1f}%" if change is not None else '      —'
+        print(f"  {row['metric']:<22} {row['old']:>10} -> {row['new']:>10}  {change_text}{mark}")
+
+    print(f"\nУхудшений больше {args.threshold * 100:.0f}%: {regressions}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Набор замеров производительности")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="Запустить замеры и записать отчёт")
+    run.add_argument('--only', default=','.join(BENCHMARKS), help="Замеры через запятую")
+    run.add_argument('--scales', default='1,10,100,1000')
+    run.add_argument('--requests', type=int, default=30)
+    run.add_argument('--latency-ms', type=float, help="Задержка fake Gemini (по умолчанию — как в pipeline)")
+    run.add_argument('--quick', action='store_true', help="Короткий прогон: масштабы 1,10, по 10 запросов и диалогов")
+    run.add_argument('--output', help=f"JSON-отчёт (по умолчанию {RESULTS_DIR.relative_to(ROOT_DIR)}/)")
+
+    compare = commands.add_parser('compare', help="Сравнить два отчёта")
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.1, help="Порог отметки изменения (доля)")
+    compare.add_argument('--fail-on-regression', action='store_true', help="Код 1 при ухудшениях")
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        args.only = [name.strip() for name in args.only.split(',') if name.strip()]
+        return cmd_run(args)
+    return cmd_compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -26,6 +26,10 @@ if not exist ".env" (
     echo [INFO] Отредактируйте .env и укажите ваши ключи
 )
 
+REM Бинарное векторное хранилище (пересобирается из static/vector_store)
+echo [INFO] Сборка бинарного векторного хранилища...
+python -m src.vector_store convert
+
 REM Установка DEV_MODE
 set DEV_MODE=true
 set FLASK_DEBUG=true
@@ -27,6 +27,10 @@ if [ ! -f ".env" ]; then
     echo "[INFO] Отредактируйте .env и укажите ваши ключи"
 fi
 
+# Бинарное векторное хранилище (пересобирается из static/vector_store)
+echo "[INFO] Сборка бинарного векторного хранилища..."
+python -m src.vector_store convert
+
 # Установка DEV_MODE
 export DEV_MODE=true
 export FLASK_DEBUG=true
@@ -0,0 +1,42 @@
+# gunicorn.conf.py - Продакшен-запуск AI Chat
+#
+# Ответы /get_response — SSE-стримы на десятки секунд, поэтому воркеры
+# gthread: один стрим занимает поток, а не процесс. Потолок одновременных
+# стримов = workers * threads (замер: python -m benchmarks.concurrency,
+# см. deploy/README.md). Следующие запросы ждут в очереди.
+#
+# Запуск: gunicorn -c gunicorn.conf.py src.app:app
+import os
+
+bind = f"{os.environ.get('FLASK_HOST', '0.0.0.0')}:{os.environ.get('FLASK_PORT', '5001')}"
+
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+# Воркер с занятыми потоками не принимает новые соединения, и они достаются
+# свободному воркеру, а не ждут в его внутренней очереди
+worker_connections = threads
+
+# Приложение (векторный индекс, манифест) загружается один раз в мастере
+# до fork; клиент Gemini и соединения SQLite создаются уже в воркерах
+preload_app = True
+
+# gthread обслуживает heartbeat отдельно от потоков запросов, поэтому
+# timeout не ограничивает длину стрима
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# При перезапуске (HUP) и остановке (TERM) воркер перестаёт принимать
+# соединения и даёт текущим стримам доиграть до graceful_timeout
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 90))
+keepalive = 5
+
+# Плановый перезапуск воркеров (0 — выключен)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    server.log.info(f"INFO: Воркер {worker.pid} запущен ({threads} потоков)")
@@ -1,108 +1,37 @@
 # admin.py - Админ-панель с данными из Hub
-import traceback
-from datetime import datetime
+import time
 
-import requests
-from flask import Blueprint, render_template, jsonify, session
+from flask import Blueprint, render_template, jsonify, session, request, Response
 
-from src.config import HUB_API_URL, DEV_MODE
+from src.config import DEV_MODE
 from src.auth import admin_required, get_current_user, get_access_token
+from src.gemini_client import embedding_cache, embedding_batcher
+from src.rag import expansion_cache
+from src import doc_text, resilience
+from src.session_store import session_store
+from src.hub_client import hub_client
+from src.fake_hub import mock_data
+from src.profiler import profiler
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
 
 def hub_api_request(endpoint: str, method: str = 'GET', data: dict = None) -> dict:
-    """Выполнить запрос к Hub API"""
+    """Выполнить запрос к Hub API (GET — через кеш hub_client)"""
     access_token = get_access_token()
 
     if DEV_MODE:
         # В режиме разработки возвращаем моковые данные
-        return get_mock_data(endpoint)
+        return mock_data(endpoint)
 
     if not access_token:
         return {'error': 'No access token', 'status': 401}
 
-    try:
-        url = f"{HUB_API_URL}/{endpoint}"
-        headers = {'Authorization': f'Bearer {access_token}'}
-
-        if method == 'GET':
-            response = requests.get(url, headers=headers, timeout=10)
-        elif method == 'POST':
-            response = requests.post(url, headers=headers, json=data, timeout=10)
-        else:
-            return {'error': 'Unsupported method'}
-
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {'error': f'Hub API error: {response.status_code}', 'status': response.status_code}
-
-    except requests.RequestException as e:
-        print(f"Hub API error: {e}")
-        traceback.print_exc()
-        return {'error': str(e)}
-
-
-def get_mock_data(endpoint: str) -> dict:
-    """Моковые данные для режима разработки"""
-    if 'users' in endpoint:
-        return {
-            'users': [
-                {
-                    'id': '1',
-                    'email': 'admin@severindevelopment.ru',
-                    'display_name': 'Администратор',
-                    'department': 'IT отдел',
-                    'job_title': 'Системный администратор',
-                    'is_admin': True,
-                    'is_active': True,
-                    'last_login_at': datetime.now().isoformat()
-                },
-                {
-                    'id': '2',
-                    'email': 'user1@severindevelopment.ru',
-                    'display_name': 'Иванов Иван',
-                    'department': 'Строительный контроль',
-                    'job_title': 'Инженер СК',
-                    'is_admin': False,
-                    'is_active': True,
-                    'last_login_at': datetime.now().isoformat()
-                },
-                {
-                    'id': '3',
-                    'email': 'user2@severindevelopment.ru',
-                    'display_name': 'Петров Пётр',
-                    'department': 'Проектный отдел',
-                    'job_title': 'Архитектор',
-                    'is_admin': False,
-                    'is_active': True,
-                    'last_login_at': None
-                },
-            ],
-            'total': 3
-        }
-    elif 'stats' in endpoint:
-        return {
-            'total_users': 3,
-            'active_users': 2,
-            'total_sessions': 15,
-            'today_logins': 5
-        }
-    elif 'applications' in endpoint:
-        return {
-            'applications': [
-                {
-                    'id': '1',
-                    'name': 'AI Chat',
-                    'client_id': 'hub_ai_chat',
-                    'is_active': True,
-                    'created_at': datetime.now().isoformat()
-                }
-            ]
-        }
-
-    return {'error': 'Unknown endpoint'}
+    if method == 'GET':
+        return hub_client.api_get(endpoint, access_token)
+    elif method == 'POST':
+        return hub_client.api_post(endpoint, access_token, data)
+    return {'error': 'Unsupported method'}
 
 
 # --- Роуты админки ---
@@ -115,20 +44,52 @@ def index():
     return render_template('admin/index.html', user=user)
 
 
-@admin_bp.route('/api/users')
-@admin_required
-def get_users():
-    """API - список пользователей из Hub"""
+def _users_endpoint() -> str:
     search = session.get('admin_user_search', '')
     page = int(session.get('admin_user_page', 1))
     per_page = 20
 
-    # Запрос к Hub API
     endpoint = f"admin/users?page={page}&per_page={per_page}"
     if search:
         endpoint += f"&search={search}"
+    return endpoint
+
+
+@admin_bp.route('/api/overview')
+@admin_required
+def get_overview():
+    """API - все разделы главной страницы одним ответом.
+
+    Запросы к Hub идут параллельно; у каждого раздела свои данные, время
+    и признак успеха — ошибка одного раздела не мешает остальным.
+    """
+    endpoints = {
+        'stats': "admin/stats",
+        'users': _users_endpoint(),
+        'applications': "applications",
+        'login_history': "admin/login-history?limit=50",
+    }
+    start = time.perf_counter()
+
+    if DEV_MODE:
+        sections = {}
+        for name, endpoint in endpoints.items():
+            data = mock_data(endpoint)
+            sections[name] = {'data': data, 'ok': 'error' not in data, 'ms': 0.0}
+    else:
+        access_token = get_access_token()
+        if not access_token:
+            return jsonify({'error': 'No access token', 'status': 401})
+        sections = hub_client.api_get_many(endpoints, access_token)
+
+    return jsonify({'sections': sections, 'total_ms': round((time.perf_counter() - start) * 1000, 1)})
 
-    result = hub_api_request(endpoint)
+
+@admin_bp.route('/api/users')
+@admin_required
+def get_users():
+    """API - список пользователей из Hub"""
+    result = hub_api_request(_users_endpoint())
     return jsonify(result)
 
 
@@ -170,3 +131,65 @@ def get_login_history():
     """API - история входов"""
     result = hub_api_request("admin/login-history?limit=50")
     return jsonify(result)
+
+
+@admin_bp.route('/api/cache-stats')
+@admin_required
+def get_cache_stats():
+    """API - статистика локальных кешей"""
+    caches = [cache.stats_dict() for cache in (embedding_cache, expansion_cache) if cache]
+    caches.append(doc_text.stats_dict())
+    batcher = embedding_batcher.stats_dict() if embedding_batcher else None
+    caches.append(hub_client.stats_dict())
+    return jsonify({'caches': caches, 'embedding_batcher': batcher})
+
+
+@admin_bp.route('/api/gemini-stats')
+@admin_required
+def get_gemini_stats():
+    """API - предохранитель и политики коротких вызовов Gemini (p95, хеджи, повторы)"""
+    return jsonify(resilience.stats_dict())
+
+
+@admin_bp.route('/api/session-stats')
+@admin_required
+def get_session_stats():
+    """API - размер хранилища сессий и вытеснения"""
+    return jsonify(session_store.stats())
+
+
+@admin_bp.route('/api/profiler', methods=['GET', 'POST'])
+@admin_required
+def profiler_status():
+    """API - профилировщик: состояние и список профилей; POST {minutes} включает для всех запросов"""
+    if request.method == 'POST':
+        try:
+            minutes = float((request.get_json(silent=True) or {}).get('minutes', 0))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'minutes должно быть числом'}), 400
+        profiler.set_enabled(max(0.0, min(minutes, 60.0)))
+    return jsonify({'profiler': profiler.stats_dict(), 'profiles': profiler.list_profiles()})
+
+
+@admin_bp.route('/api/profiles/<profile_id>')
+@admin_required
+def get_profile(profile_id):
+    """API - профиль запроса (JSON: этапы, интервалы, стеки)"""
+    data = profiler.load(profile_id)
+    if data is None:
+        return jsonify({'error': 'Профиль не найден'}), 404
+    response = jsonify(data)
+    response.headers['Content-Disposition'] = f'attachment; filename=profile-{profile_id}.json'
+    return response
+
+
+@admin_bp.route('/api/profiles/<profile_id>/folded')
+@admin_required
+def get_profile_folded(profile_id):
+    """API - стеки профиля в формате collapsed (flamegraph.pl, speedscope)"""
+    folded = profiler.folded(profile_id)
+    if folded is None:
+        return jsonify({'error': 'Профиль не найден'}), 404
+    return Response(folded, mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename=profile-{profile_id}.folded'
+    })
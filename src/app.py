@@ -1,20 +1,23 @@
 # app.py - Точка входа приложения AI Chat
 # Версия 10.0 - Модульная архитектура с админкой
 import sys
+import time
 from pathlib import Path
 
 # Добавляем корень проекта в path
 ROOT_DIR = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(ROOT_DIR))
 
-from flask import Flask
+from flask import Flask, g
 
-from src.config import SECRET_KEY, DEBUG, HOST, PORT, TEMPLATES_DIR, STATIC_DIR
+from src.config import SECRET_KEY, DEBUG, HOST, PORT, TEMPLATES_DIR, STATIC_DIR, DOC_TEXT_WARMUP
 from src.auth import auth_bp
 from src.routes import main_bp
 from src.admin import admin_bp
 from src.gemini_client import GEMINI_CONFIGURED
-from src.rag import ALL_DOCUMENTS_METADATA
+from src.rag import get_document_metadata
+from src.vector_index import get_vector_index
+from src.doc_text import start_warmup
 
 
 def create_app() -> Flask:
@@ -31,6 +34,26 @@ def create_app() -> Flask:
     app.register_blueprint(main_bp)
     app.register_blueprint(admin_bp)
 
+    # Server-Timing: время обработчика у обычных ответов. У SSE заголовки
+    # уходят раньше этапов — их длительности приходят событием timing
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        started = g.get('request_started')
+        if started is not None and not response.is_streamed:
+            response.headers.add('Server-Timing', f"app;dur={(time.perf_counter() - started) * 1000:.1f}")
+        return response
+
+    # Векторный индекс загружается один раз, до первого запроса
+    get_vector_index()
+
+    # Текст документов для режима одного документа извлекается в фоне
+    if DOC_TEXT_WARMUP:
+        start_warmup(get_document_metadata())
+
     return app
 
 
@@ -45,7 +68,7 @@ if __name__ == '__main__':
     status = []
     if not GEMINI_CONFIGURED:
         status.append("  [!] Gemini API не настроен")
-    if not ALL_DOCUMENTS_METADATA:
+    if not get_document_metadata():
         status.append("  [!] Манифест документов не загружен")
 
     if status:
@@ -0,0 +1,168 @@
+# asgi.py - ASGI-приложение: async /get_response, остальные роуты — Flask
+#
+# /get_response обрабатывается в цикле asyncio через async-клиент Gemini
+# (client.aio): открытый стрим — корутина, а не поток, и один процесс держит
+# сотни разговоров. Когда клиент закрывает вкладку, Starlette отменяет
+# задачу стрима — отменяются этапы подготовки и стрим Gemini, токены дальше
+# не тратятся. Все остальные пути передаются Flask-приложению (WsgiToAsgi).
+#
+# Запуск: uvicorn src.asgi:app --host 0.0.0.0 --port 5001
+import time
+import asyncio
+import traceback
+from typing import AsyncGenerator, Optional
+
+import anyio
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import RedirectResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from src.config import DEV_MODE
+from src.app import app as flask_app
+from src.prompts import GROUNDING_SYSTEM_PROMPT
+from src.gemini_client import astream_response, astream_grounded_response
+from src import events
+from src.events import CONTENT, StreamEvent, asse_stream, to_sse
+from src.rag import get_full_docx_text
+from src.pipeline import StageTimings, aprepare_rag_context, arun_retrieval
+from src.traffic import traffic_recorder
+from src.routes import (
+    PLAN_ABORT, PLAN_ERROR, PLAN_GROUNDING, PLAN_RAG, PLAN_RETRIEVE, PLAN_STREAM,
+    get_or_create_session, start_plan, prescription_plan, rag_session_args, rag_plan, plan_event, finish_turn
+)
+from src.session_store import session_store
+
+
+async def _single_event(event: StreamEvent) -> AsyncGenerator[StreamEvent, None]:
+    yield event
+
+
+def _flask_session(request: Request) -> Optional[dict]:
+    """Данные подписанной cookie сессии Flask (None, если нет или подпись неверна)"""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+
+
+def _is_authorized(request: Request) -> bool:
+    """Проверка как в login_required"""
+    if DEV_MODE:
+        return True
+    data = _flask_session(request)
+    return bool(data and 'access_token' in data and 'user' in data)
+
+
+async def aprocess_user_request(
+    user_input: str, doc_id: str, session_id: str, category_doc_ids: str = None
+) -> AsyncGenerator[StreamEvent, None]:
+    """process_user_request для ASGI; сессия сохраняется и при отключении клиента"""
+    current_session = await asyncio.to_thread(get_or_create_session, session_id)
+    if traffic_recorder.directory is not None:
+        # Запись в файл — в потоке, как и чтение сессии
+        await asyncio.to_thread(
+            traffic_recorder.record, session_id, current_session.get('state', 'IDLE'),
+            user_input, doc_id, category_doc_ids
+        )
+    try:
+        async for event in _ahandle_request(user_input, doc_id, current_session, category_doc_ids):
+            yield event
+    finally:
+        # Задача стрима уже отменена: без shield отменился бы и этот await
+        with anyio.CancelScope(shield=True):
+            await anyio.to_thread.run_sync(session_store.save, session_id, current_session)
+
+
+async def _ahandle_request(
+    user_input: str, doc_id: str, current_session: dict, category_doc_ids: str = None
+) -> AsyncGenerator[StreamEvent, None]:
+    timings = StageTimings()
+    plan = start_plan(current_session, user_input, doc_id, timings)
+
+    if plan.action == PLAN_RETRIEVE:
+        sources, context, error = await arun_retrieval(plan.text, timings, top_k=5)
+        plan = prescription_plan(current_session, plan.text, sources, context, error)
+
+    elif plan.action == PLAN_GROUNDING:
+        with timings.stage('doc_text'):
+            full_text, error = await asyncio.to_thread(get_full_docx_text, doc_id)
+        if error:
+            yield events.error(error)
+            return
+
+    elif plan.action == PLAN_RAG:
+        yield events.status('search')
+        prepared = await aprepare_rag_context(
+            user_input, current_session['history'], timings,
+            category_doc_ids=category_doc_ids, **rag_session_args(current_session)
+        )
+        plan = rag_plan(current_session, user_input, prepared)
+
+    if plan.action == PLAN_ABORT:
+        yield events.error(plan.text)
+        return
+
+    full_response = ""
+    if plan.action == PLAN_GROUNDING:
+        response_generator = astream_grounded_response(
+            full_text, user_input, GROUNDING_SYSTEM_PROMPT, display_name=doc_id
+        )
+    elif plan.action == PLAN_STREAM:
+        response_generator = astream_response(plan.history, plan.system_prompt)
+    else:
+        full_response = plan.text if plan.action == PLAN_ERROR else ""
+        response_generator = _single_event(plan_event(plan))
+
+    # Отправка ответа; этапы подготовки — событием timing до первой части
+    yield events.timing(timings.as_dict())
+    llm_started = time.perf_counter()
+    async for event in response_generator:
+        yield event
+        if event.type == CONTENT:
+            if not full_response:
+                timings.mark('first_token')
+                timings.record('llm_first_token', time.perf_counter() - llm_started)
+            full_response += event.data
+    if 'llm_first_token' in timings.stages:
+        timings.record('llm_stream', time.perf_counter() - llm_started)
+
+    if plan.sources:
+        yield events.sources(plan.sources)
+
+    finish_turn(current_session, full_response, timings)
+
+
+async def get_response(request: Request):
+    if not _is_authorized(request):
+        return RedirectResponse('/login', status_code=302)
+
+    try:
+        data = await request.json()
+        user_input = data.get('user_input')
+        doc_id = data.get('doc_id')
+        session_id = data.get('session_id')
+        category_doc_ids = data.get('category_doc_ids')
+
+        if not all([user_input, doc_id is not None, session_id]):
+            return Response(to_sse(events.error('Отсутствуют параметры')), media_type='text/event-stream')
+
+        return StreamingResponse(
+            asse_stream(aprocess_user_request(user_input, doc_id, session_id, category_doc_ids)),
+            media_type='text/event-stream'
+        )
+    except Exception as e:
+        traceback.print_exc()
+        return Response(to_sse(events.error(f'Ошибка: {e}')), media_type='text/event-stream')
+
+
+app = Starlette(routes=[
+    Route('/get_response', get_response, methods=['POST']),
+    Mount('/', app=WsgiToAsgi(flask_app)),
+])
@@ -10,6 +10,7 @@ from src.config import (
     DEV_MODE, HUB_AUTHORIZE_URL, HUB_TOKEN_URL, HUB_USERINFO_URL,
     HUB_CLIENT_ID, HUB_CLIENT_SECRET, HUB_REDIRECT_URI
 )
+from src.hub_client import hub_client
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -102,7 +103,7 @@ def callback():
 
     try:
         # Обмен кода на токены
-        token_response = requests.post(
+        token_response = hub_client.post(
             HUB_TOKEN_URL,
             data={
                 'grant_type': 'authorization_code',
@@ -111,8 +112,7 @@ def callback():
                 'client_id': HUB_CLIENT_ID,
                 'client_secret': HUB_CLIENT_SECRET,
             },
-            headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            timeout=10
+            headers={'Content-Type': 'application/x-www-form-urlencoded'}
         )
 
         if token_response.status_code != 200:
@@ -126,10 +126,9 @@ def callback():
             return "Ошибка: токен не получен", 400
 
         # Получение информации о пользователе
-        userinfo_response = requests.get(
+        userinfo_response = hub_client.get(
             HUB_USERINFO_URL,
-            headers={'Authorization': f'Bearer {access_token}'},
-            timeout=10
+            headers={'Authorization': f'Bearer {access_token}'}
         )
 
         if userinfo_response.status_code != 200:
@@ -0,0 +1,312 @@
+# cache.py - Кеши: LRU в памяти процесса + SQLite на диске (общий для воркеров)
+import os
+import sys
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+
+class LRUCache:
+    """Потокобезопасный LRU с ограничением по числу элементов"""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value) -> None:
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class ByteLRUCache(LRUCache):
+    """LRU с ограничением по суммарному размеру значений (байт)"""
+
+    def __init__(self, max_bytes: int, sizeof=sys.getsizeof, max_items: int = sys.maxsize):
+        super().__init__(max_items=max_items)
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self._sizes = {}
+
+    def set(self, key, value) -> None:
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+                self.total_bytes -= self._sizes.pop(key)
+            # Значение больше всего бюджета не кешируется
+            if size > self.max_bytes:
+                return
+            self._data[key] = value
+            self._sizes[key] = size
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes or len(self._data) > self.max_items:
+                old_key, _ = self._data.popitem(last=False)
+                self.total_bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+
+    def delete(self, key) -> None:
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.total_bytes -= self._sizes.pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+
+
+class SQLiteCache:
+    """Ключ-значение в SQLite (WAL), разделяемое процессами одного узла.
+
+    Соединение создаётся на поток и пересоздаётся после fork.
+    При превышении max_entries удаляются давно не читавшиеся записи,
+    при заданном ttl — ещё и устаревшие.
+    """
+
+    # Проверять лимит раз в столько записей
+    EVICT_EVERY = 64
+
+    def __init__(self, path, max_entries: int = 100_000, ttl: Optional[float] = None):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        # Удалено этим процессом: по TTL и сверх max_entries
+        self.expired = 0
+        self.evicted = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get_entries(self, keys: Iterable[str], max_age: Optional[float] = None) -> Dict[str, tuple]:
+        """key -> (value, created_at); записи старше max_age секунд не возвращаются"""
+        keys = list(keys)
+        if not keys:
+            return {}
+        conn = self._connect()
+        now = time.time()
+        placeholders = ",".join("?" * len(keys))
+        rows = conn.execute(
+            f"SELECT key, value, created_at FROM cache WHERE key IN ({placeholders})", keys
+        ).fetchall()
+
+        result = {key: (value, created_at) for key, value, created_at in rows
+                  if max_age is None or now - created_at <= max_age}
+        if result:
+            conn.executemany(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?",
+                [(now, key) for key in result]
+            )
+        return result
+
+    def get_many(self, keys: Iterable[str], max_age: Optional[float] = None) -> Dict[str, bytes]:
+        return {key: value for key, (value, _) in self.get_entries(keys, max_age).items()}
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[bytes]:
+        return self.get_many([key], max_age).get(key)
+
+    def set_many(self, items: Dict[str, bytes]) -> None:
+        if not items:
+            return
+        conn = self._connect()
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+            [(key, value, now, now) for key, value in items.items()]
+        )
+        with self._lock:
+            self._writes += len(items)
+            evict = self._writes >= self.EVICT_EVERY
+            if evict:
+                self._writes = 0
+        if evict:
+            self.evict()
+
+    def set(self, key: str, value: bytes) -> None:
+        self.set_many({key: value})
+
+    def delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def evict(self, max_age: Optional[float] = None) -> int:
+        """Удалить записи сверх max_entries (и старше max_age/ttl); вернуть число удалённых"""
+        conn = self._connect()
+        expired = evicted = 0
+        if max_age is None:
+            max_age = self.ttl
+        if max_age is not None:
+            expired = conn.execute(
+                "DELETE FROM cache WHERE created_at < ?", (time.time() - max_age,)
+            ).rowcount
+        overflow = self.count() - self.max_entries
+        if overflow > 0:
+            evicted = conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                " SELECT key FROM cache ORDER BY accessed_at LIMIT ?)", (overflow,)
+            ).rowcount
+        with self._lock:
+            self.expired += expired
+            self.evicted += evicted
+        return expired + evicted
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def total_bytes(self) -> int:
+        return self._connect().execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM cache").fetchone()[0]
+
+
+class CacheStats:
+    """Счётчики попаданий двухуровневого кеша"""
+
+    def __init__(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def add(self, memory_hits: int = 0, disk_hits: int = 0, misses: int = 0) -> None:
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+            self.misses += misses
+
+    def as_dict(self) -> dict:
+        total = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+        }
+
+
+class TwoTierCache:
+    """LRU процесса перед общим SQLite.
+
+    Значения на диске — bytes; encode/decode переводят их в объекты памяти.
+    Ошибки диска не мешают работе: кеш просто деградирует до LRU.
+    """
+
+    def __init__(self, name: str, directory, max_items: int, max_disk_entries: int,
+                 encode=None, decode=None, ttl: Optional[float] = None):
+        self.name = name
+        self.memory = LRUCache(max_items)
+        self.disk = SQLiteCache(
+            Path(directory) / f"{name}.sqlite3", max_disk_entries, ttl=ttl
+        ) if directory else None
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda blob: blob)
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    def _memory_get(self, key):
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        value, created_at = entry
+        if self.ttl is not None and time.time() - created_at > self.ttl:
+            return None
+        return value
+
+    def get_many(self, keys: List[str]) -> dict:
+        found = {}
+        for key in keys:
+            value = self._memory_get(key)
+            if value is not None:
+                found[key] = value
+        memory_hits = len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.disk is not None:
+            try:
+                for key, (blob, created_at) in self.disk.get_entries(missing, max_age=self.ttl).items():
+                    value = self.decode(blob)
+                    found[key] = value
+                    self.memory.set(key, (value, created_at))
+            except (sqlite3.Error, OSError) as e:
+                print(f"WARN: Кеш {self.name}: ошибка чтения SQLite: {e}")
+
+        self.stats.add(
+            memory_hits=memory_hits,
+            disk_hits=len(found) - memory_hits,
+            misses=len(keys) - len(found)
+        )
+        return found
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items: dict) -> None:
+        now = time.time()
+        for key, value in items.items():
+            self.memory.set(key, (value, now))
+        if self.disk is not None and items:
+            try:
+                self.disk.set_many({key: self.encode(value) for key, value in items.items()})
+            except (sqlite3.Error, OSError) as e:
+                print(f"WARN: Кеш {self.name}: ошибка записи SQLite: {e}")
+
+    def set(self, key: str, value) -> None:
+        self.set_many({key: value})
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.disk is not None:
+            try:
+                self.disk.delete(key)
+            except (sqlite3.Error, OSError) as e:
+                print(f"WARN: Кеш {self.name}: ошибка удаления из SQLite: {e}")
+
+    def stats_dict(self) -> dict:
+        return {'name': self.name, 'memory_items': len(self.memory), **self.stats.as_dict()}
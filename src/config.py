@@ -13,7 +13,11 @@ TEMPLATES_DIR = BASE_DIR / 'templates'
 TEXT_INSTRUCTIONS_DIR = STATIC_DIR / 'text_instructions'
 PDF_DATA_DIR = STATIC_DIR / 'data'
 VECTOR_STORE_DIR = STATIC_DIR / 'vector_store'
+# Бинарная (memmap) версия хранилища, собирается из VECTOR_STORE_DIR
+VECTOR_BINARY_DIR = Path(os.environ.get("VECTOR_BINARY_DIR", STATIC_DIR / 'vector_index'))
 MANIFEST_PATH = BASE_DIR / 'documents_manifest.json'
+# Локальные кеши (SQLite), общие для воркеров одного узла
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", BASE_DIR / '.cache'))
 
 # --- Flask ---
 SECRET_KEY = os.environ.get("FLASK_SECRET_KEY", "change-me-in-production")
@@ -25,6 +29,139 @@ PORT = int(os.environ.get("FLASK_PORT", 5001))
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
 GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL_NAME", "gemini-2.5-flash")
 EMBEDDING_MODEL = "text-embedding-004"
+# google — реальный API, fake — локальная замена (src/fake_gemini.py) для
+# разработки без ключа и нагрузочных замеров
+GEMINI_BACKEND = os.environ.get("GEMINI_BACKEND", "google").lower()
+FAKE_GEMINI_LATENCY_MS = int(os.environ.get("FAKE_GEMINI_LATENCY_MS", 0))
+FAKE_GEMINI_CHUNK_DELAY_MS = int(os.environ.get("FAKE_GEMINI_CHUNK_DELAY_MS", 0))
+# Хвост задержек и ошибки fake-клиента: доля медленных вызовов (+SLOW_MS к
+# задержке) и доля вызовов с ошибкой 503 — для проверки src/resilience.py
+FAKE_GEMINI_SLOW_RATE = float(os.environ.get("FAKE_GEMINI_SLOW_RATE", 0))
+FAKE_GEMINI_SLOW_MS = int(os.environ.get("FAKE_GEMINI_SLOW_MS", 0))
+FAKE_GEMINI_FAIL_RATE = float(os.environ.get("FAKE_GEMINI_FAIL_RATE", 0))
+# Имена моделей в ключах локальных кешей: результаты fake не смешиваются с настоящими
+_BACKEND_PREFIX = "" if GEMINI_BACKEND == "google" else f"{GEMINI_BACKEND}/"
+GEMINI_MODEL_KEY = f"{_BACKEND_PREFIX}{GEMINI_MODEL_NAME}"
+EMBEDDING_MODEL_KEY = f"{_BACKEND_PREFIX}{EMBEDDING_MODEL}"
+
+# Контекстный кеш Gemini для режима одного документа: полный текст документа
+# регистрируется у провайдера с TTL и продлевается, когда до истечения
+# остаётся меньше REFRESH_MARGIN секунд
+CONTEXT_CACHE_ENABLED = os.environ.get("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+CONTEXT_CACHE_TTL = int(os.environ.get("CONTEXT_CACHE_TTL", 3600))
+CONTEXT_CACHE_REFRESH_MARGIN = int(os.environ.get("CONTEXT_CACHE_REFRESH_MARGIN", 300))
+# Документы короче не кешируются (у API есть минимальный размер кеша)
+CONTEXT_CACHE_MIN_CHARS = int(os.environ.get("CONTEXT_CACHE_MIN_CHARS", 8000))
+# Пауза перед повторной попыткой после ошибки создания кеша
+CONTEXT_CACHE_RETRY_AFTER = int(os.environ.get("CONTEXT_CACHE_RETRY_AFTER", 600))
+
+# Кеш эмбеддингов: LRU в памяти процесса + SQLite в CACHE_DIR
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", 2048))
+EMBEDDING_CACHE_DISK_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_DISK_ENTRIES", 100_000))
+
+# Склейка эмбеддинг-запросов разных потоков: промахи кеша, пришедшие в пределах
+# окна, уходят одним вызовом embed_content (0 — каждый запрос отдельно).
+# MAX_TEXTS — предел текстов в одном вызове API, CONCURRENCY — вызовов в полёте
+EMBEDDING_BATCH_WINDOW_MS = float(os.environ.get("EMBEDDING_BATCH_WINDOW_MS", 5))
+EMBEDDING_BATCH_MAX_TEXTS = int(os.environ.get("EMBEDDING_BATCH_MAX_TEXTS", 100))
+EMBEDDING_BATCH_CONCURRENCY = int(os.environ.get("EMBEDDING_BATCH_CONCURRENCY", 4))
+
+# Кеш расширений запроса (TTL в секундах)
+QUERY_EXPANSION_CACHE_ENABLED = os.environ.get("QUERY_EXPANSION_CACHE_ENABLED", "true").lower() == "true"
+QUERY_EXPANSION_CACHE_TTL = int(os.environ.get("QUERY_EXPANSION_CACHE_TTL", 7 * 24 * 3600))
+QUERY_EXPANSION_CACHE_SIZE = int(os.environ.get("QUERY_EXPANSION_CACHE_SIZE", 1024))
+QUERY_EXPANSION_CACHE_DISK_ENTRIES = int(os.environ.get("QUERY_EXPANSION_CACHE_DISK_ENTRIES", 20_000))
+
+# Текст документов для режима одного документа: файлы в CACHE_DIR/doc_text
+# и LRU в памяти с бюджетом в байтах
+DOC_TEXT_CACHE_ENABLED = os.environ.get("DOC_TEXT_CACHE_ENABLED", "true").lower() == "true"
+DOC_TEXT_CACHE_BYTES = int(os.environ.get("DOC_TEXT_CACHE_BYTES", 64 * 1024 * 1024))
+# Извлечь текст всех документов манифеста в фоне при старте
+DOC_TEXT_WARMUP = os.environ.get("DOC_TEXT_WARMUP", "true").lower() == "true"
+
+# --- Роутер документов ---
+# Локальный выбор документов по эмбеддингам; LLM — только при низкой уверенности
+ROUTER_MIN_SCORE = float(os.environ.get("ROUTER_MIN_SCORE", 0.45))
+ROUTER_CONFIDENCE = float(os.environ.get("ROUTER_CONFIDENCE", 0.55))
+ROUTER_MARGIN = float(os.environ.get("ROUTER_MARGIN", 0.05))
+ROUTER_MAX_DOCS = int(os.environ.get("ROUTER_MAX_DOCS", 3))
+ROUTER_LLM_FALLBACK = os.environ.get("ROUTER_LLM_FALLBACK", "true").lower() == "true"
+
+# --- Детектор уточняющих вопросов ---
+# Близость эмбеддингов нового и прежнего вопроса: выше REUSE — тот же контекст,
+# ниже NEW (и без общих слов) — новый поиск, между ними решает LLM
+FOLLOWUP_REUSE_SIMILARITY = float(os.environ.get("FOLLOWUP_REUSE_SIMILARITY", 0.85))
+FOLLOWUP_NEW_SIMILARITY = float(os.environ.get("FOLLOWUP_NEW_SIMILARITY", 0.6))
+FOLLOWUP_SHORT_TOKENS = int(os.environ.get("FOLLOWUP_SHORT_TOKENS", 4))
+
+# --- Устойчивость коротких вызовов Gemini (src/resilience.py) ---
+# Эмбеддинги, роутер, расширение запроса: срок вызова (с) и потоки для них
+GEMINI_CALL_DEADLINE = float(os.environ.get("GEMINI_CALL_DEADLINE", 10))
+GEMINI_CALL_WORKERS = int(os.environ.get("GEMINI_CALL_WORKERS", 32))
+# Попыток на вызов (с первой) и база экспоненциальной паузы с джиттером
+GEMINI_RETRY_ATTEMPTS = int(os.environ.get("GEMINI_RETRY_ATTEMPTS", 2))
+GEMINI_RETRY_BASE_MS = int(os.environ.get("GEMINI_RETRY_BASE_MS", 200))
+# Хедж — повтор медленного вызова после p95 (пока замеров мало — после AFTER_MS),
+# не раньше MIN_MS и не больше BUDGET от числа вызовов
+GEMINI_HEDGE_ENABLED = os.environ.get("GEMINI_HEDGE_ENABLED", "true").lower() == "true"
+GEMINI_HEDGE_AFTER_MS = int(os.environ.get("GEMINI_HEDGE_AFTER_MS", 1500))
+GEMINI_HEDGE_MIN_MS = int(os.environ.get("GEMINI_HEDGE_MIN_MS", 100))
+GEMINI_HEDGE_BUDGET = float(os.environ.get("GEMINI_HEDGE_BUDGET", 0.1))
+# Предохранитель: после стольких ошибок подряд необязательные этапы
+# пропускаются на COOLDOWN секунд (0 — выключен)
+GEMINI_BREAKER_FAILURES = int(os.environ.get("GEMINI_BREAKER_FAILURES", 5))
+GEMINI_BREAKER_COOLDOWN = float(os.environ.get("GEMINI_BREAKER_COOLDOWN", 30))
+
+# --- Сессии чата ---
+# sqlite — общее хранилище воркеров узла (CACHE_DIR), memory — память процесса
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite").lower()
+# Сессия удаляется через столько секунд без сообщений
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 24 * 3600))
+SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", 10_000))
+# Только для memory: лимит суммарного размера сессий (байт JSON)
+SESSION_MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", 256 * 1024 * 1024))
+
+# --- Пайплайн ---
+# Потоки для параллельных этапов подготовки контекста (общие на процесс)
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", 16))
+
+# --- Стрим ответа (SSE) ---
+# Части ответа, пришедшие в пределах окна, отправляются одним кадром
+# (первая часть — сразу); 0 — каждая часть отдельным кадром
+SSE_COALESCE_MS = int(os.environ.get("SSE_COALESCE_MS", 50))
+SSE_COALESCE_MAX_CHARS = int(os.environ.get("SSE_COALESCE_MAX_CHARS", 4096))
+# Комментарий-heartbeat, если стрим молчит дольше стольких секунд (0 — выключен):
+# прокси не закрывают соединение, пока идёт подготовка ответа
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", 15))
+# Потоки, читающие события WSGI-стримов (со склейкой или heartbeat); когда все
+# заняты, стрим читается потоком запроса без heartbeat
+SSE_PUMP_WORKERS = int(os.environ.get("SSE_PUMP_WORKERS", 16))
+
+# --- Метрики (/metrics, src/metrics.py) ---
+# Снимки счётчиков воркеров: /metrics суммирует все свежие (пусто — только
+# свой процесс). Снимок пишется раз в FLUSH_INTERVAL секунд; старше STALE —
+# воркер завершён, снимок не учитывается и удаляется
+METRICS_DIR = os.environ.get("METRICS_DIR", str(CACHE_DIR / 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+METRICS_STALE = float(os.environ.get("METRICS_STALE", 60))
+# Bearer-токен для /metrics (пусто — без проверки; наружу закрыт в nginx)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# --- Профилирование /get_response (src/profiler.py) ---
+# Стеки потоков запроса снимаются раз в INTERVAL_MS. SLOW_MS > 0 — запрос без
+# ответа дольше SLOW_MS (до первой части ответа или до конца) сэмплируется с
+# этого момента и сохраняется автоматически (0 — только по заголовку X-Profile
+# и переключателю в админке)
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", CACHE_DIR / 'profiles'))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 20))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 0))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 50))
+
+# --- Запись трафика для нагрузочных прогонов (src/traffic.py) ---
+# Форма запросов /get_response без текста (вид, шаг предписания, документ,
+# время) для benchmarks/replay.py. Пусто — не записывать
+TRAFFIC_RECORD_DIR = os.environ.get("TRAFFIC_RECORD_DIR", "")
 
 # --- OAuth2 (Hub) ---
 HUB_BASE_URL = os.environ.get("HUB_BASE_URL", "https://ai-hub.svrd.ru")
@@ -41,5 +178,14 @@ HUB_REDIRECT_URI = f"{APP_BASE_URL}/auth/callback"
 # Hub Admin API (для получения данных пользователей)
 HUB_API_URL = f"{HUB_BASE_URL}/api"
 
+# Клиент Hub: keep-alive пул соединений, таймаут запроса (с) и кеш GET-ответов
+# Admin API: TTL свежести и сколько ещё секунд отдавать устаревший ответ,
+# обновляя его в фоне
+HUB_TIMEOUT = float(os.environ.get("HUB_TIMEOUT", 10))
+HUB_POOL_SIZE = int(os.environ.get("HUB_POOL_SIZE", 16))
+HUB_CACHE_TTL = float(os.environ.get("HUB_CACHE_TTL", 30))
+HUB_CACHE_STALE = float(os.environ.get("HUB_CACHE_STALE", 300))
+HUB_CACHE_MAX_ENTRIES = int(os.environ.get("HUB_CACHE_MAX_ENTRIES", 1024))
+
 # Режим разработки
 DEV_MODE = os.environ.get("DEV_MODE", "false").lower() == "true"
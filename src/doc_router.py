@@ -0,0 +1,201 @@
+# doc_router.py - Локальный роутер документов по эмбеддингам
+#
+# Описания из манифеста эмбеддятся один раз и хранятся рядом с бинарным
+# индексом (router.npy + router.json). Заголовки TOC уже имеют эмбеддинги
+# в векторном индексе. Запрос сравнивается с обоими векторизованно.
+#
+# Предварительная сборка: python -m src.doc_router build
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from src.config import (
+    VECTOR_BINARY_DIR, MANIFEST_PATH, EMBEDDING_MODEL_KEY,
+    ROUTER_MIN_SCORE, ROUTER_MARGIN, ROUTER_MAX_DOCS
+)
+from src.gemini_client import embed_texts
+from src.vector_index import VectorIndex, get_vector_index, normalize_rows
+
+ROUTER_VECTORS_FILE = 'router.npy'
+ROUTER_META_FILE = 'router.json'
+
+# Вес описания документа относительно лучшего совпадения с заголовком TOC
+DESCRIPTION_WEIGHT = 0.5
+
+# Пауза перед повторной попыткой построить роутер после ошибки
+RETRY_INTERVAL = 60.0
+
+
+def _entry_text(doc: dict) -> str:
+    return f"{doc['name']}. {doc.get('description', '')}".strip()
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _routable_entries(manifest: List[dict]) -> List[Tuple[str, str]]:
+    return [(d['id'], _entry_text(d)) for d in manifest if d.get('id') and d['id'] != '0']
+
+
+class DocumentRouter:
+    """Выбор документов по близости запроса к описаниям и заголовкам TOC"""
+
+    def __init__(self, doc_ids: List[str], desc_matrix: np.ndarray, index: VectorIndex):
+        self.doc_ids = doc_ids
+        self.desc_matrix = desc_matrix
+        self.index = index
+
+        positions = {doc_id: i for i, doc_id in enumerate(index.doc_ids)}
+        # Строка роутера -> документ индекса (-1: векторов нет, искать нечего)
+        self._index_pos = np.array([positions.get(d, -1) for d in doc_ids], dtype=np.int64)
+        self._has_toc = np.array([
+            pos >= 0 and index.toc_ranges[index.doc_ids[pos]][1] > index.toc_ranges[index.doc_ids[pos]][0]
+            for pos in self._index_pos
+        ], dtype=bool)
+
+    def score(self, query_embedding) -> np.ndarray:
+        """Оценка каждого документа манифеста для запроса"""
+        query = normalize_rows(query_embedding)[0]
+        desc_scores = self.desc_matrix @ query
+
+        toc_best = np.full(len(self.index.doc_ids), -1.0, dtype=np.float32)
+        if len(self.index.toc_sections):
+            np.maximum.at(toc_best, self.index.toc_doc, self.index.toc_matrix @ query)
+        toc_scores = toc_best[np.maximum(self._index_pos, 0)] if len(toc_best) else np.zeros(len(self.doc_ids))
+
+        scores = np.where(
+            self._has_toc,
+            DESCRIPTION_WEIGHT * desc_scores + (1 - DESCRIPTION_WEIGHT) * toc_scores,
+            desc_scores
+        )
+        scores[self._index_pos < 0] = -np.inf
+        return scores
+
+    def route(self, query_embedding) -> Tuple[List[str], float]:
+        """Документы в пределах ROUTER_MARGIN от лучшего и лучшая оценка.
+
+        Лучший документ возвращается всегда (если у него есть векторы);
+        ROUTER_MIN_SCORE ограничивает только добавление остальных.
+        """
+        scores = self.score(query_embedding)
+        if not len(scores):
+            return [], 0.0
+
+        order = np.argsort(-scores)
+        best = float(scores[order[0]])
+        if not np.isfinite(best):
+            return [], 0.0
+        cutoff = max(best - ROUTER_MARGIN, ROUTER_MIN_SCORE)
+        selected = [self.doc_ids[order[0]]]
+        selected += [self.doc_ids[i] for i in order[1:ROUTER_MAX_DOCS] if scores[i] >= cutoff]
+        return selected, best
+
+
+def _read_cached(directory: Path) -> Tuple[dict, Optional[np.ndarray]]:
+    try:
+        with open(directory / ROUTER_META_FILE, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return meta, np.load(directory / ROUTER_VECTORS_FILE)
+    except (OSError, ValueError):
+        return {}, None
+
+
+def _write_cached(directory: Path, doc_ids: List[str], hashes: List[str], matrix: np.ndarray) -> None:
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_vectors = directory / (ROUTER_VECTORS_FILE + '.tmp')
+        with open(tmp_vectors, 'wb') as f:
+            np.save(f, matrix)
+        tmp_vectors.replace(directory / ROUTER_VECTORS_FILE)
+
+        tmp_meta = directory / (ROUTER_META_FILE + '.tmp')
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump({'model': EMBEDDING_MODEL_KEY, 'doc_ids': doc_ids, 'hashes': hashes}, f, ensure_ascii=False)
+        tmp_meta.replace(directory / ROUTER_META_FILE)
+    except OSError as e:
+        print(f"WARN: Не удалось сохранить эмбеддинги роутера: {e}")
+
+
+def load_router(
+    manifest: List[dict],
+    index: VectorIndex,
+    directory=VECTOR_BINARY_DIR,
+    force: bool = False
+) -> Optional[DocumentRouter]:
+    """Построить роутер; эмбеддятся только новые или изменённые описания"""
+    directory = Path(directory)
+    entries = _routable_entries(manifest)
+    if not entries:
+        return None
+
+    doc_ids = [doc_id for doc_id, _ in entries]
+    hashes = [_text_hash(text) for _, text in entries]
+
+    cached_rows = {}
+    if not force:
+        meta, cached = _read_cached(directory)
+        if cached is not None and meta.get('model') == EMBEDDING_MODEL_KEY:
+            for row, (doc_id, text_hash) in enumerate(zip(meta.get('doc_ids', []), meta.get('hashes', []))):
+                cached_rows[(doc_id, text_hash)] = cached[row]
+
+    missing = [i for i, key in enumerate(zip(doc_ids, hashes)) if key not in cached_rows]
+    if missing:
+        embeddings = embed_texts([entries[i][1] for i in missing])
+        if len(embeddings) != len(missing):
+            return None
+        for i, emb in zip(missing, embeddings):
+            cached_rows[(doc_ids[i], hashes[i])] = np.asarray(emb, dtype=np.float32)
+
+    matrix = normalize_rows([cached_rows[key] for key in zip(doc_ids, hashes)])
+    if missing:
+        _write_cached(directory, doc_ids, hashes, matrix)
+        print(f"INFO: Роутер: эмбеддинги описаний обновлены ({len(missing)} шт.)")
+
+    return DocumentRouter(doc_ids, matrix, index)
+
+
+_router: Optional[DocumentRouter] = None
+_router_failed_at: Optional[float] = None
+_router_lock = threading.Lock()
+
+
+def get_document_router(manifest: List[dict]) -> Optional[DocumentRouter]:
+    """Роутер процесса; None, если эмбеддинги описаний недоступны"""
+    global _router, _router_failed_at
+    retry_due = _router_failed_at is None or time.monotonic() - _router_failed_at >= RETRY_INTERVAL
+    if _router is None and retry_due:
+        with _router_lock:
+            if _router is None:
+                _router = load_router(manifest, get_vector_index())
+                if _router is None:
+                    _router_failed_at = time.monotonic()
+    return _router
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Эмбеддинги локального роутера документов")
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--output', default=str(VECTOR_BINARY_DIR), help="Каталог бинарного хранилища")
+    args = parser.parse_args(argv)
+
+    with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    router = load_router(manifest, get_vector_index(), args.output, force=True)
+    if router is None:
+        print("ОШИБКА: Не удалось получить эмбеддинги описаний документов")
+        return 1
+    print(f"OK: Роутер построен для {len(router.doc_ids)} документов")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+# doc_text.py - Кеш извлечённого текста документов (режим одного документа)
+#
+# Текст DOCX разбирается один раз и сохраняется в CACHE_DIR/doc_text:
+#   {имя файла}.txt   - текст норматива
+#   {имя файла}.json  - отпечаток исходника: mtime_ns, size, sha256, версия формата
+# Актуальность проверяется по mtime и размеру; если изменился только mtime
+# (файл перезаписан тем же содержимым), сверяется sha256 и текст не
+# разбирается заново. Поверх файлов — LRU в памяти с бюджетом в байтах.
+#
+# Запуск прогрева: python -m src.doc_text warm
+import os
+import sys
+import json
+import argparse
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from src.config import (
+    CACHE_DIR, TEXT_INSTRUCTIONS_DIR, DOC_TEXT_CACHE_ENABLED, DOC_TEXT_CACHE_BYTES
+)
+from src.cache import ByteLRUCache, CacheStats
+from src.vector_store import file_sha256, write_atomic
+
+DOC_TEXT_DIR = CACHE_DIR / 'doc_text'
+FORMAT_VERSION = 1
+START_MARKER = "<<ТЕКСТ НОРМАТИВА НАЧАЛО>>"
+
+# filepath -> (text, (mtime_ns, size))
+_memory = ByteLRUCache(DOC_TEXT_CACHE_BYTES, sizeof=lambda entry: sys.getsizeof(entry[0]))
+stats = CacheStats()
+
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+def _reset_locks_after_fork() -> None:
+    # Прогрев мог идти в мастере gunicorn (preload_app) во время fork:
+    # захваченные им блокировки в дочернем процессе не освободятся
+    global _file_locks, _file_locks_guard
+    _file_locks = {}
+    _file_locks_guard = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+def extract_docx_text(filepath) -> str:
+    """Текст DOCX после маркера начала норматива"""
+    import docx
+    document = docx.Document(filepath)
+    full_text = '\n'.join(p.text for p in document.paragraphs)
+
+    marker_pos = full_text.find(START_MARKER)
+    if marker_pos != -1:
+        full_text = full_text[marker_pos + len(START_MARKER):]
+    return full_text.strip()
+
+
+def _file_lock(filepath: str) -> threading.Lock:
+    with _file_locks_guard:
+        return _file_locks.setdefault(filepath, threading.Lock())
+
+
+def _sidecar_paths(filepath: str):
+    name = os.path.basename(filepath)
+    return DOC_TEXT_DIR / f"{name}.txt", DOC_TEXT_DIR / f"{name}.json"
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    write_atomic(path, lambda f: f.write(data))
+
+
+def _read_sidecar(filepath: str, st: os.stat_result) -> Optional[str]:
+    """Текст из файлов кеша, если они соответствуют исходнику"""
+    text_path, meta_path = _sidecar_paths(filepath)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('format_version') != FORMAT_VERSION or meta.get('size') != st.st_size:
+        return None
+    if meta.get('mtime_ns') != st.st_mtime_ns:
+        if meta.get('sha256') != file_sha256(filepath):
+            return None
+        meta['mtime_ns'] = st.st_mtime_ns
+        try:
+            _write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+        except OSError as e:
+            print(f"WARN: Кеш текста: не удалось обновить {meta_path.name}: {e}")
+
+    try:
+        return text_path.read_text(encoding='utf-8')
+    except OSError:
+        return None
+
+
+def _write_sidecar(filepath: str, st: os.stat_result, text: str) -> None:
+    """Записать текст и отпечаток; отпечаток пишется последним"""
+    text_path, meta_path = _sidecar_paths(filepath)
+    DOC_TEXT_DIR.mkdir(parents=True, exist_ok=True)
+    _write_atomic(text_path, text.encode('utf-8'))
+    _write_atomic(meta_path, json.dumps({
+        'format_version': FORMAT_VERSION,
+        'source': os.path.basename(filepath),
+        'mtime_ns': st.st_mtime_ns,
+        'size': st.st_size,
+        'sha256': file_sha256(filepath),
+    }).encode('utf-8'))
+
+
+def _parse_and_store(filepath: str, st: os.stat_result) -> str:
+    text = extract_docx_text(filepath)
+    try:
+        _write_sidecar(filepath, st, text)
+    except OSError as e:
+        print(f"WARN: Кеш текста: не удалось записать {os.path.basename(filepath)}: {e}")
+    return text
+
+
+def get_document_text(filepath) -> str:
+    """Текст документа: память -> файл кеша -> разбор DOCX"""
+    filepath = str(filepath)
+    if not DOC_TEXT_CACHE_ENABLED:
+        return extract_docx_text(filepath)
+
+    st = os.stat(filepath)
+    signature = (st.st_mtime_ns, st.st_size)
+
+    entry = _memory.get(filepath)
+    if entry is not None and entry[1] == signature:
+        stats.add(memory_hits=1)
+        return entry[0]
+
+    # Один разбор на файл, даже если документ запрошен одновременно
+    with _file_lock(filepath):
+        entry = _memory.get(filepath)
+        if entry is not None and entry[1] == signature:
+            stats.add(memory_hits=1)
+            return entry[0]
+
+        text = _read_sidecar(filepath, st)
+        if text is not None:
+            stats.add(disk_hits=1)
+        else:
+            text = _parse_and_store(filepath, st)
+            stats.add(misses=1)
+        _memory.set(filepath, (text, signature))
+    return text
+
+
+def document_paths(documents: List[dict]) -> List[str]:
+    """Пути к существующим DOCX документов манифеста"""
+    paths = []
+    for doc in documents:
+        filename = doc.get('filename')
+        if filename and filename.endswith('.docx'):
+            path = os.path.join(TEXT_INSTRUCTIONS_DIR, filename)
+            if os.path.exists(path):
+                paths.append(path)
+    return paths
+
+
+def warm_document_texts(filepaths: List[str]) -> int:
+    """Подготовить файлы кеша (в память не загружаются); вернуть число разобранных"""
+    parsed = 0
+    for filepath in filepaths:
+        try:
+            with _file_lock(filepath):
+                st = os.stat(filepath)
+                if _read_sidecar(filepath, st) is None:
+                    _parse_and_store(filepath, st)
+                    parsed += 1
+        except Exception as e:
+            print(f"WARN: Кеш текста: {os.path.basename(filepath)}: {e}")
+    if parsed:
+        print(f"INFO: Кеш текста документов: разобрано {parsed} из {len(filepaths)}")
+    return parsed
+
+
+def start_warmup(documents: List[dict]) -> Optional[threading.Thread]:
+    """Прогрев файлов кеша в фоновом потоке"""
+    if not DOC_TEXT_CACHE_ENABLED:
+        return None
+    thread = threading.Thread(
+        target=warm_document_texts, args=(document_paths(documents),),
+        name='doc-text-warmup', daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def stats_dict() -> dict:
+    return {
+        'name': 'doc_text',
+        'memory_items': len(_memory),
+        'memory_bytes': _memory.total_bytes,
+        **stats.as_dict()
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Кеш текста документов")
+    parser.add_argument('command', choices=['warm'])
+    parser.parse_args(argv)
+
+    from src.rag import get_document_metadata
+    paths = document_paths(get_document_metadata())
+    warm_document_texts(paths)
+    print(f"INFO: Кеш текста документов актуален ({len(paths)} шт.): {DOC_TEXT_DIR}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
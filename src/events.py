@@ -0,0 +1,297 @@
+# events.py - События стрима ответа и их отправка по SSE
+#
+# Генерация (gemini_client) и обработка запроса (routes, asgi) передают друг
+# другу события StreamEvent; в строки "data: {json}" они превращаются один
+# раз — в sse_stream / asse_stream на границе HTTP. Там же части ответа,
+# пришедшие в пределах SSE_COALESCE_MS, склеиваются в один кадр, а в паузах
+# длиннее SSE_HEARTBEAT_INTERVAL отправляется комментарий ": ping".
+#
+# В WSGI события читает поток из пула SSE_PUMP_WORKERS (постоянные потоки:
+# их соединения SQLite с кешами и сессиями переиспользуются между запросами),
+# а поток запроса ждёт их с таймаутом. Если свободных потоков нет, события
+# читает сам поток запроса: склейка остаётся, heartbeat — нет.
+import os
+import json
+import time
+import queue
+import asyncio
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, List, NamedTuple, Optional
+
+from src.config import SSE_COALESCE_MS, SSE_COALESCE_MAX_CHARS, SSE_HEARTBEAT_INTERVAL, SSE_PUMP_WORKERS
+
+CONTENT = 'content'
+ERROR = 'error'
+SOURCES = 'sources'
+STATUS = 'status'
+# Длительности этапов подготовки ответа (мс), до первой части ответа
+TIMING = 'timing'
+
+# Комментарий SSE: клиент его игнорирует, прокси видят активность
+HEARTBEAT = ": ping\n\n"
+
+
+class StreamEvent(NamedTuple):
+    type: str
+    data: Any
+
+
+def content(text: str) -> StreamEvent:
+    return StreamEvent(CONTENT, text)
+
+
+def error(message: str) -> StreamEvent:
+    return StreamEvent(ERROR, message)
+
+
+def sources(items: List[dict]) -> StreamEvent:
+    return StreamEvent(SOURCES, items)
+
+
+def status(stage: str) -> StreamEvent:
+    return StreamEvent(STATUS, stage)
+
+
+def timing(stages: dict) -> StreamEvent:
+    return StreamEvent(TIMING, stages)
+
+
+def to_sse(event: StreamEvent) -> str:
+    return f"data: {json.dumps({'type': event.type, 'data': event.data})}\n\n"
+
+
+class FrameWriter:
+    """Кадры SSE из событий: склейка content и heartbeat.
+
+    Часть ответа уходит сразу, если с прошлого кадра прошло не меньше окна
+    (поэтому первый токен не задерживается); иначе копится до конца окна
+    или до max_chars. Любое другое событие сначала выталкивает накопленное.
+    """
+
+    def __init__(self, window: float, max_chars: int, heartbeat: float):
+        self.window = window
+        self.max_chars = max_chars
+        self.heartbeat = heartbeat
+        self._parts = []
+        self._size = 0
+        self._next_frame = 0.0
+        self._last_write = time.monotonic()
+
+    def timeout(self, now: float) -> Optional[float]:
+        """Сколько можно ждать следующего события (None — без ограничения)"""
+        deadlines = []
+        if self._parts:
+            deadlines.append(self._next_frame)
+        if self.heartbeat > 0:
+            deadlines.append(self._last_write + self.heartbeat)
+        return max(0.0, min(deadlines) - now) if deadlines else None
+
+    def _flush(self, now: float) -> List[str]:
+        if not self._parts:
+            return []
+        frame = to_sse(content(''.join(self._parts)))
+        self._parts = []
+        self._size = 0
+        self._next_frame = now + self.window
+        return [frame]
+
+    def _write(self, frames: List[str], now: float) -> str:
+        if frames:
+            self._last_write = now
+        return ''.join(frames)
+
+    def event(self, event: StreamEvent, now: float) -> str:
+        if event.type != CONTENT:
+            return self._write(self._flush(now) + [to_sse(event)], now)
+        self._parts.append(event.data)
+        self._size += len(event.data)
+        if now >= self._next_frame or self._size >= self.max_chars:
+            return self._write(self._flush(now), now)
+        return ''
+
+    def idle(self, now: float) -> str:
+        """Событий не было до timeout(): накопленное или heartbeat"""
+        if self._parts and now >= self._next_frame:
+            return self._write(self._flush(now), now)
+        if self.heartbeat > 0 and now - self._last_write >= self.heartbeat:
+            return self._write([HEARTBEAT], now)
+        return ''
+
+    def finish(self, now: float) -> str:
+        return self._write(self._flush(now), now)
+
+
+_DONE = object()
+
+
+def _pump_failed(e: BaseException) -> StreamEvent:
+    print(f"ОШИБКА: Стрим ответа прерван: {e}")
+    traceback.print_exc()
+    return error(f'Ошибка: {e}')
+
+
+def _close(events: Iterator[StreamEvent]) -> None:
+    close = getattr(events, 'close', None)
+    if close:
+        close()
+
+
+class PumpPool:
+    """Потоки чтения событий WSGI-стримов процесса; занятые не ждут в очереди"""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._busy = 0
+
+    def _ensure_started(self) -> None:
+        # Пул создаётся в процессе, который его использует: после fork
+        # (preload_app в gunicorn) потоки мастера в воркере не существуют
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sse-pump')
+            self._busy = 0
+            self._pid = os.getpid()
+
+    def try_submit(self, fn: Callable[[], None]) -> bool:
+        """Запустить fn в свободном потоке; False — свободных нет"""
+        if self.max_workers <= 0:
+            return False
+        self._ensure_started()
+        with self._lock:
+            if self._busy >= self.max_workers:
+                return False
+            self._busy += 1
+            pid = self._pid
+            future = self._executor.submit(fn)
+        future.add_done_callback(lambda _: self._release(pid))
+        return True
+
+    def _release(self, pid: int) -> None:
+        with self._lock:
+            if pid == self._pid:
+                self._busy -= 1
+
+
+pump_pool = PumpPool(SSE_PUMP_WORKERS)
+
+
+def _inline_stream(events: Iterator[StreamEvent], writer: Optional[FrameWriter]) -> Iterator[str]:
+    """События в потоке запроса: склейка по приходу событий, без heartbeat"""
+    try:
+        for event in events:
+            chunk = to_sse(event) if writer is None else writer.event(event, time.monotonic())
+            if chunk:
+                yield chunk
+        if writer is not None:
+            chunk = writer.finish(time.monotonic())
+            if chunk:
+                yield chunk
+    finally:
+        _close(events)
+
+
+def sse_stream(
+    events: Iterator[StreamEvent],
+    coalesce_ms: int = SSE_COALESCE_MS,
+    heartbeat: float = SSE_HEARTBEAT_INTERVAL,
+    max_chars: int = SSE_COALESCE_MAX_CHARS
+) -> Iterator[str]:
+    """Строки SSE для WSGI-ответа.
+
+    Со склейкой или heartbeat события читает поток пула, поток запроса ждёт
+    их с таймаутом. После отключения клиента следующее событие (в том числе
+    стрим Gemini после события timing) уже не запрашивается.
+    """
+    if coalesce_ms <= 0 and heartbeat <= 0:
+        yield from _inline_stream(events, None)
+        return
+
+    items = queue.SimpleQueue()
+    stopped = threading.Event()
+
+    def pump():
+        try:
+            while not stopped.is_set():
+                event = next(events, _DONE)
+                if event is _DONE:
+                    break
+                items.put(event)
+        except Exception as e:
+            items.put(_pump_failed(e))
+        finally:
+            _close(events)
+            items.put(_DONE)
+
+    writer = FrameWriter(coalesce_ms / 1000, max_chars, heartbeat)
+    if not pump_pool.try_submit(pump):
+        yield from _inline_stream(events, writer)
+        return
+    try:
+        while True:
+            try:
+                item = items.get(timeout=writer.timeout(time.monotonic()))
+            except queue.Empty:
+                item = None
+            now = time.monotonic()
+            if item is _DONE:
+                chunk = writer.finish(now)
+                if chunk:
+                    yield chunk
+                return
+            chunk = writer.idle(now) if item is None else writer.event(item, now)
+            if chunk:
+                yield chunk
+    finally:
+        stopped.set()
+
+
+async def asse_stream(
+    events: AsyncIterator[StreamEvent],
+    coalesce_ms: int = SSE_COALESCE_MS,
+    heartbeat: float = SSE_HEARTBEAT_INTERVAL,
+    max_chars: int = SSE_COALESCE_MAX_CHARS
+) -> AsyncIterator[str]:
+    """Строки SSE для ASGI-ответа; при отмене отменяется и генерация"""
+    if coalesce_ms <= 0 and heartbeat <= 0:
+        async for event in events:
+            yield to_sse(event)
+        return
+
+    items = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for event in events:
+                items.put_nowait(event)
+        except Exception as e:
+            items.put_nowait(_pump_failed(e))
+        finally:
+            items.put_nowait(_DONE)
+
+    task = asyncio.create_task(pump())
+    writer = FrameWriter(coalesce_ms / 1000, max_chars, heartbeat)
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(items.get(), writer.timeout(time.monotonic()))
+            except asyncio.TimeoutError:
+                item = None
+            now = time.monotonic()
+            if item is _DONE:
+                chunk = writer.finish(now)
+                if chunk:
+                    yield chunk
+                return
+            chunk = writer.idle(now) if item is None else writer.event(item, now)
+            if chunk:
+                yield chunk
+    finally:
+        task.cancel()
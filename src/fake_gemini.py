@@ -0,0 +1,363 @@
+# fake_gemini.py - Локальная замена клиента google-genai (GEMINI_BACKEND=fake)
+#
+# Повторяет ту часть API, которой пользуется gemini_client: models.generate_content,
+# models.generate_content_stream, models.embed_content (и их async-версии в
+# aio.models) и caches (create/get/update/delete) с TTL. Сеть не нужна:
+# эмбеддинги детерминированы (хешированный мешок слов), ответы — шаблонные.
+# Время берётся из clock, поэтому истечение кешей можно проверять без ожидания.
+# slow_rate/slow_latency добавляют хвост задержек: доля вызовов отвечает дольше.
+import re
+import math
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+EMBEDDING_DIMENSIONS = 768
+STREAM_CHUNK_WORDS = 3
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class FakeAPIError(Exception):
+    """Ошибка API с HTTP-кодом, как в google.genai.errors"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.message = message
+
+
+def _config_value(config, key: str, default=None):
+    """Поле конфига: dict или pydantic-объект google.genai.types"""
+    if config is None:
+        return default
+    if isinstance(config, dict):
+        return config.get(key, default)
+    value = getattr(config, key, None)
+    return default if value is None else value
+
+
+def _parse_ttl(ttl) -> float:
+    if ttl is None:
+        return 3600.0
+    if isinstance(ttl, (int, float)):
+        return float(ttl)
+    return float(str(ttl).rstrip('s'))
+
+
+def _contents_text(contents) -> str:
+    """Весь текст из contents: строки, dict с parts или объекты Content"""
+    if contents is None:
+        return ''
+    if isinstance(contents, str):
+        return contents
+    texts = []
+    for item in contents:
+        if isinstance(item, str):
+            texts.append(item)
+            continue
+        parts = _config_value(item, 'parts', [])
+        for part in parts:
+            text = _config_value(part, 'text')
+            if text:
+                texts.append(text)
+    return '\n'.join(texts)
+
+
+def _token_count(text: str) -> int:
+    return max(1, len(text) // 4) if text else 0
+
+
+def fake_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> list:
+    """Нормализованный хешированный мешок слов: близкие тексты дают близкие векторы"""
+    vector = [0.0] * dimensions
+    for word in _WORD_RE.findall(text.lower()):
+        digest = hashlib.md5(word.encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector))
+    if not norm:
+        vector[0] = norm = 1.0
+    return [v / norm for v in vector]
+
+
+def _default_schema_value(annotation):
+    origin = getattr(annotation, '__origin__', None)
+    if annotation is bool:
+        return True
+    if annotation in (int, float):
+        return annotation(0)
+    if annotation is str:
+        return ''
+    if origin in (list, tuple, set):
+        return []
+    return None
+
+
+def fake_parsed(schema):
+    """Экземпляр pydantic-схемы со значениями по умолчанию для типов полей"""
+    values = {
+        name: _default_schema_value(field.annotation)
+        for name, field in schema.model_fields.items()
+        if field.is_required()
+    }
+    return schema(**values)
+
+
+class FakeCachedContent:
+    def __init__(self, name, model, display_name, contents_text, system_instruction, create_time, expire_time):
+        self.name = name
+        self.model = model
+        self.display_name = display_name
+        self.contents_text = contents_text
+        self.system_instruction = system_instruction
+        self.create_time = create_time
+        self.update_time = create_time
+        self.expire_time = expire_time
+        self.usage_metadata = SimpleNamespace(total_token_count=_token_count(contents_text))
+
+
+class FakeCaches:
+    """client.caches: хранилище кешированного контента с TTL"""
+
+    def __init__(self, owner: 'FakeGeminiClient'):
+        self._owner = owner
+        self._items = {}
+        self._lock = threading.Lock()
+        self._counter = 0
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+
+    def _now(self) -> datetime:
+        return datetime.fromtimestamp(self._owner.clock(), tz=timezone.utc)
+
+    def _expire_time(self, config) -> datetime:
+        expire_time = _config_value(config, 'expire_time')
+        if expire_time is not None:
+            return expire_time
+        return datetime.fromtimestamp(
+            self._owner.clock() + _parse_ttl(_config_value(config, 'ttl')), tz=timezone.utc
+        )
+
+    def _purge_expired(self) -> None:
+        now = self._now()
+        for name in [n for n, item in self._items.items() if item.expire_time <= now]:
+            del self._items[name]
+
+    def create(self, *, model: str, config=None) -> FakeCachedContent:
+        self._owner._maybe_fail('caches.create')
+        contents_text = _contents_text(_config_value(config, 'contents'))
+        system_instruction = _config_value(config, 'system_instruction')
+        total = _token_count(contents_text) + _token_count(str(system_instruction or ''))
+        if total < self._owner.min_cache_tokens:
+            raise FakeAPIError(400, f"Cached content is too small: {total} < {self._owner.min_cache_tokens} tokens")
+
+        with self._lock:
+            self._purge_expired()
+            self._counter += 1
+            self.created += 1
+            name = f"cachedContents/fake-{self._counter}"
+            item = FakeCachedContent(
+                name, model, _config_value(config, 'display_name'), contents_text,
+                system_instruction, self._now(), self._expire_time(config)
+            )
+            self._items[name] = item
+            return item
+
+    def get(self, *, name: str, config=None) -> FakeCachedContent:
+        with self._lock:
+            self._purge_expired()
+            if name not in self._items:
+                raise FakeAPIError(404, f"CachedContent not found: {name}")
+            return self._items[name]
+
+    def update(self, *, name: str, config=None) -> FakeCachedContent:
+        self._owner._maybe_fail('caches.update')
+        with self._lock:
+            self._purge_expired()
+            if name not in self._items:
+                raise FakeAPIError(404, f"CachedContent not found: {name}")
+            item = self._items[name]
+            item.expire_time = self._expire_time(config)
+            item.update_time = self._now()
+            self.updated += 1
+            return item
+
+    def delete(self, *, name: str, config=None) -> None:
+        with self._lock:
+            if self._items.pop(name, None) is not None:
+                self.deleted += 1
+
+    def list(self, config=None):
+        with self._lock:
+            self._purge_expired()
+            return list(self._items.values())
+
+
+class FakeModels:
+    """client.models: генерация и эмбеддинги без сети"""
+
+    def __init__(self, owner: 'FakeGeminiClient'):
+        self._owner = owner
+        self.calls = {'generate_content': 0, 'generate_content_stream': 0, 'embed_content': 0}
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def _prepare(self, method: str, contents, config) -> tuple:
+        self._owner._maybe_fail(method)
+        self.calls[method] += 1
+        prompt_text = _contents_text(contents)
+        cached = None
+        cached_name = _config_value(config, 'cached_content')
+        if cached_name:
+            cached = self._owner.caches.get(name=cached_name)
+        usage = SimpleNamespace(
+            prompt_token_count=_token_count(prompt_text) + (cached.usage_metadata.total_token_count if cached else 0),
+            cached_content_token_count=cached.usage_metadata.total_token_count if cached else 0
+        )
+        self.prompt_tokens += usage.prompt_token_count
+        self.cached_tokens += usage.cached_content_token_count
+        return prompt_text, usage
+
+    def _response(self, prompt_text: str, usage, config):
+        schema = _config_value(config, 'response_schema')
+        parsed = fake_parsed(schema) if schema is not None and hasattr(schema, 'model_fields') else None
+        text = self._owner.text_fn(prompt_text)
+        usage.candidates_token_count = _token_count(text)
+        return SimpleNamespace(text=text, parsed=parsed, usage_metadata=usage)
+
+    def _chunks(self, prompt_text: str, usage) -> list:
+        text = self._owner.text_fn(prompt_text)
+        usage.candidates_token_count = _token_count(text)
+        words = text.split(' ')
+        chunks = []
+        for i in range(0, len(words), STREAM_CHUNK_WORDS):
+            last = i + STREAM_CHUNK_WORDS >= len(words)
+            chunks.append(SimpleNamespace(
+                text=' '.join(words[i:i + STREAM_CHUNK_WORDS]) + ('' if last else ' '),
+                usage_metadata=usage if last else None
+            ))
+        return chunks
+
+    def _embeddings(self, contents):
+        self._owner._maybe_fail('embed_content')
+        self.calls['embed_content'] += 1
+        texts = [contents] if isinstance(contents, str) else list(contents)
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=fake_embedding(t)) for t in texts])
+
+    def generate_content(self, *, model: str, contents, config=None):
+        prompt_text, usage = self._prepare('generate_content', contents, config)
+        self._owner._sleep(self._owner.latency_for(self._owner.latency))
+        return self._response(prompt_text, usage, config)
+
+    def generate_content_stream(self, *, model: str, contents, config=None):
+        prompt_text, usage = self._prepare('generate_content_stream', contents, config)
+        chunks = self._chunks(prompt_text, usage)
+
+        def stream():
+            self._owner._sleep(self._owner.latency_for(self._owner.latency))
+            for i, chunk in enumerate(chunks):
+                if i:
+                    self._owner._sleep(self._owner.chunk_delay)
+                yield chunk
+        return stream()
+
+    def embed_content(self, *, model: str, contents, config=None):
+        response = self._embeddings(contents)
+        self._owner._sleep(self._owner.latency_for(self._owner.embed_latency))
+        return response
+
+
+class FakeAsyncModels:
+    """client.aio.models: те же ответы, ожидание через asyncio.sleep"""
+
+    def __init__(self, models: FakeModels):
+        self._models = models
+        self._owner = models._owner
+
+    async def generate_content(self, *, model: str, contents, config=None):
+        prompt_text, usage = self._models._prepare('generate_content', contents, config)
+        await asyncio.sleep(self._owner.latency_for(self._owner.latency))
+        return self._models._response(prompt_text, usage, config)
+
+    async def generate_content_stream(self, *, model: str, contents, config=None):
+        prompt_text, usage = self._models._prepare('generate_content_stream', contents, config)
+        chunks = self._models._chunks(prompt_text, usage)
+
+        async def stream():
+            await asyncio.sleep(self._owner.latency_for(self._owner.latency))
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(self._owner.chunk_delay)
+                yield chunk
+        return stream()
+
+    async def embed_content(self, *, model: str, contents, config=None):
+        response = self._models._embeddings(contents)
+        await asyncio.sleep(self._owner.latency_for(self._owner.embed_latency))
+        return response
+
+
+def _default_text(prompt_text: str) -> str:
+    lines = [line.strip() for line in prompt_text.splitlines() if line.strip()]
+    last_line = lines[-1] if lines else ''
+    return f"Тестовый ответ на запрос: {last_line[:200]}"
+
+
+class FakeGeminiClient:
+    """Клиент с интерфейсом genai.Client для локального запуска и замеров.
+
+    latency — задержка до первого ответа (с), chunk_delay — между частями
+    стрима, embed_latency — на вызов эмбеддингов. Доля slow_rate вызовов
+    отвечает на slow_latency секунд дольше. fail — функция(method) -> bool
+    для имитации ошибок API (503).
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        chunk_delay: float = 0.0,
+        embed_latency: Optional[float] = None,
+        text_fn: Optional[Callable[[str], str]] = None,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+        min_cache_tokens: int = 1024,
+        fail: Optional[Callable[[str], bool]] = None,
+        slow_rate: float = 0.0,
+        slow_latency: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.embed_latency = latency if embed_latency is None else embed_latency
+        self.text_fn = text_fn or _default_text
+        self.clock = clock
+        self.min_cache_tokens = min_cache_tokens
+        self.fail = fail
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._random = random.Random(seed)
+        self._sleep_fn = sleep
+        self.models = FakeModels(self)
+        self.caches = FakeCaches(self)
+        self.aio = SimpleNamespace(models=FakeAsyncModels(self.models), caches=self.caches)
+
+    def latency_for(self, base: float) -> float:
+        """Задержка вызова: base, а для доли slow_rate — ещё slow_latency"""
+        if self.slow_rate > 0 and self._random.random() < self.slow_rate:
+            return base + self.slow_latency
+        return base
+
+    def _sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            self._sleep_fn(seconds)
+
+    def _maybe_fail(self, method: str) -> None:
+        if self.fail is not None and self.fail(method):
+            raise FakeAPIError(503, f"Fake failure in {method}")
@@ -0,0 +1,217 @@
+# fake_hub.py - Локальный Hub для разработки и замеров (OAuth2 + Admin API)
+#
+# HTTP/1.1-сервер с keep-alive: /oauth/authorize сразу возвращает код на
+# redirect_uri, /oauth/token меняет код на токен, /oauth/userinfo и /api/*
+# требуют Bearer-токен и отдают данные из mock_data (их же админка показывает
+# в DEV_MODE). Считает запросы и TCP-соединения — по ним видно, что клиент
+# переиспользует соединения. latency имитирует сетевую задержку Hub.
+#
+# Запуск: python -m src.fake_hub --port 5055 [--latency-ms 50]
+#         HUB_BASE_URL=http://127.0.0.1:5055 python run.py
+import json
+import time
+import secrets
+import argparse
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+
+def mock_data(endpoint: str) -> dict:
+    """Ответы Admin API: для DEV_MODE и fake Hub"""
+    if 'users' in endpoint:
+        return {
+            'users': [
+                {
+                    'id': '1',
+                    'email': 'admin@severindevelopment.ru',
+                    'display_name': 'Администратор',
+                    'department': 'IT отдел',
+                    'job_title': 'Системный администратор',
+                    'is_admin': True,
+                    'is_active': True,
+                    'last_login_at': datetime.now().isoformat()
+                },
+                {
+                    'id': '2',
+                    'email': 'user1@severindevelopment.ru',
+                    'display_name': 'Иванов Иван',
+                    'department': 'Строительный контроль',
+                    'job_title': 'Инженер СК',
+                    'is_admin': False,
+                    'is_active': True,
+                    'last_login_at': datetime.now().isoformat()
+                },
+                {
+                    'id': '3',
+                    'email': 'user2@severindevelopment.ru',
+                    'display_name': 'Петров Пётр',
+                    'department': 'Проектный отдел',
+                    'job_title': 'Архитектор',
+                    'is_admin': False,
+                    'is_active': True,
+                    'last_login_at': None
+                },
+            ],
+            'total': 3
+        }
+    elif 'stats' in endpoint:
+        return {
+            'total_users': 3,
+            'active_users': 2,
+            'total_sessions': 15,
+            'today_logins': 5
+        }
+    elif 'applications' in endpoint:
+        return {
+            'applications': [
+                {
+                    'id': '1',
+                    'name': 'AI Chat',
+                    'client_id': 'hub_ai_chat',
+                    'is_active': True,
+                    'created_at': datetime.now().isoformat()
+                }
+            ]
+        }
+
+    return {'error': 'Unknown endpoint'}
+
+
+FAKE_USER = {
+    'sub': '1',
+    'email': 'admin@severindevelopment.ru',
+    'name': 'Администратор',
+    'department': 'IT отдел',
+    'job_title': 'Системный администратор',
+    'is_admin': True,
+}
+
+
+class FakeHubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0):
+        super().__init__(address, FakeHubHandler)
+        self.latency = latency
+        self.codes = set()
+        self.tokens = set()
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class FakeHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        header = self.headers.get('Authorization', '')
+        return header.startswith('Bearer ') and header[7:] in self.server.tokens
+
+    def _begin(self) -> None:
+        self.server.count('requests')
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+    def do_GET(self):
+        self._begin()
+        url = urlsplit(self.path)
+
+        if url.path == '/oauth/authorize':
+            params = parse_qs(url.query)
+            code = secrets.token_urlsafe(16)
+            self.server.codes.add(code)
+            query = urlencode({'code': code, 'state': params.get('state', [''])[0]})
+            self.send_response(302)
+            self.send_header('Location', f"{params.get('redirect_uri', [''])[0]}?{query}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if not self._authorized():
+            self._send_json(401, {'error': 'invalid_token'})
+            return
+
+        if url.path == '/oauth/userinfo':
+            self._send_json(200, FAKE_USER)
+        elif url.path.startswith('/api/'):
+            self._send_json(200, mock_data(url.path))
+        else:
+            self._send_json(404, {'error': 'not_found'})
+
+    def do_POST(self):
+        self._begin()
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+
+        if self.path == '/oauth/token':
+            code = parse_qs(body).get('code', [''])[0]
+            if code not in self.server.codes:
+                self._send_json(400, {'error': 'invalid_grant'})
+                return
+            self.server.codes.discard(code)
+            token = secrets.token_urlsafe(24)
+            self.server.tokens.add(token)
+            self._send_json(200, {
+                'access_token': token,
+                'refresh_token': secrets.token_urlsafe(24),
+                'token_type': 'Bearer',
+                'expires_in': 3600
+            })
+        elif not self._authorized():
+            self._send_json(401, {'error': 'invalid_token'})
+        else:
+            self._send_json(200, {'ok': True})
+
+
+def start_fake_hub(host: str = '127.0.0.1', port: int = 0, latency: float = 0.0) -> FakeHubServer:
+    """Запуск в фоновом потоке (port=0 — свободный порт); остановка: server.shutdown()"""
+    server = FakeHubServer((host, port), latency=latency)
+    threading.Thread(target=server.serve_forever, name='fake-hub', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный Hub (OAuth2 + Admin API)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--latency-ms', type=float, default=0, help="задержка ответа, мс")
+    args = parser.parse_args()
+
+    server = FakeHubServer((args.host, args.port), latency=args.latency_ms / 1000)
+    print(f"INFO: Fake Hub: {server.base_url} (задержка {args.latency_ms:g} мс)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"INFO: Fake Hub: {server.requests} запросов, {server.connections} соединений")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# followup.py - Локальное определение уточняющих вопросов
+#
+# Решает, можно ли ответить на новое сообщение по контексту предыдущего
+# RAG-поиска, без вызова LLM: близость эмбеддингов нового вопроса и вопроса,
+# по которому найден контекст, пересечение слов и эвристика коротких реплик.
+import math
+import unicodedata
+from typing import List, Optional
+
+from src.config import FOLLOWUP_REUSE_SIMILARITY, FOLLOWUP_NEW_SIMILARITY, FOLLOWUP_SHORT_TOKENS
+
+# Типичные начала и формулировки уточнений
+FOLLOWUP_MARKERS = (
+    'подробнее', 'поподробнее', 'детальнее', 'ещё', 'еще', 'продолжи', 'дальше',
+    'поясни', 'объясни', 'уточни', 'расскажи больше', 'что это значит', 'почему',
+    'например', 'пример', 'а если', 'а как', 'а что', 'а где', 'а когда', 'а кто',
+    'в этом', 'этого', 'этому', 'там', 'тогда',
+    'more', 'explain', 'why', 'example', 'continue',
+)
+
+# Слова, не несущие темы вопроса
+_STOP_WORDS = {
+    'а', 'и', 'в', 'во', 'на', 'по', 'о', 'об', 'от', 'до', 'для', 'с', 'со', 'к', 'ко',
+    'из', 'за', 'у', 'не', 'ли', 'же', 'бы', 'то', 'это', 'как', 'что', 'какие', 'какой',
+    'какая', 'каких', 'где', 'когда', 'или', 'мне', 'я', 'вы', 'нужно', 'можно',
+}
+
+
+def _tokens(text: str) -> List[str]:
+    text = unicodedata.normalize('NFC', text).lower()
+    text = ''.join(' ' if unicodedata.category(ch).startswith('P') else ch for ch in text)
+    return text.split()
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def lexical_overlap(query: str, previous_query: str) -> float:
+    """Доля общих значимых слов (коэффициент Жаккара)"""
+    a = {t for t in _tokens(query) if t not in _STOP_WORDS}
+    b = {t for t in _tokens(previous_query) if t not in _STOP_WORDS}
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+_MARKER_WORDS = {word for marker in FOLLOWUP_MARKERS for word in marker.split()}
+
+
+def is_short_followup(query: str, previous_query: Optional[str] = None) -> bool:
+    """Короткая реплика с маркером уточнения ("а подробнее?", "почему?").
+
+    Значимые слова, кроме маркеров, допускаются только из прежнего вопроса:
+    "а что с кровлей?" после вопроса о фундаментах — уже новая тема.
+    """
+    tokens = _tokens(query)
+    if not tokens or len(tokens) > FOLLOWUP_SHORT_TOKENS:
+        return False
+    padded = f" {' '.join(tokens)} "
+    if not any(f' {marker} ' in padded for marker in FOLLOWUP_MARKERS):
+        return False
+
+    content = {t for t in tokens if t not in _STOP_WORDS and t not in _MARKER_WORDS}
+    return content <= set(_tokens(previous_query or ''))
+
+
+def needs_new_search(
+    query: str,
+    query_embedding: Optional[List[float]],
+    previous_query: Optional[str],
+    previous_embedding: Optional[List[float]]
+) -> Optional[bool]:
+    """True — нужен новый поиск, False — хватит прежнего контекста,
+    None — случай неоднозначный (решает LLM)."""
+    if is_short_followup(query, previous_query):
+        return False
+
+    if not previous_query or query_embedding is None or previous_embedding is None:
+        return None
+
+    similarity = _cosine(query_embedding, previous_embedding)
+    overlap = lexical_overlap(query, previous_query)
+
+    if similarity >= FOLLOWUP_REUSE_SIMILARITY:
+        return False
+    if similarity < FOLLOWUP_NEW_SIMILARITY and overlap == 0.0:
+        return True
+    return None
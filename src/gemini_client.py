@@ -1,28 +1,310 @@
 # gemini_client.py - Работа с Google Gemini AI
+import os
 import json
+import time
+import asyncio
+import hashlib
+import threading
 import traceback
-from typing import List, Generator
+import unicodedata
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncGenerator, Callable, Dict, Generator, List, Optional, Tuple
 
-from google import genai
-from google.genai import types
 from pydantic import BaseModel, Field
 
-from src.config import GEMINI_API_KEY, GEMINI_MODEL_NAME, EMBEDDING_MODEL
+from src.config import (
+    GEMINI_API_KEY, GEMINI_MODEL_NAME, EMBEDDING_MODEL, CACHE_DIR,
+    GEMINI_BACKEND, FAKE_GEMINI_LATENCY_MS, FAKE_GEMINI_CHUNK_DELAY_MS, GEMINI_MODEL_KEY, EMBEDDING_MODEL_KEY,
+    FAKE_GEMINI_SLOW_RATE, FAKE_GEMINI_SLOW_MS, FAKE_GEMINI_FAIL_RATE,
+    EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_DISK_ENTRIES,
+    EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_BATCH_MAX_TEXTS, EMBEDDING_BATCH_CONCURRENCY,
+    CONTEXT_CACHE_ENABLED, CONTEXT_CACHE_TTL, CONTEXT_CACHE_REFRESH_MARGIN,
+    CONTEXT_CACHE_MIN_CHARS, CONTEXT_CACHE_RETRY_AFTER
+)
+from src.cache import TwoTierCache
+from src.resilience import CircuitOpen, embed_policy, json_policy, text_policy
+from src.metrics import record_usage
+from src import events
+from src.events import StreamEvent
 
 
 # --- Инициализация клиента ---
-client = None
-GEMINI_CONFIGURED = False
+# google-genai импортируется при первом обращении к API: это самый тяжёлый
+# импорт приложения, и воркер не должен платить за него при старте
+_client = None
+_client_failed = False
+_client_lock = threading.Lock()
 
-try:
-    if not GEMINI_API_KEY:
-        raise ValueError("GEMINI_API_KEY не установлен")
-    client = genai.Client()
-    print(f"INFO: Gemini клиент инициализирован. Модель: {GEMINI_MODEL_NAME}")
-    GEMINI_CONFIGURED = True
-except Exception as e:
-    print(f"ОШИБКА: Не удалось инициализировать Gemini: {e}")
-    traceback.print_exc()
+GEMINI_CONFIGURED = bool(GEMINI_API_KEY) or GEMINI_BACKEND == 'fake'
+if not GEMINI_CONFIGURED:
+    print("ОШИБКА: Не удалось инициализировать Gemini: GEMINI_API_KEY не установлен")
+
+
+def get_client():
+    """Клиент Gemini, создаётся при первом вызове; None, если недоступен"""
+    global _client, _client_failed
+    if _client is not None or _client_failed or not GEMINI_CONFIGURED:
+        return _client
+
+    with _client_lock:
+        if _client is None and not _client_failed:
+            try:
+                if GEMINI_BACKEND == 'fake':
+                    import random
+                    from src.fake_gemini import FakeGeminiClient
+                    _client = FakeGeminiClient(
+                        latency=FAKE_GEMINI_LATENCY_MS / 1000,
+                        chunk_delay=FAKE_GEMINI_CHUNK_DELAY_MS / 1000,
+                        slow_rate=FAKE_GEMINI_SLOW_RATE,
+                        slow_latency=FAKE_GEMINI_SLOW_MS / 1000,
+                        fail=(lambda method: random.random() < FAKE_GEMINI_FAIL_RATE) if FAKE_GEMINI_FAIL_RATE else None
+                    )
+                    print(f"WARN: Используется fake-клиент Gemini (задержка {FAKE_GEMINI_LATENCY_MS} мс)")
+                else:
+                    from google import genai
+                    _client = genai.Client()
+                    print(f"INFO: Gemini клиент инициализирован. Модель: {GEMINI_MODEL_NAME}")
+            except Exception as e:
+                _client_failed = True
+                print(f"ОШИБКА: Не удалось инициализировать Gemini: {e}")
+                traceback.print_exc()
+    return _client
+
+
+# --- Кеш эмбеддингов ---
+embedding_cache = TwoTierCache(
+    'embeddings', CACHE_DIR,
+    max_items=EMBEDDING_CACHE_SIZE,
+    max_disk_entries=EMBEDDING_CACHE_DISK_ENTRIES,
+    encode=lambda values: array('f', values).tobytes(),
+    decode=lambda blob: array('f', blob).tolist()
+) if EMBEDDING_CACHE_ENABLED else None
+
+
+def _embedding_key(text: str) -> str:
+    normalized = " ".join(unicodedata.normalize('NFC', text).split())
+    return hashlib.sha256(f"{EMBEDDING_MODEL_KEY}\n{normalized}".encode('utf-8')).hexdigest()
+
+
+# --- Склейка эмбеддинг-запросов ---
+class EmbeddingBatcher:
+    """Один вызов embed_content на запросы всех потоков за короткое окно.
+
+    Первый запрос открывает окно window секунд; всё, что пришло за окно
+    (или пока не набралось max_texts текстов), уходит одним вызовом API, а
+    результаты раздаются в Future вызывающих. Одинаковые тексты разных
+    запросов считаются один раз. Пока пачка в полёте, следующие копятся
+    в новое окно; одновременно в полёте не больше concurrency вызовов.
+    """
+
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]],
+                 window: float, max_texts: int, concurrency: int):
+        self._embed = embed
+        self.window = window
+        self.max_texts = max_texts
+        self.concurrency = concurrency
+        self._cond = threading.Condition()
+        self._pending = []  # [(key -> text, Future)]
+        self._pending_texts = 0
+        self._pid = None
+        self._executor = None
+        self._stats = {'requests': 0, 'batches': 0, 'api_calls': 0, 'texts': 0, 'deduplicated': 0}
+
+    def _ensure_started(self) -> None:
+        # Поток и пул создаются в процессе, который их использует: после fork
+        # (preload_app в gunicorn) потоки мастера в воркере не существуют
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pending = []
+        self._pending_texts = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='embed-batch')
+        threading.Thread(target=self._run, name='embed-batcher', daemon=True).start()
+
+    def stats_dict(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+        stats.update(window_ms=self.window * 1000, max_texts=self.max_texts)
+        return stats
+
+    def submit(self, missing: Dict[str, str]) -> Future:
+        """Future со словарём key -> вектор для всех ключей missing"""
+        future = Future()
+        with self._cond:
+            self._ensure_started()
+            self._pending.append((missing, future))
+            self._pending_texts += len(missing)
+            self._stats['requests'] += 1
+            self._cond.notify()
+        return future
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while self._pending_texts < self.max_texts:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, []
+                self._pending_texts = 0
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: list) -> None:
+        # Отменённые запросы (клиент ушёл) в вызов не попадают
+        batch = [(missing, future) for missing, future in batch if future.set_running_or_notify_cancel()]
+        texts = {}
+        for missing, _ in batch:
+            texts.update(missing)
+        if not texts:
+            for _, future in batch:
+                future.set_result({})
+            return
+
+        keys = list(texts)
+        fetched = {}
+        try:
+            for i in range(0, len(keys), self.max_texts):
+                part = keys[i:i + self.max_texts]
+                vectors = self._embed([texts[key] for key in part])
+                if len(vectors) != len(part):
+                    raise ValueError(f"API вернул {len(vectors)} эмбеддингов на {len(part)} текстов")
+                fetched.update(zip(part, vectors))
+                with self._cond:
+                    self._stats['api_calls'] += 1
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        with self._cond:
+            self._stats['batches'] += 1
+            self._stats['texts'] += len(keys)
+            self._stats['deduplicated'] += sum(len(missing) for missing, _ in batch) - len(keys)
+        for missing, future in batch:
+            future.set_result({key: fetched[key] for key in missing})
+
+
+def _request_embeddings(texts: List[str]) -> List[List[float]]:
+    client = get_client()
+    response = embed_policy.call(lambda: client.models.embed_content(
+        model=EMBEDDING_MODEL, contents=texts, config={"http_options": embed_policy.http_options()}
+    ))
+    return [list(emb.values) for emb in response.embeddings]
+
+
+embedding_batcher = EmbeddingBatcher(
+    _request_embeddings,
+    window=EMBEDDING_BATCH_WINDOW_MS / 1000,
+    max_texts=EMBEDDING_BATCH_MAX_TEXTS,
+    concurrency=EMBEDDING_BATCH_CONCURRENCY
+) if EMBEDDING_BATCH_WINDOW_MS > 0 else None
+
+
+# --- Контекстный кеш (cached content) ---
+# Полный текст документа с системным промптом регистрируется у провайдера
+# один раз; вопросы ссылаются на имя кеша. Реестр имён общий для воркеров
+# узла (SQLite). Два воркера могут одновременно создать кеш для одного
+# документа — лишний просто истечёт по TTL.
+context_caches = TwoTierCache(
+    'context_caches', CACHE_DIR,
+    max_items=256,
+    max_disk_entries=1024,
+    encode=lambda entry: json.dumps(entry).encode('utf-8'),
+    decode=lambda blob: json.loads(blob.decode('utf-8')),
+    ttl=CONTEXT_CACHE_TTL
+) if CONTEXT_CACHE_ENABLED else None
+
+# key -> время неудачного создания кеша (локально для процесса)
+_context_failures = {}
+_context_locks = {}
+_context_locks_guard = threading.Lock()
+
+
+def _context_key(system_prompt: str, document_text: str) -> str:
+    return hashlib.sha256(
+        f"{GEMINI_MODEL_KEY}\n{system_prompt}\n{document_text}".encode('utf-8')
+    ).hexdigest()
+
+
+def _context_lock(key: str) -> threading.Lock:
+    with _context_locks_guard:
+        return _context_locks.setdefault(key, threading.Lock())
+
+
+def _expire_at(cached) -> float:
+    expire_time = getattr(cached, 'expire_time', None)
+    return expire_time.timestamp() if expire_time else time.time() + CONTEXT_CACHE_TTL
+
+
+def _document_turn(document_text: str) -> str:
+    return f"ДОКУМЕНТ:\n---\n{document_text}\n---"
+
+
+def get_context_cache(system_prompt: str, document_text: str, display_name: str = '') -> Optional[str]:
+    """Имя кеша провайдера для документа; None — текст отправляется целиком.
+
+    Кеш создаётся при первом вопросе и продлевается, когда до истечения
+    остаётся меньше CONTEXT_CACHE_REFRESH_MARGIN секунд.
+    """
+    client = get_client()
+    if not client or context_caches is None or len(document_text) < CONTEXT_CACHE_MIN_CHARS:
+        return None
+
+    key = _context_key(system_prompt, document_text)
+    entry = context_caches.get(key)
+    if entry and entry['expire_at'] - time.time() > CONTEXT_CACHE_REFRESH_MARGIN:
+        return entry['name']
+
+    with _context_lock(key):
+        now = time.time()
+        entry = context_caches.get(key)
+        if entry and entry['expire_at'] - now > CONTEXT_CACHE_REFRESH_MARGIN:
+            return entry['name']
+
+        if entry and entry['expire_at'] > now:
+            try:
+                updated = client.caches.update(name=entry['name'], config={'ttl': f"{CONTEXT_CACHE_TTL}s"})
+                entry = {'name': entry['name'], 'expire_at': _expire_at(updated)}
+                context_caches.set(key, entry)
+                return entry['name']
+            except Exception as e:
+                print(f"WARN: Контекстный кеш {entry['name']} не продлён: {e}")
+
+        failed_at = _context_failures.get(key)
+        if failed_at is not None and now - failed_at < CONTEXT_CACHE_RETRY_AFTER:
+            return None
+
+        try:
+            cached = client.caches.create(
+                model=GEMINI_MODEL_NAME,
+                config={
+                    'display_name': display_name[:128],
+                    'system_instruction': system_prompt,
+                    'contents': [{'role': 'user', 'parts': [{'text': _document_turn(document_text)}]}],
+                    'ttl': f"{CONTEXT_CACHE_TTL}s",
+                }
+            )
+        except Exception as e:
+            _context_failures[key] = now
+            context_caches.delete(key)
+            print(f"WARN: Контекстный кеш для '{display_name}' не создан: {e}")
+            return None
+
+        _context_failures.pop(key, None)
+        context_caches.set(key, {'name': cached.name, 'expire_at': _expire_at(cached)})
+        print(f"INFO: Контекстный кеш создан: '{display_name}' -> {cached.name}")
+        return cached.name
+
+
+def invalidate_context_cache(system_prompt: str, document_text: str) -> None:
+    """Забыть имя кеша (например, кеш удалён на стороне провайдера)"""
+    if context_caches is not None:
+        context_caches.delete(_context_key(system_prompt, document_text))
 
 
 # --- Pydantic схемы ---
@@ -42,84 +324,335 @@ class RagDecision(BaseModel):
     reason: str = Field(description="A brief explanation for the decision.")
 
 
+# --- Параметры запросов (общие для синхронных и async-функций) ---
+def _history_contents(history: List[dict]) -> List[dict]:
+    return [{'role': msg['role'], 'parts': [{'text': msg['content']}]} for msg in history]
+
+
+def _stream_config(system_prompt: str) -> dict:
+    return {
+        "system_instruction": system_prompt,
+        "temperature": 0.2,
+        "max_output_tokens": 8192
+    }
+
+
+def _cached_stream_request(cache_name: str, question: str) -> dict:
+    return {
+        "contents": [{'role': 'user', 'parts': [{'text': f"ВОПРОС: {question}"}]}],
+        "config": {
+            "cached_content": cache_name,
+            "temperature": 0.2,
+            "max_output_tokens": 8192
+        }
+    }
+
+
+def _grounding_history(document_text: str, question: str) -> List[dict]:
+    return [{"role": "user", "content": f"{_document_turn(document_text)}\n\nВОПРОС: {question}"}]
+
+
+def _json_config(schema: type[BaseModel], temperature: float) -> dict:
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": schema,
+        "temperature": temperature,
+        "http_options": json_policy.http_options()
+    }
+
+
+def _lookup_embeddings(texts: List[str]) -> Tuple[List[str], dict, dict]:
+    """(ключи, найденные в кеше, уникальные промахи key -> text)"""
+    keys = [_embedding_key(text) for text in texts]
+    found = embedding_cache.get_many(keys) if embedding_cache else {}
+
+    # Уникальные промахи: одинаковые тексты в одном вызове считаются один раз
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    return keys, found, missing
+
+
+def _store_embeddings(found: dict, fetched: dict) -> None:
+    if embedding_cache:
+        embedding_cache.set_many(fetched)
+    found.update(fetched)
+
+
+def _chunk_usage(chunk, previous):
+    """usage_metadata стрима накопительный: берётся последний"""
+    return getattr(chunk, 'usage_metadata', None) or previous
+
+
 # --- Функции ---
-def stream_response(history: List[dict], system_prompt: str) -> Generator[str, None, None]:
+def stream_response(history: List[dict], system_prompt: str) -> Generator[StreamEvent, None, None]:
     """Стриминг ответа от Gemini"""
+    client = get_client()
     if not client:
-        yield f"data: {json.dumps({'type': 'error', 'data': 'Gemini не инициализирован'})}\n\n"
+        yield events.error('Gemini не инициализирован')
         return
 
-    contents = [{'role': msg['role'], 'parts': [{'text': msg['content']}]} for msg in history]
-
+    usage = None
     try:
         stream = client.models.generate_content_stream(
             model=GEMINI_MODEL_NAME,
-            contents=contents,
-            config=types.GenerateContentConfig(
-                system_instruction=system_prompt,
-                temperature=0.2,
-                max_output_tokens=8192
-            )
+            contents=_history_contents(history),
+            config=_stream_config(system_prompt)
         )
         for chunk in stream:
+            usage = _chunk_usage(chunk, usage)
             if chunk.text:
-                yield f"data: {json.dumps({'type': 'content', 'data': chunk.text})}\n\n"
+                yield events.content(chunk.text)
     except Exception as e:
         print(f"Ошибка Gemini API: {e}")
         traceback.print_exc()
-        yield f"data: {json.dumps({'type': 'error', 'data': f'Ошибка API: {e}'})}\n\n"
+        yield events.error(f'Ошибка API: {e}')
+    finally:
+        record_usage('stream', usage)
+
+
+def stream_grounded_response(
+    document_text: str, question: str, system_prompt: str, display_name: str = ''
+) -> Generator[StreamEvent, None, None]:
+    """Стриминг ответа по полному тексту документа.
+
+    Документ передаётся через контекстный кеш; если кеша нет или запрос
+    с ним упал до первого фрагмента, документ отправляется целиком.
+    """
+    cache_name = get_context_cache(system_prompt, document_text, display_name)
+    if cache_name:
+        started = False
+        usage = None
+        try:
+            stream = get_client().models.generate_content_stream(
+                model=GEMINI_MODEL_NAME, **_cached_stream_request(cache_name, question)
+            )
+            for chunk in stream:
+                usage = _chunk_usage(chunk, usage)
+                if chunk.text:
+                    started = True
+                    yield events.content(chunk.text)
+            return
+        except Exception as e:
+            if started:
+                print(f"Ошибка Gemini API: {e}")
+                traceback.print_exc()
+                yield events.error(f'Ошибка API: {e}')
+                return
+            print(f"WARN: Запрос с контекстным кешем {cache_name} не удался, документ отправляется целиком: {e}")
+            invalidate_context_cache(system_prompt, document_text)
+        finally:
+            record_usage('stream', usage)
+
+    yield from stream_response(_grounding_history(document_text, question), system_prompt)
 
 
 def generate_json(prompt: str, schema: type[BaseModel], temperature: float = 0.0):
-    """Генерация структурированного JSON ответа"""
+    """Генерация структурированного JSON ответа.
+
+    None при ошибке, а также без запроса, пока разомкнут предохранитель:
+    все вызывающие (роутер, детектор) имеют локальный запасной путь.
+    """
+    client = get_client()
     if not client:
         return None
 
     try:
-        response = client.models.generate_content(
+        response = json_policy.call(lambda: client.models.generate_content(
             model=GEMINI_MODEL_NAME,
             contents=[prompt],
-            config={
-                "response_mime_type": "application/json",
-                "response_schema": schema,
-                "temperature": temperature
-            }
-        )
+            config=_json_config(schema, temperature)
+        ), optional=True)
+        record_usage('json', getattr(response, 'usage_metadata', None))
         if hasattr(response, 'parsed') and response.parsed:
             return response.parsed
         return None
+    except CircuitOpen:
+        return None
     except Exception as e:
         print(f"Ошибка генерации JSON: {e}")
         traceback.print_exc()
         return None
 
 
-def generate_text(prompt: str, temperature: float = 0.1) -> str:
-    """Генерация текстового ответа"""
+def generate_text(prompt: str, temperature: float = 0.1) -> Optional[str]:
+    """Генерация текстового ответа (None при ошибке или пропуске, как generate_json)"""
+    client = get_client()
     if not client:
-        return prompt
+        return None
 
     try:
-        response = client.models.generate_content(
+        response = text_policy.call(lambda: client.models.generate_content(
             model=GEMINI_MODEL_NAME,
             contents=[prompt],
-            config={"temperature": temperature}
-        )
+            config={"temperature": temperature, "http_options": text_policy.http_options()}
+        ), optional=True)
+        record_usage('text', getattr(response, 'usage_metadata', None))
         return response.text.strip()
+    except CircuitOpen:
+        return None
     except Exception as e:
         print(f"Ошибка генерации текста: {e}")
-        return prompt
+        return None
 
 
 def embed_texts(texts: List[str]) -> List[List[float]]:
-    """Получение эмбеддингов для текстов"""
+    """Получение эмбеддингов для текстов (через кеш, в API уходят только промахи)"""
+    client = get_client()
     if not client:
         return []
 
+    keys, found, missing = _lookup_embeddings(texts)
+    if missing:
+        try:
+            if embedding_batcher:
+                fetched = embedding_batcher.submit(missing).result()
+            else:
+                fetched = dict(zip(missing, _request_embeddings(list(missing.values()))))
+        except Exception as e:
+            print(f"Ошибка эмбеддинга: {e}")
+            traceback.print_exc()
+            return []
+        _store_embeddings(found, fetched)
+
+    return [list(found[key]) for key in keys]
+
+
+# --- Async-версии (client.aio) для ASGI-пайплайна, см. src/asgi.py ---
+# Отмена задачи (клиент закрыл вкладку) прерывает await и закрывает стрим
+# провайдера: генерация дальше не оплачивается.
+async def astream_response(history: List[dict], system_prompt: str) -> AsyncGenerator[StreamEvent, None]:
+    """Стриминг ответа от Gemini (async)"""
+    client = get_client()
+    if not client:
+        yield events.error('Gemini не инициализирован')
+        return
+
+    usage = None
+    try:
+        stream = await client.aio.models.generate_content_stream(
+            model=GEMINI_MODEL_NAME,
+            contents=_history_contents(history),
+            config=_stream_config(system_prompt)
+        )
+        async for chunk in stream:
+            usage = _chunk_usage(chunk, usage)
+            if chunk.text:
+                yield events.content(chunk.text)
+    except Exception as e:
+        print(f"Ошибка Gemini API: {e}")
+        traceback.print_exc()
+        yield events.error(f'Ошибка API: {e}')
+    finally:
+        record_usage('stream', usage)
+
+
+async def astream_grounded_response(
+    document_text: str, question: str, system_prompt: str, display_name: str = ''
+) -> AsyncGenerator[StreamEvent, None]:
+    """Стриминг ответа по полному тексту документа (async)"""
+    # Создание и продление кеша — редкие синхронные вызовы, выполняются в потоке
+    cache_name = await asyncio.to_thread(get_context_cache, system_prompt, document_text, display_name)
+    if cache_name:
+        started = False
+        usage = None
+        try:
+            stream = await get_client().aio.models.generate_content_stream(
+                model=GEMINI_MODEL_NAME, **_cached_stream_request(cache_name, question)
+            )
+            async for chunk in stream:
+                usage = _chunk_usage(chunk, usage)
+                if chunk.text:
+                    started = True
+                    yield events.content(chunk.text)
+            return
+        except Exception as e:
+            if started:
+                print(f"Ошибка Gemini API: {e}")
+                traceback.print_exc()
+                yield events.error(f'Ошибка API: {e}')
+                return
+            print(f"WARN: Запрос с контекстным кешем {cache_name} не удался, документ отправляется целиком: {e}")
+            invalidate_context_cache(system_prompt, document_text)
+        finally:
+            record_usage('stream', usage)
+
+    async for event in astream_response(_grounding_history(document_text, question), system_prompt):
+        yield event
+
+
+async def agenerate_json(prompt: str, schema: type[BaseModel], temperature: float = 0.0):
+    """Генерация структурированного JSON ответа (async)"""
+    client = get_client()
+    if not client:
+        return None
+
     try:
-        response = client.models.embed_content(model=EMBEDDING_MODEL, contents=texts)
-        return [emb.values for emb in response.embeddings]
+        response = await json_policy.acall(lambda: client.aio.models.generate_content(
+            model=GEMINI_MODEL_NAME,
+            contents=[prompt],
+            config=_json_config(schema, temperature)
+        ), optional=True)
+        record_usage('json', getattr(response, 'usage_metadata', None))
+        if hasattr(response, 'parsed') and response.parsed:
+            return response.parsed
+        return None
+    except CircuitOpen:
+        return None
     except Exception as e:
-        print(f"Ошибка эмбеддинга: {e}")
+        print(f"Ошибка генерации JSON: {e}")
         traceback.print_exc()
+        return None
+
+
+async def agenerate_text(prompt: str, temperature: float = 0.1) -> Optional[str]:
+    """Генерация текстового ответа (async)"""
+    client = get_client()
+    if not client:
+        return None
+
+    try:
+        response = await text_policy.acall(lambda: client.aio.models.generate_content(
+            model=GEMINI_MODEL_NAME,
+            contents=[prompt],
+            config={"temperature": temperature, "http_options": text_policy.http_options()}
+        ), optional=True)
+        record_usage('text', getattr(response, 'usage_metadata', None))
+        return response.text.strip()
+    except CircuitOpen:
+        return None
+    except Exception as e:
+        print(f"Ошибка генерации текста: {e}")
+        return None
+
+
+async def aembed_texts(texts: List[str]) -> List[List[float]]:
+    """Эмбеддинги текстов через кеш (async)"""
+    client = get_client()
+    if not client:
         return []
+
+    # Кеш — SQLite на диске: чтение и запись в потоке, цикл событий не ждёт
+    keys, found, missing = await asyncio.to_thread(_lookup_embeddings, texts)
+    if missing:
+        try:
+            if embedding_batcher:
+                # Ожидание Future не блокирует цикл событий; при отмене задачи
+                # запрос снимается с пачки, если она ещё не отправлена
+                fetched = await asyncio.wrap_future(embedding_batcher.submit(missing))
+            else:
+                response = await embed_policy.acall(
+                    lambda: client.aio.models.embed_content(
+                        model=EMBEDDING_MODEL, contents=list(missing.values()),
+                        config={"http_options": embed_policy.http_options()}
+                    )
+                )
+                fetched = {key: list(emb.values) for key, emb in zip(missing, response.embeddings)}
+        except Exception as e:
+            print(f"Ошибка эмбеддинга: {e}")
+            traceback.print_exc()
+            return []
+        await asyncio.to_thread(_store_embeddings, found, fetched)
+
+    return [list(found[key]) for key in keys]
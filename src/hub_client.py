@@ -0,0 +1,213 @@
+# hub_client.py - HTTP-клиент Hub: keep-alive пул соединений и кеш чтений Admin API
+#
+# Все запросы к Hub (обмен кода на токен, userinfo, Admin API) идут через
+# одну requests.Session на процесс: TCP+TLS-рукопожатие платится один раз
+# на соединение, а не на каждый запрос.
+#
+# GET-ответы Admin API кешируются по (токен, путь): HUB_CACHE_TTL секунд
+# отдаются из памяти, ещё HUB_CACHE_STALE секунд — устаревший ответ сразу,
+# а свежий запрашивается в фоне (stale-while-revalidate). В ключе хеш токена:
+# у каждого администратора свой кеш и свои права. Ошибки не кешируются.
+#
+# api_get_many запрашивает несколько ресурсов параллельно (обзор админки):
+# ответ готов за время самого медленного запроса, а не за их сумму.
+#
+# Локальная проверка без Hub: python -m src.fake_hub (см. deploy/README.md)
+import os
+import time
+import hashlib
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.cache import LRUCache
+from src.config import (
+    HUB_API_URL, HUB_TIMEOUT, HUB_POOL_SIZE,
+    HUB_CACHE_TTL, HUB_CACHE_STALE, HUB_CACHE_MAX_ENTRIES
+)
+
+
+class HubClient:
+    """Запросы к Hub через общий пул соединений; GET Admin API — через кеш"""
+
+    def __init__(self, api_url: str, timeout: float, pool_size: int, ttl: float, stale: float,
+                 max_entries: int, clock: Callable[[], float] = time.monotonic):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self.stale = stale
+        self.clock = clock
+        self._cache = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._pid = None
+        self._http = None
+        self._executor = None
+        self._fanout = None
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0}
+
+    def _ensure_started(self) -> None:
+        # Сессия и пул создаются в процессе, который их использует: сокеты
+        # мастера после fork (preload_app) воркерам не передаются
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+            http.mount('https://', adapter)
+            http.mount('http://', adapter)
+            self._http = http
+            self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='hub-refresh')
+            self._fanout = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='hub-fanout')
+            self._refreshing = set()
+            self._pid = os.getpid()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    # --- Запросы без кеша (OAuth) ---
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Запрос через пул; исключения requests пробрасываются"""
+        self._ensure_started()
+        kwargs.setdefault('timeout', self.timeout)
+        return self._http.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    # --- Admin API ---
+    def _api_request(self, method: str, endpoint: str, access_token: str, data: dict = None) -> Tuple[dict, bool]:
+        """(ответ или {'error': ...}, успех)"""
+        try:
+            response = self.request(
+                method, f"{self.api_url}/{endpoint}",
+                headers={'Authorization': f'Bearer {access_token}'},
+                json=data if method == 'POST' else None
+            )
+            if response.status_code != 200:
+                return {'error': f'Hub API error: {response.status_code}', 'status': response.status_code}, False
+            return response.json(), True
+        except ValueError as e:
+            # 200 с телом не в JSON (например, страница ошибки прокси);
+            # requests.JSONDecodeError — и ValueError, и RequestException
+            print(f"Hub API error: ответ {endpoint} не JSON: {e}")
+            return {'error': 'Hub API error: ответ не JSON', 'status': response.status_code}, False
+        except requests.RequestException as e:
+            print(f"Hub API error: {e}")
+            traceback.print_exc()
+            return {'error': str(e)}, False
+
+    def _key(self, access_token: str, endpoint: str) -> str:
+        token_hash = hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:32]
+        return f"{token_hash}:{endpoint}"
+
+    def _fetch(self, key: str, endpoint: str, access_token: str) -> dict:
+        result, ok = self._api_request('GET', endpoint, access_token)
+        if ok:
+            self._cache.set(key, (self.clock(), result))
+        else:
+            self._count('errors')
+        return result
+
+    def _refresh(self, key: str, endpoint: str, access_token: str) -> None:
+        try:
+            self._fetch(key, endpoint, access_token)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh_in_background(self, key: str, endpoint: str, access_token: str) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self._stats['refreshes'] += 1
+        self._executor.submit(self._refresh, key, endpoint, access_token)
+
+    def api_get(self, endpoint: str, access_token: str) -> dict:
+        """GET {HUB_API_URL}/{endpoint} через кеш"""
+        self._ensure_started()
+        key = self._key(access_token, endpoint)
+        entry = self._cache.get(key)
+        if entry is not None:
+            fetched_at, result = entry
+            age = self.clock() - fetched_at
+            if age < self.ttl:
+                self._count('hits')
+                return result
+            if age < self.ttl + self.stale:
+                self._count('stale_hits')
+                self._refresh_in_background(key, endpoint, access_token)
+                return result
+
+        self._count('misses')
+        return self._fetch(key, endpoint, access_token)
+
+    def _timed_get(self, endpoint: str, access_token: str) -> Tuple[dict, float]:
+        start = time.perf_counter()
+        try:
+            result = self.api_get(endpoint, access_token)
+        except Exception as e:
+            print(f"Hub API error: {e}")
+            traceback.print_exc()
+            result = {'error': str(e)}
+        return result, (time.perf_counter() - start) * 1000
+
+    def api_get_many(self, endpoints: Dict[str, str], access_token: str,
+                     timeout: Optional[float] = None) -> Dict[str, dict]:
+        """Параллельные GET: name -> {'data', 'ok', 'ms'}.
+
+        Общий срок — timeout (по умолчанию таймаут запроса); разделы, не
+        успевшие к сроку, возвращаются с ошибкой, остальные — как есть.
+        """
+        self._ensure_started()
+        timeout = self.timeout if timeout is None else timeout
+        futures = {
+            name: self._fanout.submit(self._timed_get, endpoint, access_token)
+            for name, endpoint in endpoints.items()
+        }
+        done, _ = wait(futures.values(), timeout=timeout)
+
+        sections = {}
+        for name, future in futures.items():
+            if future in done:
+                result, ms = future.result()
+            else:
+                future.cancel()
+                result, ms = {'error': 'Hub API timeout'}, timeout * 1000
+                self._count('errors')
+            sections[name] = {'data': result, 'ok': 'error' not in result, 'ms': round(ms, 1)}
+        return sections
+
+    def api_post(self, endpoint: str, access_token: str, data: dict = None) -> dict:
+        """POST в Admin API; после изменения данных кеш чтений сбрасывается"""
+        result, ok = self._api_request('POST', endpoint, access_token, data)
+        if ok:
+            self._cache.clear()
+        return result
+
+    def stats_dict(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        return {'name': 'hub_api', 'items': len(self._cache), 'ttl': self.ttl, 'stale': self.stale, **stats}
+
+
+hub_client = HubClient(
+    HUB_API_URL,
+    timeout=HUB_TIMEOUT,
+    pool_size=HUB_POOL_SIZE,
+    ttl=HUB_CACHE_TTL,
+    stale=HUB_CACHE_STALE,
+    max_entries=HUB_CACHE_MAX_ENTRIES
+)
@@ -0,0 +1,490 @@
+# indexer.py - Сборка JSON-хранилища векторов (static/vector_store) из документов
+#
+# Для каждого документа манифеста:
+#   1. исходник: DOCX из static/text_instructions, иначе DOCX/PDF из static/data;
+#   2. разбор на разделы по заголовкам (стили Heading/Заголовок, .HEADERTEXT;
+#      в PDF — строки вида "5 Название"), текст между маркерами норматива;
+#   3. чанки до --chunk-chars символов, "Раздел (часть N)" для длинных разделов;
+#   4. оглавление (table_of_contents) с диапазонами чанков, как ждёт vector_index;
+#   5. эмбеддинги батчами в несколько потоков с ограничением запросов в минуту
+#      и паузой после 429;
+#   6. атомарная запись {doc_id}_vectors.json и {doc_id}_metadata.json.
+#
+# Документ пропускается, если sha256 исходника и параметры сборки совпадают
+# с записанными в metadata (index_source). У изменённого документа векторы
+# неизменившихся чанков берутся из предыдущей версии файла.
+#
+# Запуск: python -m src.indexer build [--only SP_71] [--force]
+# Без сети: python -m src.indexer build --fake --output /tmp/vector_store
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.config import (
+    TEXT_INSTRUCTIONS_DIR, PDF_DATA_DIR, VECTOR_STORE_DIR, VECTOR_BINARY_DIR,
+    GEMINI_BACKEND, EMBEDDING_MODEL, EMBEDDING_MODEL_KEY
+)
+from src.resilience import is_retryable
+from src.doc_text import START_MARKER
+from src.vector_store import convert_json_store, file_sha256, write_atomic
+
+INDEXER_VERSION = 1
+END_MARKER = "<<ТЕКСТ НОРМАТИВА КОНЕЦ>>"
+
+DEFAULT_CHUNK_CHARS = 6000
+# Начало раздела, которое эмбеддится вместе с путём заголовка для оглавления
+TOC_TEXT_CHARS = 1000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_WORKERS = 4
+DEFAULT_RPM = 600
+MAX_ATTEMPTS = 6
+
+HEADING_STYLE_RE = re.compile(r'^(?:heading|заголовок)\s*(\d+)$', re.IGNORECASE)
+SECTION_NUMBER_RE = re.compile(r'^\d+(?:\.\d+)*\.?\s+')
+PDF_HEADING_RE = re.compile(r'^\d{1,2}\.?\s+[А-ЯЁA-Z][^.]{2,150}$')
+
+Embedder = Callable[[List[str]], List[List[float]]]
+
+
+# --- Разбор документов ---
+# Блок — (уровень заголовка или None для текста, текст)
+
+def _clean(text: str) -> str:
+    return ' '.join(text.replace('\xa0', ' ').split())
+
+
+def _docx_heading_level(paragraph) -> Optional[int]:
+    style = paragraph.style.name if paragraph.style is not None else ''
+    if style == '.HEADERTEXT':
+        return 1
+    match = HEADING_STYLE_RE.match(style)
+    return int(match.group(1)) if match else None
+
+
+def _table_markdown(table) -> str:
+    rows = []
+    for row in table.rows:
+        cells = []
+        for cell in row.cells:
+            # Объединённые ячейки python-docx возвращает несколько раз подряд
+            text = _clean(cell.text)
+            if not cells or cells[-1][0] is not cell._tc:
+                cells.append((cell._tc, text))
+        rows.append('| ' + ' | '.join(text for _, text in cells) + ' |')
+    return '\n'.join(rows)
+
+
+def _between_markers(blocks: List[Tuple[Optional[int], str]]) -> List[Tuple[Optional[int], str]]:
+    texts = [text for _, text in blocks]
+    start = next((i for i, text in enumerate(texts) if START_MARKER in text), None)
+    if start is None:
+        return blocks
+    end = next((i for i in range(start + 1, len(texts)) if END_MARKER in texts[i]), len(blocks))
+    return blocks[start + 1:end]
+
+
+def docx_blocks(path) -> List[Tuple[Optional[int], str]]:
+    """Абзацы и таблицы (markdown) DOCX в порядке документа"""
+    import docx
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    document = docx.Document(path)
+    blocks = []
+    for element in document.element.body.iterchildren():
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'p':
+            paragraph = Paragraph(element, document)
+            blocks.append((_docx_heading_level(paragraph), _clean(paragraph.text)))
+        elif tag == 'tbl':
+            blocks.append((None, _table_markdown(Table(element, document))))
+    return _between_markers(blocks)
+
+
+def pdf_blocks(path) -> List[Tuple[Optional[int], str]]:
+    """Строки текстового слоя PDF; заголовки — нумерованные строки верхнего уровня"""
+    from pypdf import PdfReader
+
+    blocks = []
+    for page in PdfReader(str(path)).pages:
+        for line in (page.extract_text() or '').splitlines():
+            line = _clean(line)
+            blocks.append((1 if PDF_HEADING_RE.match(line) else None, line))
+    return _between_markers(blocks)
+
+
+def parse_sections(blocks: List[Tuple[Optional[int], str]], default_header: str) -> List[dict]:
+    """Разделы с путём заголовков; разделы без текста пропускаются"""
+    sections = []
+    path = []
+    current = {'header_name': default_header, 'level': 1, 'full_path': default_header, 'paragraphs': []}
+
+    for level, text in blocks:
+        if not text:
+            continue
+        if level is None:
+            current['paragraphs'].append(text)
+            continue
+
+        if current['paragraphs']:
+            sections.append(current)
+        header = SECTION_NUMBER_RE.sub('', text) or text
+        path = [item for item in path if item[0] < level] + [(level, header)]
+        current = {
+            'header_name': header,
+            'level': level,
+            'full_path': ' -> '.join(name for _, name in path),
+            'paragraphs': []
+        }
+
+    if current['paragraphs']:
+        sections.append(current)
+    return sections
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    """Абзац длиннее лимита — по предложениям, в крайнем случае жёстко"""
+    parts = []
+    current = ''
+    for sentence in re.split(r'(?<=[.;:!?])\s+', text):
+        while len(sentence) > max_chars:
+            if current:
+                parts.append(current)
+                current = ''
+            parts.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            parts.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_text(paragraphs: List[str], max_chars: int) -> List[str]:
+    """Абзацы раздела -> чанки не длиннее max_chars"""
+    chunks = []
+    current = ''
+    for paragraph in paragraphs:
+        pieces = [paragraph] if len(paragraph) <= max_chars else _split_long(paragraph, max_chars)
+        for piece in pieces:
+            if current and len(current) + 1 + len(piece) > max_chars:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current}\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_chunks(doc_id: str, doc_name: str, sections: List[dict], max_chars: int) -> Tuple[List[dict], List[dict]]:
+    """Чанки (без векторов) и оглавление (без эмбеддингов) документа"""
+    chunks, toc = [], []
+    for section in sections:
+        parts = split_text(section['paragraphs'], max_chars)
+        toc.append({
+            'header_name': section['header_name'],
+            'level': section['level'],
+            'full_path': section['full_path'],
+            'start_chunk_index': len(chunks),
+            'num_chunks': len(parts),
+        })
+        for i, text in enumerate(parts):
+            header = section['full_path'] if len(parts) == 1 else f"{section['full_path']} (часть {i + 1})"
+            chunks.append({
+                'doc_id': doc_id,
+                'doc_name': doc_name,
+                'chunk_id': f"{doc_id}_chunk_{len(chunks)}",
+                'section_header': header,
+                'text': text,
+            })
+    return chunks, toc
+
+
+def _toc_embed_text(entry: dict, chunks: List[dict]) -> str:
+    first_chunk = chunks[entry['start_chunk_index']]['text']
+    return f"{entry['full_path']}\n{first_chunk[:TOC_TEXT_CHARS]}"
+
+
+# --- Эмбеддинги ---
+
+class RateLimiter:
+    """Не чаще rpm запросов в минуту на все потоки; после 429 — общая пауза"""
+
+    def __init__(self, rpm: int):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+def _embed_batch(embed: Embedder, batch: List[str], limiter: RateLimiter) -> List[List[float]]:
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.acquire()
+        try:
+            vectors = embed(batch)
+            if len(vectors) != len(batch):
+                raise ValueError(f"получено {len(vectors)} эмбеддингов на {len(batch)} текстов")
+            return vectors
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS - 1 or not is_retryable(e):
+                raise
+            delay = min(60.0, 2.0 ** attempt) * (0.5 + random.random())
+            print(f"WARN: Эмбеддинги: {e}; повтор через {delay:.1f} с")
+            limiter.pause(delay)
+
+
+def embed_all(
+    texts: List[str],
+    embed: Embedder,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    limiter: Optional[RateLimiter] = None
+) -> List[List[float]]:
+    """Эмбеддинги текстов батчами в несколько потоков (порядок сохраняется)"""
+    if not texts:
+        return []
+    limiter = limiter or RateLimiter(0)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as executor:
+        results = executor.map(lambda batch: _embed_batch(embed, batch, limiter), batches)
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+
+def client_embedder(client) -> Embedder:
+    def embed(batch: List[str]) -> List[List[float]]:
+        response = client.models.embed_content(model=EMBEDDING_MODEL, contents=batch)
+        return [list(embedding.values) for embedding in response.embeddings]
+    return embed
+
+
+# --- Сборка ---
+
+def _text_key(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _write_json(path: Path, data) -> None:
+    payload = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    write_atomic(path, lambda f: f.write(payload))
+
+
+def _read_json(path: Path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def find_source(doc: dict) -> Optional[Path]:
+    """Исходник документа: DOCX из text_instructions, иначе DOCX/PDF из data"""
+    filename = doc.get('filename')
+    if not filename:
+        return None
+    stem = os.path.splitext(filename)[0]
+    candidates = [
+        Path(TEXT_INSTRUCTIONS_DIR) / filename,
+        Path(PDF_DATA_DIR) / filename,
+        Path(PDF_DATA_DIR) / f"{stem}.pdf",
+    ]
+    return next((path for path in candidates if path.exists()), None)
+
+
+def _previous_vectors(output_dir: Path, doc_id: str, metadata: Optional[dict], model_key: str) -> Tuple[dict, dict]:
+    """Векторы предыдущей версии документа по хешу текста (той же модели)"""
+    if not metadata or metadata.get('index_source', {}).get('model') != model_key:
+        return {}, {}
+    chunks = _read_json(output_dir / f"{doc_id}_vectors.json") or []
+    by_text = {_text_key(c['text']): c['vector'] for c in chunks if 'vector' in c}
+    entries = metadata.get('table_of_contents', [])
+    by_toc = {entry['embed_key']: entry['embedding'] for entry in entries if 'embed_key' in entry and 'embedding' in entry}
+    return by_text, by_toc
+
+
+def index_document(
+    doc: dict,
+    source: Path,
+    output_dir: Path,
+    embed: Embedder,
+    chunk_chars: int = DEFAULT_CHUNK_CHARS,
+    model_key: str = EMBEDDING_MODEL_KEY,
+    force: bool = False,
+    **embed_options
+) -> Optional[dict]:
+    """Проиндексировать документ; None, если он не менялся"""
+    doc_id = doc['id']
+    meta_path = output_dir / f"{doc_id}_metadata.json"
+    previous = _read_json(meta_path)
+
+    fingerprint = {
+        'filename': source.name,
+        'sha256': file_sha256(source),
+        'indexer_version': INDEXER_VERSION,
+        'chunk_chars': chunk_chars,
+        'model': model_key,
+    }
+    vectors_exist = (output_dir / f"{doc_id}_vectors.json").exists()
+    if not force and previous and vectors_exist and previous.get('index_source') == fingerprint:
+        return None
+
+    blocks = pdf_blocks(source) if source.suffix.lower() == '.pdf' else docx_blocks(source)
+    doc_name = (previous or {}).get('doc_name') or doc.get('name') or doc_id
+    sections = parse_sections(blocks, default_header=doc_name)
+    chunks, toc = build_chunks(doc_id, doc_name, sections, chunk_chars)
+    if not chunks:
+        raise ValueError("в документе не найден текст")
+
+    reuse_chunks, reuse_toc = _previous_vectors(output_dir, doc_id, previous, model_key)
+    toc_texts = [_toc_embed_text(entry, chunks) for entry in toc]
+
+    # Эмбеддятся только тексты, которых не было в предыдущей версии
+    pending = {}
+    for text in [c['text'] for c in chunks] + toc_texts:
+        key = _text_key(text)
+        if key not in reuse_chunks and key not in reuse_toc and key not in pending:
+            pending[key] = text
+    fetched = dict(zip(pending, embed_all(list(pending.values()), embed, **embed_options)))
+    known = {**reuse_chunks, **reuse_toc, **fetched}
+
+    for chunk in chunks:
+        chunk['vector'] = known[_text_key(chunk['text'])]
+    for entry, text in zip(toc, toc_texts):
+        entry['embed_key'] = _text_key(text)
+        entry['embedding'] = known[entry['embed_key']]
+
+    # Поля метаданных, собранные не индексатором (реквизиты, редакции), сохраняются
+    metadata = {k: v for k, v in (previous or {}).items() if k not in ('table_of_contents', 'index_source')}
+    metadata.update({'doc_id': doc_id, 'doc_name': doc_name, 'table_of_contents': toc, 'index_source': fingerprint})
+
+    # Метаданные пишутся последними: после сбоя между записями отпечаток
+    # старый, и документ будет пересобран при следующем запуске
+    output_dir.mkdir(parents=True, exist_ok=True)
+    _write_json(output_dir / f"{doc_id}_vectors.json", chunks)
+    _write_json(meta_path, metadata)
+    return {'chunks': len(chunks), 'sections': len(toc), 'embedded': len(fetched), 'reused': len(chunks) + len(toc) - len(fetched)}
+
+
+def build_index(
+    documents: List[dict],
+    output_dir=VECTOR_STORE_DIR,
+    embed: Optional[Embedder] = None,
+    only: Optional[List[str]] = None,
+    force: bool = False,
+    chunk_chars: int = DEFAULT_CHUNK_CHARS,
+    model_key: str = EMBEDDING_MODEL_KEY,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    rpm: int = DEFAULT_RPM
+) -> Dict[str, int]:
+    """Собрать хранилище; вернуть счётчики indexed/skipped/missing/failed"""
+    output_dir = Path(output_dir)
+    limiter = RateLimiter(rpm)
+    counts = {'indexed': 0, 'skipped': 0, 'missing': 0, 'failed': 0}
+
+    for doc in documents:
+        doc_id = doc.get('id')
+        if not doc_id or doc_id == '0' or (only and doc_id not in only):
+            continue
+        source = find_source(doc)
+        if source is None:
+            print(f"WARN: {doc_id}: исходник {doc.get('filename')} не найден")
+            counts['missing'] += 1
+            continue
+
+        start = time.perf_counter()
+        try:
+            result = index_document(
+                doc, source, output_dir, embed, chunk_chars=chunk_chars, model_key=model_key, force=force,
+                batch_size=batch_size, workers=workers, limiter=limiter
+            )
+        except Exception as e:
+            print(f"ОШИБКА: {doc_id}: {e}")
+            counts['failed'] += 1
+            continue
+
+        if result is None:
+            counts['skipped'] += 1
+            continue
+        counts['indexed'] += 1
+        print(
+            f"INFO: {doc_id}: {result['chunks']} чанков, {result['sections']} разделов, "
+            f"эмбеддингов {result['embedded']} (повторно использовано {result['reused']}), "
+            f"{time.perf_counter() - start:.1f} с"
+        )
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Индексатор документов в векторное хранилище")
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--output', default=str(VECTOR_STORE_DIR), help="Каталог JSON-хранилища")
+    parser.add_argument('--only', default='', help="Только эти doc_id (через запятую)")
+    parser.add_argument('--force', action='store_true', help="Пересобрать и неизменившиеся документы")
+    parser.add_argument('--chunk-chars', type=int, default=DEFAULT_CHUNK_CHARS)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Текстов в запросе эмбеддингов")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Одновременных запросов")
+    parser.add_argument('--rpm', type=int, default=DEFAULT_RPM, help="Лимит запросов в минуту (0 — без лимита)")
+    parser.add_argument('--fake', action='store_true', help="Локальные эмбеддинги без сети (src/fake_gemini.py)")
+    parser.add_argument('--no-binary', action='store_true', help="Не обновлять бинарное хранилище")
+    args = parser.parse_args(argv)
+
+    output_dir = Path(args.output)
+    is_main_store = output_dir.resolve() == Path(VECTOR_STORE_DIR).resolve()
+    if (args.fake or GEMINI_BACKEND != 'google') and is_main_store:
+        print("ОШИБКА: Эмбеддинги fake пишутся только в отдельный каталог (--output)")
+        return 1
+
+    if args.fake:
+        from src.fake_gemini import FakeGeminiClient
+        client, model_key = FakeGeminiClient(), f"fake/{EMBEDDING_MODEL}"
+    else:
+        from src.gemini_client import get_client
+        client, model_key = get_client(), EMBEDDING_MODEL_KEY
+        if client is None:
+            print("ОШИБКА: Gemini не настроен (GEMINI_API_KEY)")
+            return 1
+
+    from src.rag import get_document_metadata
+    counts = build_index(
+        get_document_metadata(), output_dir, client_embedder(client),
+        only=[x.strip() for x in args.only.split(',') if x.strip()] or None,
+        force=args.force, chunk_chars=args.chunk_chars, model_key=model_key,
+        batch_size=args.batch_size, workers=args.workers, rpm=args.rpm
+    )
+    print(
+        f"INFO: Индексация: собрано {counts['indexed']}, без изменений {counts['skipped']}, "
+        f"нет исходника {counts['missing']}, ошибок {counts['failed']}"
+    )
+
+    # Сервис читает бинарное хранилище; оно собирается из основного каталога
+    if counts['indexed'] and not args.no_binary and is_main_store:
+        convert_json_store(output_dir, VECTOR_BINARY_DIR)
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
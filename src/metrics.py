@@ -0,0 +1,302 @@
+# metrics.py - Метрики конвейера чата: гистограммы этапов, счётчики токенов, формат Prometheus
+#
+# StageTimings — длительности этапов одного запроса: сводка уходит в журнал и
+# в SSE-событие timing, каждое измерение — в гистограмму chat_stage_seconds.
+# Гистограмма — фиксированные корзины: наблюдение — bisect и два сложения
+# под блокировкой метрики, без выделения памяти на горячем пути.
+#
+# Воркеры gunicorn — отдельные процессы со своими счётчиками. Если задан
+# METRICS_DIR, каждый воркер раз в METRICS_FLUSH_INTERVAL секунд пишет снимок
+# в <pid>.json, и /metrics суммирует свежие снимки всех воркеров узла;
+# снимки старше METRICS_STALE (воркер завершён) не учитываются и удаляются.
+import os
+import json
+import time
+import bisect
+import threading
+import traceback
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from src.config import METRICS_DIR, METRICS_FLUSH_INTERVAL, METRICS_STALE
+
+# Секунды: от быстрых локальных этапов до полного стрима ответа
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """Семейство рядов с одинаковыми метками"""
+    kind = ''
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}
+        registry.register(self)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Ряды в виде JSON: ключ — список значений меток"""
+        with self._lock:
+            return {json.dumps(list(key), ensure_ascii=False): self._copy(value) for key, value in self._series.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series = {}
+
+    def _copy(self, value):
+        return value
+
+    def render(self, series: Dict[str, object]) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key in sorted(series):
+            lines.extend(self._render_series(tuple(json.loads(key)), series[key]))
+        return lines
+
+    def _render_series(self, labels: tuple, value) -> list:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self.registry.ensure_started()
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0.0) + amount
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0.0) + value
+
+    def _render_series(self, labels: tuple, value) -> list:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {_format_number(value)}"]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(registry, name, help_text, labels)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        # Ряд: число наблюдений по корзинам (последняя — +Inf), затем сумма
+        position = bisect.bisect_left(self.buckets, value)
+        self.registry.ensure_started()
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[position] += 1
+            series[-1] += value
+
+    def _copy(self, value):
+        return list(value)
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def _render_series(self, labels: tuple, value) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value[:-1]):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else _format_number(bound)
+            le_label = 'le="' + le + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le_label)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_number(round(value[-1], 6))}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Метрики процесса и их снимки для соседних воркеров"""
+
+    def __init__(self, directory: str = '', flush_interval: float = 5.0, stale: float = 60.0):
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self.stale = stale
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def register(self, metric: Metric) -> None:
+        self._metrics[metric.name] = metric
+
+    def ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # После fork наблюдения родителя уже учтены в его снимке
+            if self._pid is not None:
+                for metric in self._metrics.values():
+                    metric.reset()
+            self._pid = os.getpid()
+            if self.directory is not None and self.flush_interval > 0:
+                threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def _snapshot_path(self, pid: int) -> Path:
+        return self.directory / f"{pid}.json"
+
+    def flush(self) -> None:
+        """Записать снимок процесса (атомарно: временный файл + rename)"""
+        if self.directory is None or self._pid != os.getpid():
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._snapshot_path(self._pid)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _flush_loop(self) -> None:
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"WARN: Снимок метрик не записан: {e}")
+
+    def _other_snapshots(self) -> list:
+        if self.directory is None or not self.directory.is_dir():
+            return []
+        snapshots = []
+        now = time.time()
+        for path in self.directory.glob('*.json'):
+            if path.stem == str(os.getpid()):
+                continue
+            try:
+                # Воркер завершён: его снимок больше не нужен
+                if now - path.stat().st_mtime > self.stale:
+                    path.unlink(missing_ok=True)
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def collect(self) -> Dict[str, dict]:
+        """Сумма рядов своего процесса и свежих снимков остальных воркеров"""
+        merged = {name: {} for name in self._metrics}
+        for snapshot in [self.snapshot()] + self._other_snapshots():
+            for name, series in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                for key, value in series.items():
+                    merged[name][key] = metric.merge(merged[name].get(key), value)
+        return merged
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (text/plain; version=0.0.4)"""
+        lines = []
+        for name, series in self.collect().items():
+            lines.extend(self._metrics[name].render(series))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry(METRICS_DIR, METRICS_FLUSH_INTERVAL, METRICS_STALE)
+
+stage_seconds = Histogram(
+    registry, 'chat_stage_seconds', "Длительность этапа обработки запроса чата", labels=('stage',)
+)
+requests_total = Counter(
+    registry, 'chat_requests_total', "Запросы чата по намерению", labels=('intent',)
+)
+gemini_tokens_total = Counter(
+    registry, 'gemini_tokens_total', "Токены Gemini по usage_metadata ответов", labels=('call', 'kind')
+)
+
+# kind метрики токенов -> поле usage_metadata
+TOKEN_FIELDS = (
+    ('prompt', 'prompt_token_count'),
+    ('output', 'candidates_token_count'),
+    ('cached', 'cached_content_token_count'),
+    ('thoughts', 'thoughts_token_count'),
+)
+
+
+def record_usage(call: str, usage) -> None:
+    """Токены из usage_metadata ответа Gemini (call — stream, json, text)"""
+    if usage is None:
+        return
+    try:
+        for kind, field in TOKEN_FIELDS:
+            value = getattr(usage, field, None)
+            if value:
+                gemini_tokens_total.inc(call, kind, amount=float(value))
+    except Exception as e:
+        print(f"WARN: Токены не учтены: {e}")
+        traceback.print_exc()
+
+
+class StageTimings:
+    """Длительности этапов одного запроса (мс); каждое измерение — в chat_stage_seconds"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        # (этап, начало от старта запроса, длительность) в мс — для профилей
+        self.spans = []
+
+    def record(self, name: str, seconds: float) -> None:
+        ms = seconds * 1000
+        self.stages[name] = ms
+        self.spans.append((name, (time.perf_counter() - self.started) * 1000 - ms, ms))
+        stage_seconds.observe(seconds, name)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark(self, name: str) -> None:
+        """Отметка времени от начала запроса (например, первый токен)"""
+        self.record(name, time.perf_counter() - self.started)
+
+    def as_dict(self) -> Dict[str, float]:
+        """Этапы в мс для события timing"""
+        return {name: round(ms, 1) for name, ms in self.stages.items()}
+
+    def summary(self) -> str:
+        return ", ".join(f"{name}={ms:.0f}мс" for name, ms in self.stages.items())
+
+    def log(self, label: str = "Этапы") -> None:
+        print(f"INFO: {label}: {self.summary()}")
+
+
+def stage(timings: Optional[StageTimings], name: str):
+    """timings.stage(name) или пустой контекст, если замер не ведётся"""
+    return timings.stage(name) if timings is not None else nullcontext()
@@ -0,0 +1,239 @@
+# pipeline.py - Параллельное выполнение этапов подготовки RAG-контекста
+#
+# До первого токена ответа нужны: решение о повторном поиске, эмбеддинг
+# вопроса, расширение запроса и выбор документов. Независимые этапы
+# (сетевые вызовы Gemini) запускаются одновременно в общем пуле потоков.
+# Async-версии (для src/asgi.py) запускают те же этапы задачами asyncio.
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from src.config import PIPELINE_WORKERS
+from src.metrics import StageTimings
+from src.profiler import profiler
+from src.rag import (
+    should_rerun_rag, route_query_to_docs, expand_query, embed_query, find_relevant_chunks,
+    ashould_rerun_rag, aroute_query_to_docs, aexpand_query, aembed_query, afind_relevant_chunks
+)
+
+# Ошибка run_retrieval, когда роутер не выбрал ни одного документа
+NO_DOCUMENTS = "Не определены документы."
+
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='rag-stage')
+
+
+def submit_stage(timings: StageTimings, name: str, fn: Callable, *args, **kwargs) -> Future:
+    """Запустить этап в пуле с замером времени (и в профиле запроса, если он снимается)"""
+    profile = profiler.current()
+
+    def run():
+        with profiler.attach(profile), timings.stage(name):
+            return fn(*args, **kwargs)
+    return _executor.submit(run)
+
+
+def stage_result(future: Optional[Future], default=None):
+    """Результат этапа; ошибка этапа не роняет запрос"""
+    if future is None:
+        return default
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"Ошибка этапа подготовки: {e}")
+        traceback.print_exc()
+        return default
+
+
+def discard(*futures: Optional[Future]) -> None:
+    """Отменить ещё не начатые этапы; результаты уже начатых игнорируются"""
+    for future in futures:
+        if future is not None:
+            future.cancel()
+
+
+def run_retrieval(
+    user_query: str,
+    timings: StageTimings,
+    routing_query: Optional[str] = None,
+    doc_ids: Optional[List[str]] = None,
+    top_k: int = 8,
+    embed_future: Optional[Future] = None,
+    expand_future: Optional[Future] = None
+) -> Tuple[Optional[List[dict]], Optional[str], Optional[str]]:
+    """Эмбеддинг и расширение параллельно, затем роутинг и поиск.
+
+    Возвращает (sources, context, error) как find_relevant_chunks;
+    error == NO_DOCUMENTS, если роутер не выбрал документы.
+    """
+    if embed_future is None:
+        embed_future = submit_stage(timings, 'embed', embed_query, user_query)
+    if expand_future is None:
+        expand_future = submit_stage(timings, 'expand', expand_query, user_query)
+
+    query_embedding = stage_result(embed_future)
+
+    if not doc_ids:
+        with timings.stage('route'):
+            doc_ids = route_query_to_docs(routing_query or user_query, query_embedding)
+        if not doc_ids:
+            discard(expand_future)
+            return None, None, NO_DOCUMENTS
+
+    expanded_query = stage_result(expand_future, user_query)
+
+    with timings.stage('search'):
+        return find_relevant_chunks(
+            doc_ids, user_query, top_k=top_k,
+            query_embedding=query_embedding, expanded_query=expanded_query, timings=timings
+        )
+
+
+class PreparedContext(NamedTuple):
+    reuse_cached: bool
+    sources: Optional[List[dict]]
+    context: Optional[str]
+    error: Optional[str]
+    query_embedding: Optional[List[float]]
+
+
+def prepare_rag_context(
+    user_input: str,
+    history: List[dict],
+    timings: StageTimings,
+    category_doc_ids: Optional[str] = None,
+    has_cached_context: bool = False,
+    previous_query: Optional[str] = None,
+    previous_embedding: Optional[List[float]] = None
+) -> PreparedContext:
+    """Подготовка контекста для RAG-ответа.
+
+    Эмбеддинг и расширение запроса стартуют сразу. Решение о повторном
+    поиске принимается по эмбеддингу (LLM — только в неоднозначных случаях),
+    пока расширение ещё выполняется; если решено использовать кеш,
+    поиск не выполняется.
+    """
+    embed_future = submit_stage(timings, 'embed', embed_query, user_input)
+    expand_future = submit_stage(timings, 'expand', expand_query, user_input)
+
+    if has_cached_context:
+        query_embedding = stage_result(embed_future)
+        with timings.stage('rerun'):
+            run_new_search = should_rerun_rag(history, query_embedding, previous_query, previous_embedding)
+        if not run_new_search:
+            discard(expand_future)
+            return PreparedContext(True, None, None, None, query_embedding)
+
+    doc_ids = category_doc_ids.split(',') if category_doc_ids else None
+    # Локальный роутер использует эмбеддинг вопроса, LLM-резерв — весь диалог
+    contextual_query = "\n".join([f"{m['role']}: {m['content']}" for m in history])
+
+    sources, context, error = run_retrieval(
+        user_input, timings,
+        routing_query=contextual_query,
+        doc_ids=doc_ids,
+        embed_future=embed_future,
+        expand_future=expand_future
+    )
+    return PreparedContext(False, sources, context, error, stage_result(embed_future))
+
+
+# --- Async-версии ---
+# Этапы — задачи asyncio в цикле запроса. При отмене запроса (клиент
+# отключился) незавершённые этапы отменяются вместе с их сетевыми вызовами.
+
+def create_stage(timings: StageTimings, name: str, coro) -> asyncio.Task:
+    """Запустить этап задачей с замером времени"""
+    async def run():
+        with timings.stage(name):
+            return await coro
+    return asyncio.create_task(run())
+
+
+async def astage_result(task: Optional[asyncio.Task], default=None):
+    """Результат этапа; ошибка этапа не роняет запрос"""
+    if task is None:
+        return default
+    try:
+        return await task
+    except Exception as e:
+        print(f"Ошибка этапа подготовки: {e}")
+        traceback.print_exc()
+        return default
+
+
+def cancel_stages(*tasks: Optional[asyncio.Task]) -> None:
+    for task in tasks:
+        if task is not None and not task.done():
+            task.cancel()
+
+
+async def arun_retrieval(
+    user_query: str,
+    timings: StageTimings,
+    routing_query: Optional[str] = None,
+    doc_ids: Optional[List[str]] = None,
+    top_k: int = 8,
+    embed_task: Optional[asyncio.Task] = None,
+    expand_task: Optional[asyncio.Task] = None
+) -> Tuple[Optional[List[dict]], Optional[str], Optional[str]]:
+    """run_retrieval для async-пайплайна"""
+    if embed_task is None:
+        embed_task = create_stage(timings, 'embed', aembed_query(user_query))
+    if expand_task is None:
+        expand_task = create_stage(timings, 'expand', aexpand_query(user_query))
+
+    try:
+        query_embedding = await astage_result(embed_task)
+
+        if not doc_ids:
+            with timings.stage('route'):
+                doc_ids = await aroute_query_to_docs(routing_query or user_query, query_embedding)
+            if not doc_ids:
+                return None, None, NO_DOCUMENTS
+
+        expanded_query = await astage_result(expand_task, user_query)
+
+        with timings.stage('search'):
+            return await afind_relevant_chunks(
+                doc_ids, user_query, top_k=top_k,
+                query_embedding=query_embedding, expanded_query=expanded_query, timings=timings
+            )
+    finally:
+        cancel_stages(embed_task, expand_task)
+
+
+async def aprepare_rag_context(
+    user_input: str,
+    history: List[dict],
+    timings: StageTimings,
+    category_doc_ids: Optional[str] = None,
+    has_cached_context: bool = False,
+    previous_query: Optional[str] = None,
+    previous_embedding: Optional[List[float]] = None
+) -> PreparedContext:
+    """prepare_rag_context для async-пайплайна"""
+    embed_task = create_stage(timings, 'embed', aembed_query(user_input))
+    expand_task = create_stage(timings, 'expand', aexpand_query(user_input))
+
+    try:
+        if has_cached_context:
+            query_embedding = await astage_result(embed_task)
+            with timings.stage('rerun'):
+                run_new_search = await ashould_rerun_rag(history, query_embedding, previous_query, previous_embedding)
+            if not run_new_search:
+                return PreparedContext(True, None, None, None, query_embedding)
+
+        doc_ids = category_doc_ids.split(',') if category_doc_ids else None
+        contextual_query = "\n".join([f"{m['role']}: {m['content']}" for m in history])
+
+        sources, context, error = await arun_retrieval(
+            user_input, timings,
+            routing_query=contextual_query,
+            doc_ids=doc_ids,
+            embed_task=embed_task,
+            expand_task=expand_task
+        )
+        return PreparedContext(False, sources, context, error, await astage_result(embed_task))
+    finally:
+        cancel_stages(embed_task, expand_task)
@@ -0,0 +1,330 @@
+# profiler.py - Сэмплирующий профилировщик /get_response и сохранение медленных запросов
+#
+# Отдельный поток раз в PROFILE_INTERVAL_MS снимает стеки потоков, занятых
+# профилируемыми запросами (sys._current_frames), и считает одинаковые стеки.
+# Поток запроса и потоки его этапов подготовки (src/pipeline.py) — в одном
+# профиле. Остальные потоки не трогаются, и без профилируемых запросов
+# поток-сэмплер спит.
+#
+# Когда запрос профилируется:
+#   - заголовок X-Profile: 1 от администратора — сохраняется всегда;
+#   - переключатель в админке (на N минут, общий для воркеров через файл
+#     в PROFILE_DIR) — каждый запрос, сохраняется всегда;
+#   - PROFILE_SLOW_MS > 0 (по умолчанию выключено) — сэмплирование запроса
+#     начинается, только когда порог прошёл, а первой части ответа ещё нет,
+#     и заканчивается с первой частью; сохраняется, только если первая часть
+#     (или конец, если ответа нет) пришла позже порога. Быстрые запросы
+#     сэмплер не будит.
+#
+# Профиль — JSON в PROFILE_DIR: этапы и их интервалы (StageTimings) и стеки
+# в формате collapsed ("корень;...;лист" -> число сэмплов). Формат folded
+# (строка "стек число") открывают flamegraph.pl, speedscope и inferno.
+# Хранятся последние PROFILE_MAX_FILES профилей.
+import os
+import re
+import sys
+import json
+import time
+import secrets
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.config import BASE_DIR, PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_SLOW_MS, PROFILE_MAX_FILES
+from src.metrics import StageTimings
+
+PROFILE_ID_RE = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+TOGGLE_FILE = 'enabled_until'
+# Как часто перечитывать файл переключателя (с)
+TOGGLE_CHECK_INTERVAL = 1.0
+
+_SITE_PACKAGES = ('site-packages' + os.sep, 'dist-packages' + os.sep)
+
+
+def _short_path(filename: str) -> str:
+    """Путь относительно проекта или site-packages; иначе имя файла"""
+    root = str(BASE_DIR) + os.sep
+    if filename.startswith(root):
+        return filename[len(root):]
+    for marker in _SITE_PACKAGES:
+        pos = filename.rfind(marker)
+        if pos >= 0:
+            return filename[pos + len(marker):]
+    return os.path.basename(filename)
+
+
+class RequestProfile:
+    """Сэмплы стеков и этапы одного запроса"""
+
+    def __init__(self, profile_id: str, reason: str, label: str, timings: StageTimings,
+                 armed_at: float = 0.0):
+        self.id = profile_id
+        self.reason = reason
+        self.label = label
+        self.timings = timings
+        self.started_at = time.time()
+        # perf_counter, с которого сэмплировать (медленные — после порога)
+        self.armed_at = armed_at
+        self.stacks = Counter()
+        self.samples = 0
+
+    def sampling(self, now: float) -> bool:
+        """Сэмплировать ли сейчас: медленный — от порога до первой части ответа"""
+        if now < self.armed_at:
+            return False
+        return self.reason != 'slow' or 'first_token' not in self.timings.stages
+
+    def add(self, stack: str) -> None:
+        self.stacks[stack] += 1
+        self.samples += 1
+
+    def to_dict(self, duration_ms: float, interval_ms: float) -> dict:
+        return {
+            'id': self.id,
+            'reason': self.reason,
+            'label': self.label,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'duration_ms': round(duration_ms, 1),
+            'first_token_ms': round(self.timings.stages['first_token'], 1) if 'first_token' in self.timings.stages else None,
+            'pid': os.getpid(),
+            'interval_ms': interval_ms,
+            'samples': self.samples,
+            'stages': self.timings.as_dict(),
+            'spans': [
+                {'stage': name, 'start_ms': round(start, 1), 'duration_ms': round(ms, 1)}
+                for name, start, ms in self.timings.spans
+            ],
+            'stacks': dict(self.stacks.most_common()),
+        }
+
+
+class SamplingProfiler:
+    """Сэмплер процесса: потоки профилируемых запросов -> их профили"""
+
+    def __init__(self, directory, interval_ms: float, slow_ms: float, max_files: int):
+        self.directory = Path(directory)
+        self.interval_ms = interval_ms
+        self.slow_ms = slow_ms
+        self.max_files = max_files
+        self._threads: Dict[int, RequestProfile] = {}
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._names = {}
+        self._pid = None
+        self._enabled_until = 0.0
+        self._toggle_checked = 0.0
+        self._stats = {'profiled': 0, 'saved': 0, 'discarded': 0}
+
+    def _ensure_started(self) -> None:
+        # Поток-сэмплер создаётся в процессе, который обрабатывает запросы
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._threads = {}
+            threading.Thread(target=self._run, name='profiler', daemon=True).start()
+            self._pid = os.getpid()
+
+    # --- Сэмплирование ---
+    def _frame_name(self, code) -> str:
+        name = self._names.get(code)
+        if name is None:
+            name = f"{_short_path(code.co_filename)}:{code.co_name}".replace(';', ',').replace(' ', '_')
+            self._names[code] = name
+        return name
+
+    def _collapse(self, frame) -> str:
+        names = []
+        while frame is not None:
+            names.append(self._frame_name(frame.f_code))
+            frame = frame.f_back
+        names.reverse()
+        return ';'.join(names)
+
+    def _targets(self) -> list:
+        """Потоки, которые пора сэмплировать; без них ждать до ближайшего порога"""
+        with self._cond:
+            while True:
+                now = time.perf_counter()
+                targets = [(tid, p) for tid, p in self._threads.items() if p.sampling(now)]
+                if targets:
+                    return targets
+                pending = [p.armed_at for p in self._threads.values() if p.armed_at > now]
+                self._cond.wait(min(pending) - now if pending else None)
+
+    def _run(self) -> None:
+        interval = self.interval_ms / 1000
+        while True:
+            targets = self._targets()
+            frames = sys._current_frames()
+            for thread_id, profile in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    profile.add(self._collapse(frame))
+            del frames, frame
+            time.sleep(interval)
+
+    def current(self) -> Optional[RequestProfile]:
+        """Профиль, к которому привязан текущий поток"""
+        return getattr(self._local, 'profile', None)
+
+    @contextmanager
+    def attach(self, profile: Optional[RequestProfile]):
+        """Сэмплировать текущий поток в profile (None — ничего не делать)"""
+        if profile is None:
+            yield
+            return
+        self._ensure_started()
+        thread_id = threading.get_ident()
+        previous = self._threads.get(thread_id)
+        with self._cond:
+            self._threads[thread_id] = profile
+            self._cond.notify()
+        self._local.profile = profile
+        try:
+            yield
+        finally:
+            self._local.profile = previous
+            with self._cond:
+                if previous is None:
+                    self._threads.pop(thread_id, None)
+                else:
+                    self._threads[thread_id] = previous
+
+    # --- Когда профилировать ---
+    def new_id(self) -> str:
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}"
+
+    def enabled_until(self) -> float:
+        """Срок переключателя из админки (unix-время; 0 — выключен)"""
+        now = time.time()
+        if now - self._toggle_checked >= TOGGLE_CHECK_INTERVAL:
+            self._toggle_checked = now
+            try:
+                self._enabled_until = float((self.directory / TOGGLE_FILE).read_text())
+            except (OSError, ValueError):
+                self._enabled_until = 0.0
+        return self._enabled_until if self._enabled_until > now else 0.0
+
+    def set_enabled(self, minutes: float) -> float:
+        """Профилировать все запросы minutes минут (0 — выключить)"""
+        until = time.time() + minutes * 60 if minutes > 0 else 0.0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / TOGGLE_FILE).write_text(str(until))
+        self._enabled_until = until
+        self._toggle_checked = time.time()
+        return until
+
+    def _reason(self, profile_id: Optional[str]) -> Optional[str]:
+        if profile_id:
+            return 'header'
+        if self.enabled_until():
+            return 'toggle'
+        if self.slow_ms > 0:
+            return 'slow'
+        return None
+
+    @contextmanager
+    def profile_request(self, timings: StageTimings, profile_id: Optional[str] = None, label: str = ''):
+        """Профилировать обработку запроса (поток вызывающего и потоки этапов)"""
+        reason = self._reason(profile_id)
+        if reason is None:
+            yield None
+            return
+
+        started = time.perf_counter()
+        armed_at = started + self.slow_ms / 1000 if reason == 'slow' else 0.0
+        profile = RequestProfile(profile_id or self.new_id(), reason, label, timings, armed_at)
+        self._count('profiled')
+        try:
+            with self.attach(profile):
+                yield profile
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            waited_ms = timings.stages.get('first_token', duration_ms)
+            if reason != 'slow' or waited_ms >= self.slow_ms:
+                self._save(profile, duration_ms)
+            else:
+                self._count('discarded')
+
+    def _count(self, name: str) -> None:
+        with self._cond:
+            self._stats[name] += 1
+
+    # --- Хранение ---
+    def _path(self, profile_id: str) -> Optional[Path]:
+        if not PROFILE_ID_RE.match(profile_id or ''):
+            return None
+        return self.directory / f"{profile_id}.json"
+
+    def _save(self, profile: RequestProfile, duration_ms: float) -> None:
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(profile.id)
+            tmp = path.with_suffix('.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(profile.to_dict(duration_ms, self.interval_ms), f, ensure_ascii=False)
+            os.replace(tmp, path)
+            self._count('saved')
+            print(f"INFO: Профиль {profile.id} ({profile.reason}, {duration_ms:.0f} мс, {profile.samples} сэмплов) сохранён")
+            self._prune()
+        except Exception as e:
+            print(f"WARN: Профиль {profile.id} не сохранён: {e}")
+
+    def _files(self) -> List[Path]:
+        if not self.directory.is_dir():
+            return []
+        return sorted((p for p in self.directory.glob('*.json') if PROFILE_ID_RE.match(p.stem)), reverse=True)
+
+    def _prune(self) -> None:
+        for path in self._files()[self.max_files:]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def list_profiles(self) -> List[dict]:
+        """Сохранённые профили без стеков, новые первыми"""
+        result = []
+        for path in self._files():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            data.pop('stacks', None)
+            data.pop('spans', None)
+            result.append(data)
+        return result
+
+    def load(self, profile_id: str) -> Optional[dict]:
+        path = self._path(profile_id)
+        if path is None or not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def folded(self, profile_id: str) -> Optional[str]:
+        """Стеки в формате collapsed: "корень;...;лист число" на строку"""
+        data = self.load(profile_id)
+        if data is None:
+            return None
+        return ''.join(f"{stack} {count}\n" for stack, count in data['stacks'].items())
+
+    def stats_dict(self) -> dict:
+        until = self.enabled_until()
+        result = {
+            'interval_ms': self.interval_ms,
+            'slow_ms': self.slow_ms,
+            'enabled_until': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(until)) if until else None,
+            'active_threads': len(self._threads),
+        }
+        with self._cond:
+            result.update(self._stats)
+        return result
+
+
+profiler = SamplingProfiler(PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_SLOW_MS, PROFILE_MAX_FILES)
@@ -1,41 +1,99 @@
 # rag.py - RAG (Retrieval-Augmented Generation) логика
 import os
-import re
 import json
+import asyncio
+import hashlib
+import threading
 import traceback
+import unicodedata
 from typing import List, Tuple, Optional
 
-import docx
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-
-from src.config import VECTOR_STORE_DIR, TEXT_INSTRUCTIONS_DIR, MANIFEST_PATH
+from src.config import (
+    TEXT_INSTRUCTIONS_DIR, MANIFEST_PATH, ROUTER_CONFIDENCE, ROUTER_LLM_FALLBACK,
+    GEMINI_MODEL_KEY, CACHE_DIR, QUERY_EXPANSION_CACHE_ENABLED, QUERY_EXPANSION_CACHE_TTL,
+    QUERY_EXPANSION_CACHE_SIZE, QUERY_EXPANSION_CACHE_DISK_ENTRIES
+)
+from src.cache import TwoTierCache
 from src.prompts import QUERY_EXPANSION_PROMPT
 from src.gemini_client import (
     generate_json, generate_text, embed_texts,
-    DocumentRouterResponse, RagDecision, client
+    agenerate_json, agenerate_text, aembed_texts,
+    DocumentRouterResponse, RagDecision, get_client
 )
+from src.vector_index import VectorIndex, get_vector_index
+from src.doc_router import get_document_router
+from src.followup import needs_new_search
+from src.doc_text import get_document_text
+from src.metrics import StageTimings, stage
+from src.scoring import fuse_queries, merge_ranges, score_ranges, top_k as top_k_rows
+
+
+# --- Манифест документов ---
+# Читается при первом обращении, а не при импорте модуля
+_manifest = None
+_manifest_by_id = {}
+_manifest_lock = threading.Lock()
+
+
+def _load_manifest() -> List[dict]:
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            documents = json.load(f)
+        print(f"INFO: Манифест документов загружен ({len(documents)} шт.)")
+        return documents
+    except Exception as e:
+        print(f"ОШИБКА: Не удалось загрузить манифест: {e}")
+        return []
+
+
+# --- Кеш расширений запроса ---
+# Пространство ключей зависит от шаблона и модели: при их смене кеш не используется
+_EXPANSION_NAMESPACE = hashlib.sha256(
+    f"{GEMINI_MODEL_KEY}\n{QUERY_EXPANSION_PROMPT}".encode('utf-8')
+).hexdigest()[:16]
+
+expansion_cache = TwoTierCache(
+    'expansions', CACHE_DIR,
+    max_items=QUERY_EXPANSION_CACHE_SIZE,
+    max_disk_entries=QUERY_EXPANSION_CACHE_DISK_ENTRIES,
+    encode=lambda text: text.encode('utf-8'),
+    decode=lambda blob: blob.decode('utf-8'),
+    ttl=QUERY_EXPANSION_CACHE_TTL
+) if QUERY_EXPANSION_CACHE_ENABLED else None
 
 
-# --- Загрузка манифеста документов ---
-ALL_DOCUMENTS_METADATA = []
+def normalize_query(user_query: str) -> str:
+    """Запрос без регистра, пунктуации и лишних пробелов"""
+    text = unicodedata.normalize('NFC', user_query).lower()
+    text = ''.join(' ' if unicodedata.category(ch).startswith('P') else ch for ch in text)
+    return ' '.join(text.split())
 
-try:
-    with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
-        ALL_DOCUMENTS_METADATA = json.load(f)
-    print(f"INFO: Манифест документов загружен ({len(ALL_DOCUMENTS_METADATA)} шт.)")
-except Exception as e:
-    print(f"ОШИБКА: Не удалось загрузить манифест: {e}")
 
+def _expansion_key(user_query: str) -> str:
+    return hashlib.sha256(f"{_EXPANSION_NAMESPACE}\n{normalize_query(user_query)}".encode('utf-8')).hexdigest()
 
-def get_document_metadata():
+
+def get_document_metadata() -> List[dict]:
     """Получить метаданные всех документов"""
-    return ALL_DOCUMENTS_METADATA
+    global _manifest, _manifest_by_id
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                documents = _load_manifest()
+                _manifest_by_id = {doc['id']: doc for doc in documents if doc.get('id')}
+                _manifest = documents
+    return _manifest
+
+
+def get_document(doc_id: str) -> Optional[dict]:
+    """Запись манифеста по id"""
+    get_document_metadata()
+    return _manifest_by_id.get(doc_id)
 
 
 def get_full_docx_text(doc_id: str) -> Tuple[Optional[str], Optional[str]]:
-    """Получить полный текст документа DOCX"""
-    doc_info = next((doc for doc in ALL_DOCUMENTS_METADATA if doc['id'] == doc_id), None)
+    """Получить полный текст документа DOCX (через кеш текста, см. src/doc_text.py)"""
+    doc_info = get_document(doc_id)
     if not doc_info or 'filename' not in doc_info:
         return None, "Информация о файле не найдена в манифесте."
 
@@ -44,15 +102,7 @@ def get_full_docx_text(doc_id: str) -> Tuple[Optional[str], Optional[str]]:
         return None, f"Файл {doc_info['filename']} не найден."
 
     try:
-        document = docx.Document(filepath)
-        full_text = '\n'.join([p.text for p in document.paragraphs])
-
-        start_marker = "<<ТЕКСТ НОРМАТИВА НАЧАЛО>>"
-        marker_pos = full_text.find(start_marker)
-        if marker_pos != -1:
-            full_text = full_text[marker_pos + len(start_marker):]
-
-        return full_text.strip(), None
+        return get_document_text(filepath), None
     except Exception as e:
         traceback.print_exc()
         return None, f"Ошибка чтения файла: {e}"
@@ -78,15 +128,27 @@ def get_user_intent(user_query: str) -> Tuple[str, Optional[str]]:
     return "RAG_QUERY", None
 
 
-def should_rerun_rag(history: List[dict]) -> bool:
-    """Определить, нужен ли новый RAG-поиск"""
-    if not client or len(history) < 2:
+def _local_rerun_decision(
+    history: List[dict],
+    query_embedding: Optional[List[float]],
+    previous_query: Optional[str],
+    previous_embedding: Optional[List[float]]
+) -> Optional[bool]:
+    """Решение без LLM или None, если нужен LLM"""
+    if not get_client() or len(history) < 2:
         return True
 
+    local_decision = needs_new_search(history[-1]['content'], query_embedding, previous_query, previous_embedding)
+    if local_decision is not None:
+        print(f"INFO: RAG-детектор (локально): {'НОВЫЙ ПОИСК' if local_decision else 'КЕШ'}")
+    return local_decision
+
+
+def _rerun_prompt(history: List[dict]) -> str:
     last_user_query = history[-1]['content']
     previous_model_response = history[-2]['content']
 
-    prompt = f"""You are analyzing a conversation. Decide if a new search is required.
+    return f"""You are analyzing a conversation. Decide if a new search is required.
 
     Previous AI Response:
     ---
@@ -101,191 +163,343 @@ def should_rerun_rag(history: List[dict]) -> bool:
     Do we need a new search?
     """
 
-    decision = generate_json(prompt, RagDecision)
+
+def _rerun_result(decision) -> bool:
     if decision:
         print(f"INFO: RAG-детектор: {'НОВЫЙ ПОИСК' if decision.requires_new_search else 'КЕШ'}. {decision.reason}")
         return decision.requires_new_search
-
     return True
 
 
-def route_query_to_docs(user_query: str) -> List[str]:
-    """Выбрать релевантные документы"""
-    if not client or not ALL_DOCUMENTS_METADATA:
-        return []
+def should_rerun_rag(
+    history: List[dict],
+    query_embedding: Optional[List[float]] = None,
+    previous_query: Optional[str] = None,
+    previous_embedding: Optional[List[float]] = None
+) -> bool:
+    """Определить, нужен ли новый RAG-поиск.
+
+    Сначала локальный детектор (src/followup.py) по вопросу, давшему текущий
+    контекст; LLM спрашивается только в неоднозначных случаях.
+    """
+    local_decision = _local_rerun_decision(history, query_embedding, previous_query, previous_embedding)
+    if local_decision is not None:
+        return local_decision
+    return _rerun_result(generate_json(_rerun_prompt(history), RagDecision))
 
+
+async def ashould_rerun_rag(
+    history: List[dict],
+    query_embedding: Optional[List[float]] = None,
+    previous_query: Optional[str] = None,
+    previous_embedding: Optional[List[float]] = None
+) -> bool:
+    """should_rerun_rag для async-пайплайна"""
+    local_decision = _local_rerun_decision(history, query_embedding, previous_query, previous_embedding)
+    if local_decision is not None:
+        return local_decision
+    return _rerun_result(await agenerate_json(_rerun_prompt(history), RagDecision))
+
+
+def embed_query(user_query: str) -> Optional[List[float]]:
+    """Эмбеддинг одного запроса (None при ошибке)"""
+    embeddings = embed_texts([user_query])
+    return embeddings[0] if embeddings else None
+
+
+async def aembed_query(user_query: str) -> Optional[List[float]]:
+    embeddings = await aembed_texts([user_query])
+    return embeddings[0] if embeddings else None
+
+
+def _router_prompt(user_query: str) -> str:
     docs_description = "\n".join([
         f"- ID: {d['id']}, Название: {d['name']}, Описание: {d['description']}"
-        for d in ALL_DOCUMENTS_METADATA if d.get('id')
+        for d in get_document_metadata() if d.get('id')
     ])
 
-    prompt = (
+    return (
         f"Select the most relevant documents for the user query. "
         f"Return JSON with ALL relevant document IDs.\n\n"
         f"AVAILABLE DOCUMENTS:\n{docs_description}\n\n"
         f"USER QUERY: \"{user_query}\""
     )
 
-    response = generate_json(prompt, DocumentRouterResponse)
+
+def _router_result(response) -> List[str]:
     if response:
         doc_ids = [doc.doc_id for doc in response.relevant_documents]
-        print(f"INFO: Роутер выбрал: {doc_ids}")
+        print(f"INFO: LLM-роутер выбрал: {doc_ids}")
         return doc_ids
-
     return []
 
 
-def expand_query(user_query: str) -> str:
-    """Расширить запрос ключевыми терминами"""
-    prompt = QUERY_EXPANSION_PROMPT.format(query=user_query)
-    expanded = generate_text(prompt, temperature=0.1)
-    if expanded and expanded != user_query:
+def _route_with_llm(user_query: str) -> List[str]:
+    return _router_result(generate_json(_router_prompt(user_query), DocumentRouterResponse))
+
+
+async def _aroute_with_llm(user_query: str) -> List[str]:
+    return _router_result(await agenerate_json(_router_prompt(user_query), DocumentRouterResponse))
+
+
+def _route_locally(router, query_embedding: List[float]) -> Tuple[List[str], bool]:
+    """(doc_ids, нужен ли LLM) по ответу локального роутера"""
+    doc_ids, best_score = router.route(query_embedding)
+    if doc_ids and best_score >= ROUTER_CONFIDENCE:
+        print(f"INFO: Роутер выбрал: {doc_ids} (score={best_score:.3f})")
+        return doc_ids, False
+
+    if ROUTER_LLM_FALLBACK:
+        print(f"INFO: Роутер не уверен (score={best_score:.3f}), запрос к LLM")
+        return doc_ids, True
+
+    print(f"INFO: Роутер выбрал: {doc_ids} (score={best_score:.3f})")
+    return doc_ids, False
+
+
+def route_query_to_docs(user_query: str, query_embedding: Optional[List[float]] = None) -> List[str]:
+    """Выбрать релевантные документы.
+
+    Основной путь — локальный роутер по эмбеддингу запроса (query_embedding,
+    если он уже посчитан). LLM вызывается только при низкой уверенности
+    роутера или если локальный роутер недоступен.
+    """
+    documents = get_document_metadata()
+    if not get_client() or not documents:
+        return []
+
+    router = get_document_router(documents)
+    if router is None:
+        return _route_with_llm(user_query)
+
+    if query_embedding is None:
+        query_embedding = embed_query(user_query)
+        if query_embedding is None:
+            return _route_with_llm(user_query)
+
+    doc_ids, ask_llm = _route_locally(router, query_embedding)
+    if ask_llm:
+        llm_doc_ids = _route_with_llm(user_query)
+        if llm_doc_ids:
+            return llm_doc_ids
+        print(f"INFO: Роутер выбрал: {doc_ids}")
+    return doc_ids
+
+
+async def aroute_query_to_docs(user_query: str, query_embedding: Optional[List[float]] = None) -> List[str]:
+    """route_query_to_docs для async-пайплайна"""
+    documents = get_document_metadata()
+    if not get_client() or not documents:
+        return []
+
+    # Первое обращение строит роутер (эмбеддинги документов) — в потоке
+    router = await asyncio.to_thread(get_document_router, documents)
+    if router is None:
+        return await _aroute_with_llm(user_query)
+
+    if query_embedding is None:
+        query_embedding = await aembed_query(user_query)
+        if query_embedding is None:
+            return await _aroute_with_llm(user_query)
+
+    doc_ids, ask_llm = _route_locally(router, query_embedding)
+    if ask_llm:
+        llm_doc_ids = await _aroute_with_llm(user_query)
+        if llm_doc_ids:
+            return llm_doc_ids
+        print(f"INFO: Роутер выбрал: {doc_ids}")
+    return doc_ids
+
+
+def _cached_expansion(user_query: str) -> Tuple[str, Optional[str]]:
+    key = _expansion_key(user_query)
+    return key, expansion_cache.get(key) if expansion_cache else None
+
+
+def _store_expansion(key: str, user_query: str, expanded: Optional[str]) -> str:
+    # None — ошибка или этап пропущен предохранителем: ищем по исходному запросу
+    if not expanded:
+        return user_query
+
+    if expanded != user_query:
         print(f"INFO: Запрос расширен: '{user_query}' -> '{expanded}'")
+    if expansion_cache:
+        expansion_cache.set(key, expanded)
     return expanded
 
 
+def expand_query(user_query: str) -> str:
+    """Расширить запрос ключевыми терминами (с кешем по нормализованному запросу)"""
+    key, cached = _cached_expansion(user_query)
+    if cached is not None:
+        return cached
+
+    prompt = QUERY_EXPANSION_PROMPT.format(query=user_query)
+    return _store_expansion(key, user_query, generate_text(prompt, temperature=0.1))
+
+
+async def aexpand_query(user_query: str) -> str:
+    # Кеш расширений — SQLite на диске: обращения к нему в потоке
+    key, cached = await asyncio.to_thread(_cached_expansion, user_query)
+    if cached is not None:
+        return cached
+
+    prompt = QUERY_EXPANSION_PROMPT.format(query=user_query)
+    expanded = await agenerate_text(prompt, temperature=0.1)
+    return await asyncio.to_thread(_store_expansion, key, user_query, expanded)
+
+
 def find_relevant_chunks(
     doc_ids: List[str],
     user_query: str,
     top_k: int = 8,
-    similarity_threshold: float = 0.4
+    similarity_threshold: float = 0.4,
+    query_embedding: Optional[List[float]] = None,
+    expanded_query: Optional[str] = None,
+    timings: Optional[StageTimings] = None
+) -> Tuple[Optional[List[dict]], Optional[str], Optional[str]]:
+    """Найти релевантные фрагменты.
+
+    query_embedding и expanded_query можно передать уже посчитанными
+    (см. src/pipeline.py), тогда соответствующие вызовы не выполняются.
+    В timings пишутся подэтапы поиска.
+    """
+    if not get_client():
+        return None, None, "Gemini не инициализирован."
+
+    if expanded_query is None:
+        expanded_query = expand_query(user_query)
+    queries = _queries_to_embed(user_query, query_embedding, expanded_query)
+    with stage(timings, 'embed_queries'):
+        embeddings = embed_texts(queries) if queries else []
+    return _search_with_embeddings(doc_ids, query_embedding, embeddings, top_k, similarity_threshold, timings=timings)
+
+
+async def afind_relevant_chunks(
+    doc_ids: List[str],
+    user_query: str,
+    top_k: int = 8,
+    similarity_threshold: float = 0.4,
+    query_embedding: Optional[List[float]] = None,
+    expanded_query: Optional[str] = None,
+    timings: Optional[StageTimings] = None
 ) -> Tuple[Optional[List[dict]], Optional[str], Optional[str]]:
-    """Найти релевантные фрагменты"""
-    if not client:
+    """find_relevant_chunks для async-пайплайна; поиск по матрице — в потоке"""
+    if not get_client():
         return None, None, "Gemini не инициализирован."
 
-    expanded_query = expand_query(user_query)
-    queries = [user_query]
+    if expanded_query is None:
+        expanded_query = await aexpand_query(user_query)
+    queries = _queries_to_embed(user_query, query_embedding, expanded_query)
+    with stage(timings, 'embed_queries'):
+        embeddings = await aembed_texts(queries) if queries else []
+    return await asyncio.to_thread(
+        _search_with_embeddings, doc_ids, query_embedding, embeddings, top_k, similarity_threshold, timings=timings
+    )
+
+
+def _queries_to_embed(user_query: str, query_embedding: Optional[List[float]], expanded_query: str) -> List[str]:
+    queries = [] if query_embedding is not None else [user_query]
     if expanded_query != user_query:
         queries.append(expanded_query)
+    return queries
+
 
-    embeddings = embed_texts(queries)
-    if not embeddings:
-        return None, None, "Ошибка получения эмбеддингов."
+def _search_with_embeddings(
+    doc_ids: List[str],
+    query_embedding: Optional[List[float]],
+    embeddings: List[List[float]],
+    top_k: int,
+    similarity_threshold: float,
+    index: Optional[VectorIndex] = None,
+    timings: Optional[StageTimings] = None
+) -> Tuple[Optional[List[dict]], Optional[str], Optional[str]]:
+    if query_embedding is None:
+        if not embeddings:
+            return None, None, "Ошибка получения эмбеддингов."
+        query_embedding, embeddings = embeddings[0], embeddings[1:]
+
+    # Исходный и расширенный запрос с равными весами -> один вектор
+    query = fuse_queries([query_embedding] + embeddings[:1])
+
+    with stage(timings, 'vector_load'):
+        if index is None:
+            index = get_vector_index()
+        chunk_ranges = merge_ranges(index.doc_ranges, doc_ids)
+        toc_ranges = merge_ranges(index.toc_ranges, doc_ids)
+    if not chunk_ranges:
+        return None, None, "Не найдено релевантных фрагментов."
 
-    original_emb = embeddings[0]
-    expanded_emb = embeddings[1] if len(embeddings) > 1 else None
+    # Поиск по TOC
+    if toc_ranges:
+        with stage(timings, 'scoring'):
+            toc_rows, similarities = score_ranges(index.toc_matrix, toc_ranges, query)
+            top_indices = top_k_rows(similarities, (top_k + 1) // 2, similarity_threshold)
+        with stage(timings, 'context'):
+            relevant_sources, context_text = _toc_context(index, toc_rows, similarities, top_indices)
+        return relevant_sources, context_text, None
+
+    # Fallback: плоский поиск
+    with stage(timings, 'scoring'):
+        chunk_rows, similarities = score_ranges(index.matrix, chunk_ranges, query)
+        top = top_k_rows(similarities, top_k, similarity_threshold, mask=index.chunk_is_long[chunk_rows])
+    with stage(timings, 'context'):
+        relevant_sources, context_text = _flat_context(index, chunk_rows, similarities, top)
+    return relevant_sources, context_text, None
 
-    all_chunks = []
-    all_metadata = {}
 
-    for doc_id in doc_ids:
-        vector_file = os.path.join(VECTOR_STORE_DIR, f"{doc_id}_vectors.json")
-        meta_file = os.path.join(VECTOR_STORE_DIR, f"{doc_id}_metadata.json")
+def _toc_context(index: VectorIndex, toc_rows, similarities, top_indices) -> Tuple[List[dict], str]:
+    """Источники и контекст из найденных разделов оглавления"""
+    grouped_context = []
+    relevant_sources = []
 
-        if not os.path.exists(vector_file) or not os.path.exists(meta_file):
-            continue
+    for idx in top_indices:
+        toc_row = toc_rows[idx]
+        sec = index.toc_sections[toc_row]
+        sec_text = '\n'.join(c['text'] for c in index.section_chunks(toc_row))
 
-        try:
-            with open(vector_file, 'r', encoding='utf-8') as f:
-                chunks = json.load(f)
-            with open(meta_file, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
-            all_chunks.extend(chunks)
-            all_metadata[doc_id] = metadata
-        except Exception as e:
-            print(f"Ошибка загрузки {doc_id}: {e}")
-
-    if not all_chunks:
-        return None, None, "Не найдено релевантных фрагментов."
+        grouped_context.append(f"Раздел '{sec['full_path']}':\n{sec_text}")
+        relevant_sources.append({
+            "header": sec['full_path'],
+            "text": sec_text[:200] + "...",
+            "doc_name": index.metadata[sec['doc_id']]['doc_name'],
+            "similarity": float(similarities[idx])
+        })
 
-    # Поиск по TOC
-    toc_embs = []
-    for doc_id, meta in all_metadata.items():
-        for i, sec in enumerate(meta.get('table_of_contents', [])):
-            if 'embedding' in sec:
-                toc_embs.append((doc_id, i, sec['embedding']))
-
-    if toc_embs:
-        toc_matrix = np.array([emb for _, _, emb in toc_embs])
-        similarities = cosine_similarity([original_emb], toc_matrix)[0]
-
-        if expanded_emb is not None:
-            exp_sim = cosine_similarity([expanded_emb], toc_matrix)[0]
-            similarities = (similarities + exp_sim) / 2
-
-        top_indices = np.argsort(similarities)[-top_k // 2:][::-1]
-
-        grouped_context = []
-        relevant_sources = []
-
-        for idx in top_indices:
-            if similarities[idx] < similarity_threshold:
-                continue
-
-            doc_id, toc_i, _ = toc_embs[idx]
-            sec = all_metadata[doc_id]['table_of_contents'][toc_i]
-            start, num = sec['start_chunk_index'], sec['num_chunks']
-            sec_chunks = all_chunks[start:start+num]
-            sec_text = '\n'.join(c['text'] for c in sec_chunks)
-
-            grouped_context.append(f"Раздел '{sec['full_path']}':\n{sec_text}")
-            relevant_sources.append({
-                "header": sec['full_path'],
-                "text": sec_text[:200] + "...",
-                "doc_name": all_metadata[doc_id]['doc_name'],
-                "similarity": float(similarities[idx])
-            })
-
-        context_text = "\n\n---\n\n".join(grouped_context)
-
-    else:
-        # Fallback: плоский поиск
-        doc_embeddings = np.array([item['vector'] for item in all_chunks])
-        similarities = cosine_similarity([original_emb], doc_embeddings)[0]
-
-        if expanded_emb is not None:
-            exp_sim = cosine_similarity([expanded_emb], doc_embeddings)[0]
-            similarities = (similarities + exp_sim) / 2
-
-        unique_chunks = {}
-        for i, sim in enumerate(similarities):
-            if sim >= similarity_threshold and len(all_chunks[i].get('text', '')) > 50:
-                chunk_id = all_chunks[i]['chunk_id']
-                if chunk_id not in unique_chunks or sim > unique_chunks[chunk_id]['similarity']:
-                    chunk = all_chunks[i].copy()
-                    chunk['similarity'] = float(sim)
-                    unique_chunks[chunk_id] = chunk
-
-        sorted_chunks = sorted(unique_chunks.values(), key=lambda x: x['similarity'], reverse=True)[:top_k]
-
-        # Подтягиваем split-чанки
-        base_to_chunks = {}
-        for c in all_chunks:
-            header = c['section_header']
-            base_header = re.sub(r' \((часть \d+)\)$', '', header)
-            if base_header not in base_to_chunks:
-                base_to_chunks[base_header] = []
-            base_to_chunks[base_header].append(c)
-
-        expanded_chunks = []
-        seen_ids = set()
-        for chunk in sorted_chunks:
-            base_header = re.sub(r' \((часть \d+)\)$', '', chunk['section_header'])
-            if base_header in base_to_chunks:
-                for related in base_to_chunks[base_header]:
-                    if related['chunk_id'] not in seen_ids:
-                        related_copy = related.copy()
-                        related_copy['similarity'] = chunk['similarity']
-                        expanded_chunks.append(related_copy)
-                        seen_ids.add(related['chunk_id'])
-
-        expanded_chunks.sort(key=lambda x: (-x['similarity'], x['section_header']))
-
-        relevant_sources = [{
-            "header": c.get('section_header', 'Н/Д'),
-            "text": c.get('text', ''),
-            "doc_name": c.get('doc_name', 'Н/Д'),
-            "similarity": c['similarity']
-        } for c in expanded_chunks]
-
-        context_texts = [
-            f"Из документа '{c.get('doc_name', '')}', раздел '{c.get('section_header', '')}':\n{c.get('text', '')}"
-            for c in expanded_chunks
-        ]
-        context_text = "\n\n---\n\n".join(context_texts)
+    return relevant_sources, "\n\n---\n\n".join(grouped_context)
+
+
+def _flat_context(index: VectorIndex, chunk_rows, similarities, top) -> Tuple[List[dict], str]:
+    """Источники и контекст из найденных фрагментов"""
+    # Подтягиваем split-чанки: все строки раздела найденного чанка
+    expanded_rows = []
+    expanded_sims = []
+    seen_rows = set()
+    for pos in top:
+        for row in index.section_rows(chunk_rows[pos]):
+            if row not in seen_rows:
+                seen_rows.add(row)
+                expanded_rows.append(row)
+                expanded_sims.append(float(similarities[pos]))
+
+    order = sorted(
+        range(len(expanded_rows)),
+        key=lambda i: (-expanded_sims[i], index.chunks[expanded_rows[i]]['section_header'])
+    )
+    expanded_chunks = [(index.chunks[expanded_rows[i]], expanded_sims[i]) for i in order]
 
-    return relevant_sources, context_text, None
+    relevant_sources = [{
+        "header": c.get('section_header', 'Н/Д'),
+        "text": c.get('text', ''),
+        "doc_name": c.get('doc_name', 'Н/Д'),
+        "similarity": sim
+    } for c, sim in expanded_chunks]
+
+    context_texts = [
+        f"Из документа '{c.get('doc_name', '')}', раздел '{c.get('section_header', '')}':\n{c.get('text', '')}"
+        for c, _ in expanded_chunks
+    ]
+    return relevant_sources, "\n\n---\n\n".join(context_texts)
 
 
 def build_tree_from_manifest() -> List[dict]:
@@ -301,7 +515,7 @@ def build_tree_from_manifest() -> List[dict]:
         "Другое": "fas fa-folder"
     }
 
-    for doc in ALL_DOCUMENTS_METADATA:
+    for doc in get_document_metadata():
         if doc['id'] == "0":
             continue
 
@@ -0,0 +1,400 @@
+# resilience.py - Сроки, хеджирование, повторы и предохранитель для коротких вызовов Gemini
+#
+# Эмбеддинги, роутер, расширение запроса и детектор повторного поиска —
+# короткие вызовы, от которых зависит время до первого токена. Каждый идёт
+# через CallPolicy:
+#   - срок (deadline): вызов не ждёт дольше GEMINI_CALL_DEADLINE, а запрос к
+#     API получает HTTP-таймаут на тот же срок (http_options) — зависший
+#     запрос не держит поток пула дольше срока;
+#   - хеджирование: если ответа нет дольше p95 последних вызовов этого типа,
+#     отправляется второй такой же запрос и берётся первый ответ; хеджей не
+#     больше GEMINI_HEDGE_BUDGET от числа вызовов, чтобы при общей деградации
+#     не удваивать нагрузку; хедж уходит только в свободный поток пула, и
+#     хеджей в полёте не больше HEDGE_POOL_SHARE потоков;
+#   - повторы с джиттером для 429/5xx и таймаутов, если до срока есть время;
+#   - предохранитель (CircuitBreaker): после серии ошибок необязательные
+#     вызовы (optional=True) сразу получают CircuitOpen и этап пропускается;
+#     через cooldown один пробный вызов проверяет, восстановился ли Gemini.
+# Стрим ответа через политику не идёт: его длительность сроком не ограничена.
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Optional
+
+from src.config import (
+    GEMINI_CALL_DEADLINE, GEMINI_CALL_WORKERS, GEMINI_RETRY_ATTEMPTS, GEMINI_RETRY_BASE_MS,
+    GEMINI_HEDGE_ENABLED, GEMINI_HEDGE_AFTER_MS, GEMINI_HEDGE_MIN_MS, GEMINI_HEDGE_BUDGET,
+    GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_COOLDOWN
+)
+
+# Меньше образцов — p95 ещё не считается, хедж после hedge_after
+MIN_LATENCY_SAMPLES = 20
+# Доля потоков пула, которую могут занять хеджи
+HEDGE_POOL_SHARE = 0.25
+
+
+class DeadlineExceeded(TimeoutError):
+    """Вызов не уложился в срок"""
+
+
+class CircuitOpen(RuntimeError):
+    """Предохранитель разомкнут: необязательный вызов пропущен"""
+
+
+def is_retryable(e: BaseException) -> bool:
+    """Временная ошибка API: 429, 5xx, таймаут или обрыв соединения"""
+    if isinstance(e, (CircuitOpen, DeadlineExceeded)):
+        return False
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(e, 'code', None)
+    if code in (429, 500, 502, 503, 504):
+        return True
+    text = str(e)
+    return 'RESOURCE_EXHAUSTED' in text or 'UNAVAILABLE' in text
+
+
+class LatencyWindow:
+    """Длительности последних успешных вызовов (с)"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < MIN_LATENCY_SAMPLES:
+                return None
+            values = sorted(self._samples)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class CircuitBreaker:
+    """Размыкается после failure_threshold ошибок подряд, пробует снова через cooldown"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._probe_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Можно ли выполнить необязательный вызов"""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = self.clock()
+            if self.state == self.OPEN and now - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+            # Один пробный вызов; если он завис, через cooldown — следующий
+            if self.state == self.HALF_OPEN and (self._probe_at is None or now - self._probe_at >= self.cooldown):
+                self._probe_at = now
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"INFO: Предохранитель {self.name}: вызовы восстановлены")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_at = None
+
+    def record_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                if self.state == self.CLOSED:
+                    print(f"WARN: Предохранитель {self.name}: {self.failures} ошибок подряд, "
+                          f"необязательные вызовы пропускаются {self.cooldown:g} с")
+                self.state = self.OPEN
+                self.opened += 1
+                self._opened_at = self.clock()
+                self._probe_at = None
+
+    def stats_dict(self) -> dict:
+        with self._lock:
+            return {'name': self.name, 'state': self.state, 'failures': self.failures, 'opened': self.opened}
+
+
+class CallPool:
+    """Потоки синхронных вызовов процесса; хеджи — только в свободные потоки"""
+
+    def __init__(self, max_workers: int, hedge_share: float = HEDGE_POOL_SHARE):
+        self.max_workers = max_workers
+        self.max_hedges = max(1, int(max_workers * hedge_share))
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._in_flight = 0
+        self._hedges = 0
+
+    def _ensure_started(self) -> None:
+        # Пул создаётся в процессе, который его использует: после fork
+        # (preload_app в gunicorn) потоки мастера в воркере не существуют
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='gemini-call')
+            self._in_flight = 0
+            self._hedges = 0
+            self._pid = os.getpid()
+
+    def submit(self, fn: Callable[[], object], hedge: bool = False) -> Optional[Future]:
+        """Future вызова; None — для хеджа нет свободного потока"""
+        self._ensure_started()
+        with self._lock:
+            if hedge and (self._hedges >= self.max_hedges or self._in_flight >= self.max_workers):
+                return None
+            self._in_flight += 1
+            if hedge:
+                self._hedges += 1
+            pid = self._pid
+            future = self._executor.submit(fn)
+        future.add_done_callback(lambda _: self._release(pid, hedge))
+        return future
+
+    def _release(self, pid: int, hedge: bool) -> None:
+        with self._lock:
+            if pid != self._pid:
+                return
+            self._in_flight -= 1
+            if hedge:
+                self._hedges -= 1
+
+    def stats_dict(self) -> dict:
+        with self._lock:
+            return {'workers': self.max_workers, 'in_flight': self._in_flight, 'hedges_in_flight': self._hedges}
+
+
+call_pool = CallPool(GEMINI_CALL_WORKERS)
+
+
+class CallPolicy:
+    """Срок, хедж и повторы для одного типа вызовов"""
+
+    def __init__(self, name: str, breaker: CircuitBreaker, deadline: float = GEMINI_CALL_DEADLINE,
+                 attempts: int = GEMINI_RETRY_ATTEMPTS, retry_base: float = GEMINI_RETRY_BASE_MS / 1000,
+                 hedge: bool = GEMINI_HEDGE_ENABLED, hedge_after: float = GEMINI_HEDGE_AFTER_MS / 1000,
+                 hedge_min: float = GEMINI_HEDGE_MIN_MS / 1000, hedge_budget: float = GEMINI_HEDGE_BUDGET):
+        self.name = name
+        self.breaker = breaker
+        self.deadline = deadline
+        self.attempts = max(1, attempts)
+        self.retry_base = retry_base
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_min = hedge_min
+        self.hedge_budget = hedge_budget
+        self.latencies = LatencyWindow()
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0, 'failures': 0, 'skipped': 0, 'timeouts': 0,
+            'retries': 0, 'hedges': 0, 'hedge_wins': 0, 'hedges_no_thread': 0,
+        }
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def hedge_delay(self) -> Optional[float]:
+        """Через сколько секунд без ответа отправлять хедж (None — не отправлять)"""
+        if not self.hedge:
+            return None
+        p95 = self.latencies.percentile(0.95)
+        return self.hedge_after if p95 is None else max(self.hedge_min, p95)
+
+    def http_options(self) -> dict:
+        """HTTP-таймаут запроса к API (мс) — срок политики"""
+        return {'timeout': int(self.deadline * 1000)}
+
+    def _hedge_allowed(self) -> bool:
+        with self._lock:
+            return self._stats['hedges'] < self.hedge_budget * self._stats['calls']
+
+    def _begin(self, optional: bool) -> float:
+        if optional and not self.breaker.allow():
+            self._count('skipped')
+            raise CircuitOpen(f"{self.name}: Gemini недоступен, вызов пропущен")
+        self._count('calls')
+        return time.monotonic() + self.deadline
+
+    def _retry_delay(self, attempt: int, e: Exception, deadline_at: float) -> Optional[float]:
+        """Пауза перед следующей попыткой или None, если повторять нельзя"""
+        if attempt >= self.attempts or not is_retryable(e):
+            return None
+        delay = self.retry_base * 2 ** (attempt - 1) * (0.5 + random.random())
+        if time.monotonic() + delay >= deadline_at:
+            return None
+        self._count('retries')
+        print(f"WARN: {self.name}: {e}; повтор через {delay * 1000:.0f} мс")
+        return delay
+
+    def _fail(self, e: Exception) -> None:
+        self._count('failures')
+        if isinstance(e, DeadlineExceeded):
+            self._count('timeouts')
+        self.breaker.record_failure()
+
+    # --- Синхронные вызовы (потоки) ---
+    def call(self, fn: Callable[[], object], optional: bool = False):
+        """Результат fn() с учётом срока, хеджа и повторов"""
+        deadline_at = self._begin(optional)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = self._attempt(fn, deadline_at)
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline_at)
+                if delay is None:
+                    self._fail(e)
+                    raise
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _attempt(self, fn: Callable[[], object], deadline_at: float):
+        # Проигравший запрос не прерывается (у потока нет отмены), его ответ
+        # отбрасывается; поток он держит не дольше HTTP-таймаута
+        first = call_pool.submit(fn)
+        started = {first: time.monotonic()}
+        hedge_at = None if (delay := self.hedge_delay()) is None else time.monotonic() + delay
+        pending = {first}
+        error = None
+        try:
+            while pending:
+                now = time.monotonic()
+                if now >= deadline_at:
+                    raise DeadlineExceeded(f"{self.name}: нет ответа за {self.deadline:g} с")
+                timeout = deadline_at - now if hedge_at is None else max(0.0, min(deadline_at, hedge_at) - now)
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        self.latencies.add(time.monotonic() - started[future])
+                        if future is not first:
+                            self._count('hedge_wins')
+                        return future.result()
+                    error = future.exception()
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    if pending and self._hedge_allowed():
+                        future = call_pool.submit(fn, hedge=True)
+                        if future is None:
+                            self._count('hedges_no_thread')
+                        else:
+                            self._count('hedges')
+                            started[future] = time.monotonic()
+                            pending.add(future)
+            raise error
+        finally:
+            # Ещё не начатые вызовы (очередь пула) снимаются
+            for future in started:
+                future.cancel()
+
+    # --- Async-вызовы (asyncio) ---
+    async def acall(self, make: Callable[[], Awaitable], optional: bool = False):
+        """call для корутин: make() создаёт новую корутину на каждую попытку"""
+        deadline_at = self._begin(optional)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await self._aattempt(make, deadline_at)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline_at)
+                if delay is None:
+                    self._fail(e)
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def _aattempt(self, make: Callable[[], Awaitable], deadline_at: float):
+        first = asyncio.ensure_future(make())
+        started = {first: time.monotonic()}
+        hedge_at = None if (delay := self.hedge_delay()) is None else time.monotonic() + delay
+        pending = {first}
+        error = None
+        try:
+            while pending:
+                now = time.monotonic()
+                if now >= deadline_at:
+                    raise DeadlineExceeded(f"{self.name}: нет ответа за {self.deadline:g} с")
+                timeout = deadline_at - now if hedge_at is None else max(0.0, min(deadline_at, hedge_at) - now)
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.latencies.add(time.monotonic() - started[task])
+                        if task is not first:
+                            self._count('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    if pending and self._hedge_allowed():
+                        self._count('hedges')
+                        task = asyncio.ensure_future(make())
+                        started[task] = time.monotonic()
+                        pending.add(task)
+            raise error
+        finally:
+            # Проигравший и незавершённые запросы отменяются вместе с их соединениями
+            for task in started:
+                if not task.done():
+                    task.cancel()
+
+    def stats_dict(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        p95 = self.latencies.percentile(0.95)
+        return {
+            'name': self.name,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            'hedge_after_ms': round(self.hedge_delay() * 1000, 1) if self.hedge else None,
+            **stats
+        }
+
+
+gemini_breaker = CircuitBreaker('gemini', GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_COOLDOWN)
+
+embed_policy = CallPolicy('embed', gemini_breaker)
+json_policy = CallPolicy('generate_json', gemini_breaker)
+text_policy = CallPolicy('generate_text', gemini_breaker)
+
+
+def stats_dict() -> dict:
+    return {
+        'breaker': gemini_breaker.stats_dict(),
+        'pool': call_pool.stats_dict(),
+        'policies': [policy.stats_dict() for policy in (embed_policy, json_policy, text_policy)],
+    }
@@ -1,204 +1,278 @@
 # routes.py - Основные роуты приложения
 import os
+import hmac
+import time
 import uuid
-import json
 import traceback
 from datetime import datetime
-from typing import Generator
+from typing import Generator, List, NamedTuple, Optional
 
 from flask import Blueprint, render_template, request, jsonify, session, send_from_directory, Response
 
-from src.config import TEXT_INSTRUCTIONS_DIR, PDF_DATA_DIR
+from src.config import TEXT_INSTRUCTIONS_DIR, PDF_DATA_DIR, METRICS_TOKEN
 from src.auth import login_required, get_current_user
 from src.prompts import (
     RAG_SYSTEM_PROMPT, GROUNDING_SYSTEM_PROMPT,
     PRESCRIPTION_SYSTEM_PROMPT, GENERAL_CHAT_SYSTEM_PROMPT
 )
-from src.gemini_client import stream_response
-from src.rag import (
-    get_user_intent, should_rerun_rag, route_query_to_docs,
-    find_relevant_chunks, get_full_docx_text, build_tree_from_manifest
-)
+from src.gemini_client import stream_response, stream_grounded_response
+from src import events
+from src.events import CONTENT, StreamEvent, sse_stream, to_sse
+from src.rag import get_user_intent, get_full_docx_text, build_tree_from_manifest
+from src.pipeline import StageTimings, NO_DOCUMENTS, PreparedContext, prepare_rag_context, run_retrieval
+from src.metrics import registry, requests_total
+from src.profiler import profiler
+from src.traffic import traffic_recorder
+from src.session_store import session_store, new_session_data
 
 main_bp = Blueprint('main', __name__)
 
-# Хранилище сессий
-sessions = {}
-
 
 def get_or_create_session(session_id: str) -> dict:
     """Получить или создать сессию"""
-    if session_id not in sessions:
-        sessions[session_id] = {
-            'history': [],
-            'state': 'IDLE',
-            'data': {},
-            'last_rag_context': None,
-            'last_rag_sources': None
-        }
-    return sessions[session_id]
-
-
-def process_user_request(user_input: str, doc_id: str, session_id: str, category_doc_ids: str = None) -> Generator:
-    """Обработка запроса пользователя"""
-    current_session = get_or_create_session(session_id)
+    return session_store.load(session_id) or new_session_data()
+
+
+def rag_history(history: List[dict], context_text: str, user_input: str) -> List[dict]:
+    """История для RAG-ответа: последний вопрос заменён вопросом с контекстом"""
+    contextual_query = "\n".join([f"{m['role']}: {m['content']}" for m in history])
+    return history[:-1] + [{
+        'role': 'user',
+        'content': f"**КОНТЕКСТ:**\n{context_text}\n\n**ДИАЛОГ:**\n{contextual_query}\n\n**ВОПРОС:** {user_input}"
+    }]
+
+
+def remember_rag_context(current_session: dict, sources, context_text: str, user_input: str, query_embedding) -> None:
+    current_session['last_rag_context'] = context_text
+    current_session['last_rag_sources'] = sources
+    current_session['last_rag_query'] = user_input
+    current_session['last_rag_embedding'] = query_embedding
+
+
+def prescription_violations_prompt(context: str, work_description: str) -> str:
+    return f"КОНТЕКСТ:\n{context}\n\nЗАДАЧА: Сгенерируй список нарушений для '{work_description}' (ШАГ 2)."
+
+
+def prescription_final_prompt(found_sources: List[dict], user_input: str) -> str:
+    sources_text = "\n".join([
+        f"- Пункт {c.get('section_header', '')} из '{c.get('doc_name', '')}': {c.get('text', '')}"
+        for c in found_sources
+    ])
+    return (
+        f"ПОДТВЕРЖДЕННЫЕ НАРУШЕНИЯ: '{user_input}'\n\n"
+        f"ДАННЫЕ:\n{sources_text}\n\n"
+        f"ДАТА: {datetime.now().strftime('%d.%m.%Y')}\n\n"
+        f"ЗАДАЧА: Сформируй предписание (ШАГ 3)."
+    )
+
+
+def finish_turn(current_session: dict, full_response: str, timings: StageTimings) -> None:
+    """Ответ модели в историю, обрезка истории, лог этапов"""
+    if full_response:
+        current_session['history'].append({"role": "model", "content": full_response})
+
+    if len(current_session['history']) > 20:
+        current_session['history'] = current_session['history'][-10:]
+
+    timings.mark('total')
+    timings.log()
+
+
+def process_user_request(
+    user_input: str, doc_id: str, session_id: str, category_doc_ids: str = None, profile_id: str = None
+) -> Generator[StreamEvent, None, None]:
+    """Обработка запроса пользователя (события стрима); сессия сохраняется и при обрыве стрима"""
+    timings = StageTimings()
+    with profiler.profile_request(timings, profile_id, label=f"doc_id={doc_id}"):
+        current_session = get_or_create_session(session_id)
+        traffic_recorder.record(session_id, current_session.get('state', 'IDLE'), user_input, doc_id, category_doc_ids)
+        try:
+            yield from _handle_request(user_input, doc_id, current_session, timings, category_doc_ids)
+        finally:
+            session_store.save(session_id, current_session)
+
+
+# --- Ход диалога: общая логика WSGI (ниже) и ASGI (src/asgi.py) ---
+# Намерение, переходы состояния предписания, промпты и сообщения — в
+# синхронных функциях *_plan; вызывающий код выполняет только ввод-вывод
+# (поиск, текст документа, стрим модели) своим способом.
+
+PLAN_STREAM = 'stream'          # ответ модели: history + system_prompt
+PLAN_MESSAGE = 'message'        # готовый текст ответа
+PLAN_ERROR = 'error'            # ошибка как ответ хода (попадает в историю)
+PLAN_ABORT = 'abort'            # ошибка, ход прерывается без записи ответа
+PLAN_RETRIEVE = 'retrieve'      # предписание: нужен поиск по text (виду работ)
+PLAN_GROUNDING = 'grounding'    # вопрос по одному документу
+PLAN_RAG = 'rag'                # вопрос по всем документам
+
+
+class TurnPlan(NamedTuple):
+    action: str
+    text: str = ''
+    history: Optional[List[dict]] = None
+    system_prompt: str = ''
+    sources: Optional[List[dict]] = None
+
+
+def _prompt_plan(prompt: str) -> TurnPlan:
+    return TurnPlan(PLAN_STREAM, history=[{"role": "user", "content": prompt}], system_prompt=PRESCRIPTION_SYSTEM_PROMPT)
+
+
+def start_plan(current_session: dict, user_input: str, doc_id: str, timings: StageTimings) -> TurnPlan:
+    """Вопрос в историю, намерение и шаг предписания"""
     current_session['history'].append({"role": "user", "content": user_input})
 
     state = current_session.get('state', 'IDLE')
-    intent, initial_description = get_user_intent(user_input)
+    with timings.stage('intent'):
+        intent, initial_description = get_user_intent(user_input)
 
     if state.startswith("PRESCRIPTION"):
         intent = "PRESCRIPTION_REQUEST"
+    requests_total.inc(intent)
 
-    full_response = ""
-    final_sources = []
-
-    # Общий чат
     if intent == "GENERAL_CHAT":
-        response_generator = stream_response(
-            history=current_session['history'],
-            system_prompt=GENERAL_CHAT_SYSTEM_PROMPT
-        )
+        return TurnPlan(PLAN_STREAM, history=current_session['history'], system_prompt=GENERAL_CHAT_SYSTEM_PROMPT)
+
+    if intent == "PRESCRIPTION_REQUEST":
+        if state == 'IDLE' and not initial_description:
+            current_session['state'] = 'PRESCRIPTION_AWAITING_DETAILS'
+            return TurnPlan(PLAN_MESSAGE, "Пожалуйста, уточните, по какому виду работ выявлено нарушение?")
+
+        if (state == 'IDLE' and initial_description) or state == 'PRESCRIPTION_AWAITING_DETAILS':
+            work_description = initial_description or user_input
+            current_session['data']['work_description'] = work_description
+            return TurnPlan(PLAN_RETRIEVE, work_description)
 
-    # Предписание
-    elif intent == "PRESCRIPTION_REQUEST":
-        def run_prescription_logic():
-            nonlocal current_session, state, initial_description
-
-            if state == 'IDLE' and not initial_description:
-                current_session['state'] = 'PRESCRIPTION_AWAITING_DETAILS'
-                message = "Пожалуйста, уточните, по какому виду работ выявлено нарушение?"
-                yield "message", message
-                return
-
-            if (state == 'IDLE' and initial_description) or state == 'PRESCRIPTION_AWAITING_DETAILS':
-                work_description = initial_description or user_input
-                current_session['data']['work_description'] = work_description
-
-                doc_ids = route_query_to_docs(work_description)
-                if not doc_ids:
-                    yield "error", f"Не найдены документы для '{work_description}'."
-                    current_session['state'] = 'IDLE'
-                    return
-
-                sources, context, error = find_relevant_chunks(doc_ids, work_description, top_k=5)
-                if error:
-                    yield "error", f"Нет информации о '{work_description}'."
-                    current_session['state'] = 'IDLE'
-                    return
-
-                current_session['state'] = 'PRESCRIPTION_AWAITING_CONFIRMATION'
-                current_session['data']['found_sources'] = sources
-
-                prompt = f"КОНТЕКСТ:\n{context}\n\nЗАДАЧА: Сгенерируй список нарушений для '{work_description}' (ШАГ 2)."
-                yield "generator", stream_response([{"role": "user", "content": prompt}], PRESCRIPTION_SYSTEM_PROMPT)
-                return
-
-            if state == 'PRESCRIPTION_AWAITING_CONFIRMATION':
-                found_sources = current_session['data'].get('found_sources', [])
-                sources_text = "\n".join([
-                    f"- Пункт {c.get('section_header', '')} из '{c.get('doc_name', '')}': {c.get('text', '')}"
-                    for c in found_sources
-                ])
-
-                prompt = (
-                    f"ПОДТВЕРЖДЕННЫЕ НАРУШЕНИЯ: '{user_input}'\n\n"
-                    f"ДАННЫЕ:\n{sources_text}\n\n"
-                    f"ДАТА: {datetime.now().strftime('%d.%m.%Y')}\n\n"
-                    f"ЗАДАЧА: Сформируй предписание (ШАГ 3)."
-                )
-                yield "generator", stream_response([{"role": "user", "content": prompt}], PRESCRIPTION_SYSTEM_PROMPT)
-                current_session['state'] = 'IDLE'
-                current_session['data'] = {}
-                return
-
-        logic_output = run_prescription_logic()
-        result_type, result_value = next(logic_output, (None, None))
-
-        if result_type == "message":
-            full_response = result_value
-            response_generator = (f"data: {json.dumps({'type': 'content', 'data': result_value})}\n\n" for _ in [0])
-        elif result_type == "error":
-            full_response = result_value
-            response_generator = (f"data: {json.dumps({'type': 'error', 'data': result_value})}\n\n" for _ in [0])
-        elif result_type == "generator":
-            response_generator = result_value
-        else:
-            full_response = "Ошибка в логике предписаний."
+        if state == 'PRESCRIPTION_AWAITING_CONFIRMATION':
+            prompt = prescription_final_prompt(current_session['data'].get('found_sources', []), user_input)
             current_session['state'] = 'IDLE'
-            response_generator = (f"data: {json.dumps({'type': 'error', 'data': full_response})}\n\n" for _ in [0])
+            current_session['data'] = {}
+            return _prompt_plan(prompt)
 
-    # RAG-запрос
+        current_session['state'] = 'IDLE'
+        return TurnPlan(PLAN_ERROR, "Ошибка в логике предписаний.")
+
+    return TurnPlan(PLAN_GROUNDING if doc_id != '0' else PLAN_RAG)
+
+
+def prescription_plan(current_session: dict, work_description: str, sources, context, error) -> TurnPlan:
+    """Шаг предписания после поиска по виду работ"""
+    if error:
+        current_session['state'] = 'IDLE'
+        if error == NO_DOCUMENTS:
+            return TurnPlan(PLAN_ERROR, f"Не найдены документы для '{work_description}'.")
+        return TurnPlan(PLAN_ERROR, f"Нет информации о '{work_description}'.")
+
+    current_session['state'] = 'PRESCRIPTION_AWAITING_CONFIRMATION'
+    current_session['data']['found_sources'] = sources
+    return _prompt_plan(prescription_violations_prompt(context, work_description))
+
+
+def rag_session_args(current_session: dict) -> dict:
+    """Аргументы prepare_rag_context из прошлого RAG-хода сессии"""
+    return {
+        'has_cached_context': bool(current_session.get('last_rag_context')),
+        'previous_query': current_session.get('last_rag_query'),
+        'previous_embedding': current_session.get('last_rag_embedding'),
+    }
+
+
+def rag_plan(current_session: dict, user_input: str, prepared: PreparedContext) -> TurnPlan:
+    """RAG-ответ по подготовленному контексту (или по контексту прошлого хода)"""
+    if prepared.reuse_cached:
+        context_text = current_session['last_rag_context']
+        sources = current_session.get('last_rag_sources', [])
     else:
-        if doc_id != '0':
+        if prepared.error == NO_DOCUMENTS:
+            return TurnPlan(PLAN_ABORT, NO_DOCUMENTS)
+        if prepared.error:
+            return TurnPlan(PLAN_ABORT, f'Нет информации: {prepared.error}')
+
+        context_text = prepared.context
+        sources = prepared.sources
+        remember_rag_context(current_session, sources, context_text, user_input, prepared.query_embedding)
+
+    return TurnPlan(
+        PLAN_STREAM, history=rag_history(current_session['history'], context_text, user_input),
+        system_prompt=RAG_SYSTEM_PROMPT, sources=sources
+    )
+
+
+def plan_event(plan: TurnPlan) -> StreamEvent:
+    """Событие готового ответа (PLAN_MESSAGE, PLAN_ERROR)"""
+    return events.content(plan.text) if plan.action == PLAN_MESSAGE else events.error(plan.text)
+
+
+def _handle_request(
+    user_input: str, doc_id: str, current_session: dict, timings: StageTimings, category_doc_ids: str = None
+) -> Generator[StreamEvent, None, None]:
+    plan = start_plan(current_session, user_input, doc_id, timings)
+
+    if plan.action == PLAN_RETRIEVE:
+        sources, context, error = run_retrieval(plan.text, timings, top_k=5)
+        plan = prescription_plan(current_session, plan.text, sources, context, error)
+
+    elif plan.action == PLAN_GROUNDING:
+        with timings.stage('doc_text'):
             full_text, error = get_full_docx_text(doc_id)
-            if error:
-                yield f"data: {json.dumps({'type': 'error', 'data': error})}\n\n"
-                return
-
-            history = [{"role": "user", "content": f"ДОКУМЕНТ:\n---\n{full_text}\n---\n\nВОПРОС: {user_input}"}]
-            response_generator = stream_response(history, GROUNDING_SYSTEM_PROMPT)
-        else:
-            run_new_search = should_rerun_rag(current_session['history'])
-            context_text = None
-
-            if not run_new_search and current_session.get('last_rag_context'):
-                context_text = current_session['last_rag_context']
-                final_sources = current_session.get('last_rag_sources', [])
-            else:
-                if category_doc_ids:
-                    doc_ids = category_doc_ids.split(',')
-                else:
-                    contextual_query = "\n".join([f"{m['role']}: {m['content']}" for m in current_session['history']])
-                    doc_ids = route_query_to_docs(contextual_query)
-
-                if not doc_ids:
-                    yield f"data: {json.dumps({'type': 'error', 'data': 'Не определены документы.'})}\n\n"
-                    return
-
-                sources, context, error = find_relevant_chunks(doc_ids, user_input)
-                if error:
-                    yield f"data: {json.dumps({'type': 'error', 'data': f'Нет информации: {error}'})}\n\n"
-                    return
-
-                context_text = context
-                final_sources = sources
-                current_session['last_rag_context'] = context_text
-                current_session['last_rag_sources'] = final_sources
-
-            contextual_query = "\n".join([f"{m['role']}: {m['content']}" for m in current_session['history']])
-            history_with_context = current_session['history'][:-1] + [{
-                'role': 'user',
-                'content': f"**КОНТЕКСТ:**\n{context_text}\n\n**ДИАЛОГ:**\n{contextual_query}\n\n**ВОПРОС:** {user_input}"
-            }]
-            response_generator = stream_response(history_with_context, RAG_SYSTEM_PROMPT)
-
-    # Отправка ответа
-    for chunk_data in response_generator:
-        yield chunk_data
-        if chunk_data.strip().startswith("data:"):
-            try:
-                data = json.loads(chunk_data.strip()[5:])
-                if data.get('type') == 'content':
-                    full_response += data.get('data', '')
-            except json.JSONDecodeError:
-                pass
-
-    if final_sources:
-        yield f"data: {json.dumps({'type': 'sources', 'data': final_sources})}\n\n"
+        if error:
+            yield events.error(error)
+            return
+
+    elif plan.action == PLAN_RAG:
+        yield events.status('search')
+        prepared = prepare_rag_context(
+            user_input, current_session['history'], timings,
+            category_doc_ids=category_doc_ids, **rag_session_args(current_session)
+        )
+        plan = rag_plan(current_session, user_input, prepared)
 
-    if full_response:
-        current_session['history'].append({"role": "model", "content": full_response})
+    if plan.action == PLAN_ABORT:
+        yield events.error(plan.text)
+        return
 
-    if len(current_session['history']) > 20:
-        current_session['history'] = current_session['history'][-10:]
+    full_response = ""
+    if plan.action == PLAN_GROUNDING:
+        response_generator = stream_grounded_response(full_text, user_input, GROUNDING_SYSTEM_PROMPT, display_name=doc_id)
+    elif plan.action == PLAN_STREAM:
+        response_generator = stream_response(history=plan.history, system_prompt=plan.system_prompt)
+    else:
+        # Текст content-события попадает в full_response в цикле ниже
+        full_response = plan.text if plan.action == PLAN_ERROR else ""
+        response_generator = iter([plan_event(plan)])
+
+    # Отправка ответа; этапы подготовки — событием timing до первой части
+    yield events.timing(timings.as_dict())
+    llm_started = time.perf_counter()
+    for event in response_generator:
+        yield event
+        if event.type == CONTENT:
+            if not full_response:
+                timings.mark('first_token')
+                timings.record('llm_first_token', time.perf_counter() - llm_started)
+            full_response += event.data
+    if 'llm_first_token' in timings.stages:
+        timings.record('llm_stream', time.perf_counter() - llm_started)
+
+    if plan.sources:
+        yield events.sources(plan.sources)
+
+    finish_turn(current_session, full_response, timings)
 
 
 def stream_with_context(generator):
-    """Обёртка для стриминга"""
+    """Обёртка для стриминга: контекст приложения живёт до конца стрима.
+
+    Приложение берётся сразу, пока запрос активен: тело ответа читается
+    сервером уже после выхода из view-функции.
+    """
     from flask import current_app
-    with current_app.app_context():
-        yield from generator
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            yield from generator
+    return run()
 
 
 # --- Роуты ---
@@ -206,13 +280,10 @@ def stream_with_context(generator):
 @main_bp.route('/')
 @login_required
 def index():
-    if 'session_id' not in session or session['session_id'] not in sessions:
+    if 'session_id' not in session or not session_store.exists(session['session_id']):
         session_id = str(uuid.uuid4())
         session['session_id'] = session_id
-        sessions[session_id] = {
-            'history': [], 'state': 'IDLE', 'data': {},
-            'last_rag_context': None, 'last_rag_sources': None
-        }
+        session_store.save(session_id, new_session_data())
 
     user = get_current_user()
     return render_template('index.html', session_id=session['session_id'], user=user)
@@ -235,19 +306,33 @@ def get_response():
         category_doc_ids = data.get('category_doc_ids')
 
         if not all([user_input, doc_id is not None, session_id]):
-            def error_stream():
-                yield f"data: {json.dumps({'type': 'error', 'data': 'Отсутствуют параметры'})}\n\n"
-            return Response(error_stream(), mimetype='text/event-stream')
+            return Response(to_sse(events.error('Отсутствуют параметры')), mimetype='text/event-stream')
 
-        return Response(
-            stream_with_context(process_user_request(user_input, doc_id, session_id, category_doc_ids)),
+        # Профиль по запросу — только для администраторов
+        profile_id = None
+        if request.headers.get('X-Profile') == '1' and (get_current_user() or {}).get('is_admin'):
+            profile_id = profiler.new_id()
+
+        response = Response(
+            sse_stream(stream_with_context(
+                process_user_request(user_input, doc_id, session_id, category_doc_ids, profile_id)
+            )),
             mimetype='text/event-stream'
         )
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
     except Exception as e:
         traceback.print_exc()
-        def error_stream():
-            yield f"data: {json.dumps({'type': 'error', 'data': f'Ошибка: {e}'})}\n\n"
-        return Response(error_stream(), mimetype='text/event-stream')
+        return Response(to_sse(events.error(f'Ошибка: {e}')), mimetype='text/event-stream')
+
+
+@main_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики в формате Prometheus: без сессии, при METRICS_TOKEN — по Bearer-токену"""
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 
 @main_bp.route('/switch_session', methods=['POST'])
@@ -255,15 +340,12 @@ def get_response():
 def switch_session():
     old_session_id = (request.get_json() or {}).get('session_id') or session.get('session_id')
 
-    if old_session_id and old_session_id in sessions:
-        sessions.pop(old_session_id, None)
+    if old_session_id:
+        session_store.delete(old_session_id)
 
     new_session_id = str(uuid.uuid4())
     session['session_id'] = new_session_id
-    sessions[new_session_id] = {
-        'history': [], 'state': 'IDLE', 'data': {},
-        'last_rag_context': None, 'last_rag_sources': None
-    }
+    session_store.save(new_session_id, new_session_data())
 
     return jsonify({'message': 'Контекст сброшен.', 'new_session_id': new_session_id})
 
@@ -0,0 +1,65 @@
+# scoring.py - Векторизованная оценка близости по глобальной матрице индекса
+#
+# Строки матрицы уже нормализованы (см. vector_index), поэтому косинусная
+# близость — это скалярное произведение. Несколько запросов (исходный +
+# расширенный) с весами сводятся к одному вектору: среднее скалярных
+# произведений равно скалярному произведению со средним вектором.
+# Фильтр по документам — набор непрерывных диапазонов строк; срезы
+# матрицы не копируются.
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.vector_index import normalize_rows
+
+
+def fuse_queries(embeddings: Sequence, weights: Optional[Sequence[float]] = None) -> np.ndarray:
+    """Нормализованные запросы -> один взвешенный вектор"""
+    queries = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    if weights is None:
+        weights = np.full(len(queries), 1.0 / len(queries), dtype=np.float32)
+    else:
+        weights = np.asarray(weights, dtype=np.float32)
+        weights = weights / weights.sum()
+    return weights @ queries
+
+
+def merge_ranges(ranges: Dict[str, Tuple[int, int]], doc_ids: Sequence[str]) -> List[Tuple[int, int]]:
+    """Диапазоны строк выбранных документов, отсортированные и слитые"""
+    selected = sorted({ranges[d] for d in doc_ids if d in ranges and ranges[d][1] > ranges[d][0]})
+    merged = []
+    for start, end in selected:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def score_ranges(matrix: np.ndarray, row_ranges: List[Tuple[int, int]], query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Оценки строк из диапазонов: (номера строк, оценки)"""
+    total = sum(end - start for start, end in row_ranges)
+    rows = np.empty(total, dtype=np.int64)
+    scores = np.empty(total, dtype=np.float32)
+
+    pos = 0
+    for start, end in row_ranges:
+        size = end - start
+        rows[pos:pos + size] = np.arange(start, end)
+        np.matmul(matrix[start:end], query, out=scores[pos:pos + size])
+        pos += size
+    return rows, scores
+
+
+def top_k(scores: np.ndarray, k: int, threshold: Optional[float] = None, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """Позиции k лучших оценок (не ниже threshold) по убыванию"""
+    keep = np.ones(len(scores), dtype=bool) if mask is None else mask.copy()
+    if threshold is not None:
+        keep &= scores >= threshold
+    candidates = np.flatnonzero(keep)
+
+    if k <= 0:
+        return candidates[:0]
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
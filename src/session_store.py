@@ -0,0 +1,141 @@
+# session_store.py - Хранилище сессий чата
+#
+# Бэкенды (SESSION_BACKEND):
+#   memory - LRU в памяти процесса с TTL и ограничением по байтам
+#   sqlite - SQLite в CACHE_DIR, общий для всех воркеров узла
+# TTL скользящий: отсчитывается от последнего сохранения сессии.
+# Сессия загружается в начале запроса и сохраняется в конце; при
+# одновременных запросах одной сессии побеждает последняя запись.
+import json
+import time
+import sqlite3
+import threading
+from typing import Optional
+
+from src.config import (
+    CACHE_DIR, SESSION_BACKEND, SESSION_TTL, SESSION_MAX_ENTRIES, SESSION_MAX_BYTES
+)
+from src.cache import ByteLRUCache, SQLiteCache
+
+
+def new_session_data() -> dict:
+    """Пустое состояние сессии"""
+    return {
+        'history': [],
+        'state': 'IDLE',
+        'data': {},
+        'last_rag_context': None,
+        'last_rag_sources': None,
+        'last_rag_query': None,
+        'last_rag_embedding': None
+    }
+
+
+def _encode(data: dict) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class MemorySessionStore:
+    """Сессии в памяти процесса: LRU по числу и суммарному размеру, TTL"""
+
+    backend = 'memory'
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        # session_id -> (data, размер JSON, время сохранения)
+        self._cache = ByteLRUCache(max_bytes, sizeof=lambda entry: entry[1], max_items=max_entries)
+        self._lock = threading.Lock()
+        self.expired = 0
+
+    def load(self, session_id: str) -> Optional[dict]:
+        entry = self._cache.get(session_id)
+        if entry is None:
+            return None
+        if time.time() - entry[2] > self.ttl:
+            self._cache.delete(session_id)
+            with self._lock:
+                self.expired += 1
+            return None
+        return entry[0]
+
+    def save(self, session_id: str, data: dict) -> None:
+        self._cache.set(session_id, (data, len(_encode(data)), time.time()))
+
+    def delete(self, session_id: str) -> None:
+        self._cache.delete(session_id)
+
+    def exists(self, session_id: str) -> bool:
+        return self.load(session_id) is not None
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend,
+            'sessions': len(self._cache),
+            'bytes': self._cache.total_bytes,
+            'max_sessions': self._cache.max_items,
+            'max_bytes': self._cache.max_bytes,
+            'ttl': self.ttl,
+            'evicted': self._cache.evictions,
+            'expired': self.expired,
+        }
+
+
+class SQLiteSessionStore:
+    """Сессии в SQLite (JSON), общие для воркеров; вытеснение давно не читавшихся"""
+
+    backend = 'sqlite'
+
+    def __init__(self, path, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self._db = SQLiteCache(path, max_entries=max_entries, ttl=ttl)
+
+    def load(self, session_id: str) -> Optional[dict]:
+        try:
+            blob = self._db.get(session_id, max_age=self.ttl)
+        except (sqlite3.Error, OSError) as e:
+            print(f"ОШИБКА: Хранилище сессий: ошибка чтения: {e}")
+            return None
+        return json.loads(blob.decode('utf-8')) if blob is not None else None
+
+    def save(self, session_id: str, data: dict) -> None:
+        try:
+            self._db.set(session_id, _encode(data))
+        except (sqlite3.Error, OSError) as e:
+            print(f"ОШИБКА: Хранилище сессий: ошибка записи: {e}")
+
+    def delete(self, session_id: str) -> None:
+        try:
+            self._db.delete(session_id)
+        except (sqlite3.Error, OSError) as e:
+            print(f"ОШИБКА: Хранилище сессий: ошибка удаления: {e}")
+
+    def exists(self, session_id: str) -> bool:
+        return self.load(session_id) is not None
+
+    def stats(self) -> dict:
+        try:
+            sessions, size = self._db.count(), self._db.total_bytes()
+        except (sqlite3.Error, OSError) as e:
+            print(f"ОШИБКА: Хранилище сессий: {e}")
+            sessions = size = None
+        return {
+            'backend': self.backend,
+            'sessions': sessions,
+            'bytes': size,
+            'max_sessions': self._db.max_entries,
+            'ttl': self.ttl,
+            # Счётчики процесса, который отвечает на запрос
+            'evicted': self._db.evicted,
+            'expired': self._db.expired,
+        }
+
+
+def create_session_store(backend: str = SESSION_BACKEND):
+    if backend == 'memory':
+        return MemorySessionStore(SESSION_TTL, SESSION_MAX_ENTRIES, SESSION_MAX_BYTES)
+    if backend != 'sqlite':
+        print(f"WARN: Неизвестный SESSION_BACKEND '{backend}', используется sqlite")
+    return SQLiteSessionStore(CACHE_DIR / 'sessions.sqlite3', SESSION_TTL, SESSION_MAX_ENTRIES)
+
+
+session_store = create_session_store()
@@ -0,0 +1,94 @@
+# traffic.py - Запись анонимизированных последовательностей /get_response
+#
+# Для нагрузочных прогонов (benchmarks/replay.py) важны порядок и темп
+# запросов: многоходовые диалоги, шаги предписания, вопросы по документу.
+# Текст вопроса не записывается — только его форма:
+#   {"t": 1760700000.123, "session": "3f9a0c1d2e4b5a6c", "kind": "prescription",
+#    "step": "details", "doc_id": "0", "category_doc_ids": null}
+# session — HMAC идентификатора сессии на SECRET_KEY: ходы одного диалога
+# связаны, но по записи сессию не найти. doc_id и category_doc_ids — id
+# документов манифеста. При воспроизведении текст подбирается по виду и шагу.
+#
+# Каждый воркер дописывает свой файл <pid>.jsonl в TRAFFIC_RECORD_DIR.
+import os
+import hmac
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+from src.config import SECRET_KEY, TRAFFIC_RECORD_DIR
+from src.rag import get_user_intent
+
+# Виды запросов
+GENERAL = 'general'
+RAG = 'rag'
+GROUNDING = 'grounding'
+PRESCRIPTION = 'prescription'
+
+# Шаги предписания: по состоянию сессии до запроса
+STEP_START = 'start'                    # «выдать предписание» без вида работ
+STEP_START_DETAILS = 'start_details'    # «выдать предписание по ...»
+STEP_DETAILS = 'details'                # ответ на уточнение вида работ
+STEP_CONFIRM = 'confirm'                # подтверждение нарушений
+
+
+def classify(state: str, user_input: str, doc_id: str) -> Tuple[str, str]:
+    """(вид, шаг) запроса — так же, как его разберёт обработчик /get_response"""
+    intent, description = get_user_intent(user_input)
+    if state.startswith('PRESCRIPTION'):
+        step = STEP_CONFIRM if state == 'PRESCRIPTION_AWAITING_CONFIRMATION' else STEP_DETAILS
+        return PRESCRIPTION, step
+    if intent == 'PRESCRIPTION_REQUEST':
+        return PRESCRIPTION, STEP_START_DETAILS if description else STEP_START
+    if intent == 'GENERAL_CHAT':
+        return GENERAL, ''
+    return (GROUNDING if doc_id != '0' else RAG), ''
+
+
+class TrafficRecorder:
+    """Форма запросов процесса — в <pid>.jsonl"""
+
+    def __init__(self, directory: str, key: str):
+        self.directory = Path(directory) if directory else None
+        self._key = key.encode('utf-8')
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def _open(self):
+        # Файл открывается в процессе, который обрабатывает запросы
+        if self._pid != os.getpid():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.directory / f"{os.getpid()}.jsonl", 'a', encoding='utf-8')
+            self._pid = os.getpid()
+        return self._file
+
+    def pseudonym(self, session_id: str) -> str:
+        return hmac.new(self._key, session_id.encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+    def record(self, session_id: str, state: str, user_input: str, doc_id: str,
+               category_doc_ids: Optional[str] = None) -> None:
+        if self.directory is None:
+            return
+        try:
+            kind, step = classify(state, user_input, str(doc_id))
+            line = json.dumps({
+                't': round(time.time(), 3),
+                'session': self.pseudonym(session_id),
+                'kind': kind,
+                'step': step,
+                'doc_id': str(doc_id),
+                'category_doc_ids': category_doc_ids,
+            }, ensure_ascii=False)
+            with self._lock:
+                f = self._open()
+                f.write(line + '\n')
+                f.flush()
+        except Exception as e:
+            print(f"WARN: Запрос не записан в трафик: {e}")
+
+
+traffic_recorder = TrafficRecorder(TRAFFIC_RECORD_DIR, SECRET_KEY)
@@ -0,0 +1,206 @@
+# vector_index.py - Предзагруженный векторный индекс документов
+import os
+import re
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.config import VECTOR_STORE_DIR
+
+# Суффикс частей раздела, разбитого на несколько чанков: "Заголовок (часть 2)"
+SPLIT_SUFFIX_RE = re.compile(r' \((часть \d+)\)$')
+
+# Чанки короче этого не попадают в выдачу плоского поиска
+MIN_CHUNK_TEXT = 50
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-нормализация строк матрицы (нулевые строки остаются нулевыми)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorIndex:
+    """Все документы хранилища в одной непрерывной матрице.
+
+    Строки чанков одного документа идут подряд, поэтому выборка по doc_id —
+    это срез, а не загрузка файлов.
+    """
+
+    def __init__(self):
+        self.doc_ids: List[str] = []
+        self.metadata: Dict[str, dict] = {}
+        # doc_id -> (start, end) строк в matrix / toc_matrix
+        self.doc_ranges: Dict[str, Tuple[int, int]] = {}
+        self.toc_ranges: Dict[str, Tuple[int, int]] = {}
+
+        # Чанки: нормализованные векторы и чанки по строкам
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.chunks: List[dict] = []
+
+        # Оглавление: нормализованные эмбеддинги разделов
+        self.toc_matrix = np.zeros((0, 0), dtype=np.float32)
+        self.toc_doc = np.zeros(0, dtype=np.int32)
+        self.toc_sections: List[dict] = []
+
+        # Разделы (заголовок без "(часть N)" в пределах документа):
+        # строка -> раздел и CSR-список строк раздела по порядку
+        self.chunk_section = np.zeros(0, dtype=np.int32)
+        self.section_offsets = np.zeros(1, dtype=np.int64)
+        self.section_members = np.zeros(0, dtype=np.int64)
+        self.section_headers: List[str] = []
+        # Чанк достаточно длинный для выдачи
+        self.chunk_is_long = np.zeros(0, dtype=bool)
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self.chunks)
+
+    def section_chunks(self, toc_row: int) -> List[dict]:
+        """Чанки раздела оглавления"""
+        sec = self.toc_sections[toc_row]
+        return self.chunks[sec['row_start']:sec['row_end']]
+
+    def section_rows(self, row: int) -> np.ndarray:
+        """Все строки раздела, к которому относится чанк (по порядку)"""
+        sec = self.chunk_section[row]
+        return self.section_members[self.section_offsets[sec]:self.section_offsets[sec + 1]]
+
+    def build_sections(self) -> None:
+        """Группировка чанков по разделам; выполняется при загрузке"""
+        section_ids = {}
+        chunk_section = np.empty(self.num_chunks, dtype=np.int32)
+        self.section_headers = []
+
+        for row, chunk in enumerate(self.chunks):
+            base_header = SPLIT_SUFFIX_RE.sub('', chunk.get('section_header', ''))
+            key = (chunk.get('doc_id'), base_header)
+            if key not in section_ids:
+                section_ids[key] = len(self.section_headers)
+                self.section_headers.append(base_header)
+            chunk_section[row] = section_ids[key]
+
+        # Стабильная сортировка сохраняет порядок чанков внутри раздела
+        self.chunk_section = chunk_section
+        self.section_members = np.argsort(chunk_section, kind='stable').astype(np.int64)
+        counts = np.bincount(chunk_section, minlength=len(self.section_headers))
+        self.section_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        self.chunk_is_long = np.array(
+            [len(chunk.get('text', '')) > MIN_CHUNK_TEXT for chunk in self.chunks], dtype=bool
+        )
+
+
+def _load_document(doc_id: str, directory) -> Optional[Tuple[list, dict]]:
+    vector_file = os.path.join(directory, f"{doc_id}_vectors.json")
+    meta_file = os.path.join(directory, f"{doc_id}_metadata.json")
+
+    if not os.path.exists(vector_file) or not os.path.exists(meta_file):
+        return None
+
+    with open(vector_file, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    return chunks, metadata
+
+
+def load_vector_index(directory=VECTOR_STORE_DIR) -> VectorIndex:
+    """Загрузить все документы хранилища в VectorIndex"""
+    index = VectorIndex()
+
+    doc_ids = sorted(
+        name[:-len('_vectors.json')]
+        for name in os.listdir(directory)
+        if name.endswith('_vectors.json')
+    ) if os.path.isdir(directory) else []
+
+    vectors, toc_vectors = [], []
+    toc_doc = []
+
+    for doc_id in doc_ids:
+        try:
+            loaded = _load_document(doc_id, directory)
+        except Exception as e:
+            print(f"Ошибка загрузки {doc_id}: {e}")
+            continue
+        if not loaded:
+            continue
+
+        chunks, metadata = loaded
+        doc_num = len(index.doc_ids)
+        row_start = len(index.chunks)
+
+        for chunk in chunks:
+            vectors.append(chunk['vector'])
+            index.chunks.append({k: v for k, v in chunk.items() if k != 'vector'})
+        row_end = len(index.chunks)
+
+        toc_start = len(index.toc_sections)
+        for sec in metadata.get('table_of_contents', []):
+            if 'embedding' not in sec:
+                continue
+            # start_chunk_index задан относительно документа -> глобальные строки
+            start = row_start + int(sec['start_chunk_index'])
+            end = min(start + int(sec['num_chunks']), row_end)
+            toc_vectors.append(sec['embedding'])
+            index.toc_sections.append({
+                **{k: v for k, v in sec.items() if k != 'embedding'},
+                'doc_id': doc_id,
+                'row_start': start,
+                'row_end': end,
+            })
+            toc_doc.append(doc_num)
+
+        index.doc_ids.append(doc_id)
+        index.doc_ranges[doc_id] = (row_start, row_end)
+        index.toc_ranges[doc_id] = (toc_start, len(index.toc_sections))
+        index.metadata[doc_id] = {k: v for k, v in metadata.items() if k != 'table_of_contents'}
+
+    if vectors:
+        index.matrix = normalize_rows(vectors)
+    if toc_vectors:
+        index.toc_matrix = normalize_rows(toc_vectors)
+    index.toc_doc = np.asarray(toc_doc, dtype=np.int32)
+    index.build_sections()
+
+    print(
+        f"INFO: Векторный индекс загружен: {len(index.doc_ids)} док., "
+        f"{index.num_chunks} фрагментов, {len(index.toc_sections)} разделов"
+    )
+    return index
+
+
+_index: Optional[VectorIndex] = None
+_index_lock = threading.Lock()
+
+
+def _load_default_index() -> VectorIndex:
+    # Бинарное хранилище (memmap) общее для всех воркеров через page cache;
+    # JSON остаётся источником истины и запасным вариантом
+    from src.vector_store import is_binary_store_fresh, load_binary_store
+
+    if is_binary_store_fresh():
+        try:
+            return load_binary_store()
+        except Exception as e:
+            print(f"ОШИБКА: Не удалось открыть бинарное хранилище: {e}")
+    else:
+        print("WARN: Бинарное хранилище отсутствует или устарело, загрузка из JSON")
+    return load_vector_index()
+
+
+def get_vector_index() -> VectorIndex:
+    """Индекс процесса (загружается один раз)"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _load_default_index()
+    return _index
@@ -0,0 +1,216 @@
+# vector_store.py - Бинарный формат векторного хранилища (memmap)
+#
+# Раскладка каталога VECTOR_BINARY_DIR:
+#   chunks.npy      - float32 (N, D), нормализованные векторы чанков
+#   toc.npy         - float32 (M, D), нормализованные эмбеддинги разделов
+#   chunks.json     - колонки текста и атрибутов чанков
+#   toc.json        - колонки атрибутов разделов
+#   documents.json  - диапазоны строк, метаданные документов, отпечатки исходников
+#
+# Запуск конвертера: python -m src.vector_store convert
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from src.config import VECTOR_STORE_DIR, VECTOR_BINARY_DIR
+from src.vector_index import VectorIndex, load_vector_index
+
+FORMAT_VERSION = 1
+DOCUMENTS_FILE = 'documents.json'
+
+
+def _source_files(source_dir) -> List[str]:
+    if not os.path.isdir(source_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(source_dir)
+        if name.endswith('_vectors.json') or name.endswith('_metadata.json')
+    )
+
+
+def file_sha256(path) -> str:
+    """sha256 файла (читается блоками по 1 МБ)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_fingerprint(source_dir=VECTOR_STORE_DIR, with_hash: bool = True) -> Dict[str, dict]:
+    """Размеры, mtime (и хеши) исходных JSON-файлов хранилища"""
+    result = {}
+    for name in _source_files(source_dir):
+        path = os.path.join(source_dir, name)
+        st = os.stat(path)
+        entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        if with_hash:
+            entry['sha256'] = file_sha256(path)
+        result[name] = entry
+    return result
+
+
+def _to_columns(rows: List[dict]) -> Dict[str, list]:
+    keys = []
+    for row in rows:
+        for key in row:
+            if key not in keys:
+                keys.append(key)
+    return {key: [row.get(key) for row in rows] for key in keys}
+
+
+def _from_columns(columns: Dict[str, list]) -> List[dict]:
+    if not columns:
+        return []
+    size = len(next(iter(columns.values())))
+    return [
+        {key: values[i] for key, values in columns.items() if values[i] is not None}
+        for i in range(size)
+    ]
+
+
+def write_atomic(path: Path, write) -> None:
+    """Атомарная запись: write(f) пишет во временный файл, затем rename.
+
+    Имя временного файла своё у каждого потока: один файл могут
+    одновременно писать несколько потоков и процессов.
+    """
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path: Path, data) -> None:
+    payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    write_atomic(path, lambda f: f.write(payload))
+
+
+def save_binary_store(index: VectorIndex, output_dir=VECTOR_BINARY_DIR, sources: Dict[str, dict] = None) -> None:
+    """Записать индекс в бинарном формате.
+
+    documents.json пишется последним: пока он не обновлён, загрузчик видит
+    прежнюю версию отпечатков и считает хранилище устаревшим.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    write_atomic(output_dir / 'chunks.npy', lambda f: np.save(f, index.matrix.astype(np.float32)))
+    write_atomic(output_dir / 'toc.npy', lambda f: np.save(f, index.toc_matrix.astype(np.float32)))
+    _write_json(output_dir / 'chunks.json', _to_columns(index.chunks))
+    _write_json(output_dir / 'toc.json', _to_columns(index.toc_sections))
+    _write_json(output_dir / DOCUMENTS_FILE, {
+        'format_version': FORMAT_VERSION,
+        'doc_ids': index.doc_ids,
+        'doc_ranges': index.doc_ranges,
+        'toc_ranges': index.toc_ranges,
+        'metadata': index.metadata,
+        'sources': sources or {},
+    })
+
+
+def load_binary_store(directory=VECTOR_BINARY_DIR) -> VectorIndex:
+    """Открыть бинарное хранилище; матрицы отображаются в память только для чтения"""
+    directory = Path(directory)
+    with open(directory / DOCUMENTS_FILE, 'r', encoding='utf-8') as f:
+        documents = json.load(f)
+    if documents.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Неподдерживаемая версия формата: {documents.get('format_version')}")
+
+    index = VectorIndex()
+    index.doc_ids = documents['doc_ids']
+    index.doc_ranges = {k: tuple(v) for k, v in documents['doc_ranges'].items()}
+    index.toc_ranges = {k: tuple(v) for k, v in documents['toc_ranges'].items()}
+    index.metadata = documents['metadata']
+
+    index.matrix = np.load(directory / 'chunks.npy', mmap_mode='r')
+    index.toc_matrix = np.load(directory / 'toc.npy', mmap_mode='r')
+
+    with open(directory / 'chunks.json', 'r', encoding='utf-8') as f:
+        index.chunks = _from_columns(json.load(f))
+    with open(directory / 'toc.json', 'r', encoding='utf-8') as f:
+        index.toc_sections = _from_columns(json.load(f))
+
+    doc_num = {doc_id: i for i, doc_id in enumerate(index.doc_ids)}
+    index.toc_doc = np.asarray([doc_num[s['doc_id']] for s in index.toc_sections], dtype=np.int32)
+    index.build_sections()
+
+    print(
+        f"INFO: Бинарный векторный индекс открыт (memmap): {len(index.doc_ids)} док., "
+        f"{index.num_chunks} фрагментов, {len(index.toc_sections)} разделов"
+    )
+    return index
+
+
+def is_binary_store_fresh(directory=VECTOR_BINARY_DIR, source_dir=VECTOR_STORE_DIR) -> bool:
+    """Бинарное хранилище существует и собрано из текущих JSON-файлов (по размерам и mtime)"""
+    documents_path = Path(directory) / DOCUMENTS_FILE
+    if not documents_path.exists():
+        return False
+    try:
+        with open(documents_path, 'r', encoding='utf-8') as f:
+            recorded = json.load(f).get('sources', {})
+    except Exception:
+        return False
+
+    current = source_fingerprint(source_dir, with_hash=False)
+    if set(current) != set(recorded):
+        return False
+    return all(
+        recorded[name].get('size') == entry['size'] and recorded[name].get('mtime_ns') == entry['mtime_ns']
+        for name, entry in current.items()
+    )
+
+
+def convert_json_store(source_dir=VECTOR_STORE_DIR, output_dir=VECTOR_BINARY_DIR) -> VectorIndex:
+    """Сконвертировать JSON-хранилище в бинарный формат"""
+    index = load_vector_index(source_dir)
+    save_binary_store(index, output_dir, sources=source_fingerprint(source_dir))
+    print(f"INFO: Бинарное хранилище записано: {output_dir}")
+    return index
+
+
+def verify_binary_store(directory=VECTOR_BINARY_DIR, source_dir=VECTOR_STORE_DIR) -> bool:
+    """Полная проверка по хешам исходных файлов"""
+    documents_path = Path(directory) / DOCUMENTS_FILE
+    if not documents_path.exists():
+        return False
+    with open(documents_path, 'r', encoding='utf-8') as f:
+        recorded = json.load(f).get('sources', {})
+    # mtime не сравнивается: после копирования файлов содержимое то же
+    current = source_fingerprint(source_dir)
+    if set(current) != set(recorded):
+        return False
+    return all(
+        recorded[name].get('size') == entry['size'] and recorded[name].get('sha256') == entry['sha256']
+        for name, entry in current.items()
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бинарное векторное хранилище")
+    parser.add_argument('command', choices=['convert', 'verify'])
+    parser.add_argument('--source', default=str(VECTOR_STORE_DIR), help="Каталог JSON-хранилища")
+    parser.add_argument('--output', default=str(VECTOR_BINARY_DIR), help="Каталог бинарного хранилища")
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        convert_json_store(args.source, args.output)
+        return 0
+
+    if verify_binary_store(args.output, args.source):
+        print("OK: Бинарное хранилище актуально")
+        return 0
+    print("WARN: Бинарное хранилище устарело или отсутствует")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -325,6 +325,8 @@ function sendMessage() {
         
         const reader = response.body.getReader();
         const decoder = new TextDecoder("utf-8");
+        // Событие SSE может прийти частями: незавершённый хвост ждёт следующего чтения
+        let pending = "";
 
         const readStream = () => {
             reader.read().then(({ done, value }) => {
@@ -334,8 +336,9 @@ function sendMessage() {
                     userInput.focus();
                     return;
                 }
-                const chunk = decoder.decode(value, { stream: true });
-                const lines = chunk.split('\n\n');
+                pending += decoder.decode(value, { stream: true });
+                const lines = pending.split('\n\n');
+                pending = lines.pop();
                 lines.forEach(line => {
                     if (line.startsWith('data:')) {
                         const jsonData = line.substring(5).trim();
@@ -0,0 +1,12 @@
+# conftest.py - Окружение тестов: fake-клиент Gemini, DEV_MODE (fake Hub), кеши во временном каталоге
+#
+# Окружение задаётся до импорта модулей src: конфигурация читается при импорте.
+import atexit
+import shutil
+import tempfile
+
+from benchmarks.report import use_fake_backend
+
+_workdir = tempfile.mkdtemp(prefix='tests-')
+atexit.register(shutil.rmtree, _workdir, True)
+use_fake_backend(_workdir)
@@ -0,0 +1,58 @@
+# test_benchmarks.py - Бенчмарк конвейера: уникальность запросов, разбор SSE-ответа, сводка
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.pipeline import StreamTimer, make_payloads, rag_queries, summarize
+from src import vector_index
+
+SECTIONS = [{'full_path': 'Раздел 1'}, {'full_path': 'Раздел 2'}]
+
+
+@pytest.fixture(autouse=True)
+def toc(monkeypatch):
+    index = SimpleNamespace(toc_sections=SECTIONS)
+    monkeypatch.setattr(vector_index, 'get_vector_index', lambda: index)
+
+
+def test_rag_queries_unique_within_and_between_runs():
+    first, second = rag_queries(5), rag_queries(5)
+    assert len(set(first)) == 5
+    assert not set(first) & set(second)
+    assert first[0].startswith('Раздел 1') and first[1].startswith('Раздел 2')
+
+
+def test_payloads_have_own_sessions():
+    payloads = [json.loads(body) for body in make_payloads('rag', 3)]
+    assert len({p['session_id'] for p in payloads}) == 3
+    assert all(p['doc_id'] == '0' for p in payloads)
+    general = [json.loads(body) for body in make_payloads('general', 2)]
+    assert [p['user_input'] for p in general] == ['привет', 'привет']
+
+
+def test_stream_timer_marks_first_content():
+    timer = StreamTimer()
+    timer.feed(b': ping\n\n')
+    timer.feed(b'data: {"type": "content", "data": "a"}\n\n')
+    timer.finish(200)
+    assert timer.error is None
+    assert timer.ttfb <= timer.first_content <= timer.total
+
+
+def test_stream_timer_errors():
+    assert StreamTimer().finish(500).error == 'HTTP 500'
+    assert StreamTimer().finish(200).error == 'no content'
+    timer = StreamTimer()
+    timer.feed(b'data: {"type": "error", "data": "x"}\n\n')
+    assert timer.finish(200).error == 'error event'
+
+
+def test_summarize_counts_errors_separately():
+    ok = StreamTimer()
+    ok.feed(b'data: {"type": "content", "data": "a"}\n\n')
+    timers = [ok.finish(200), StreamTimer().finish(500)]
+    metrics = summarize(timers, elapsed=2.0)
+    assert metrics['requests'] == 2 and metrics['errors'] == 1
+    assert metrics['rps'] == 1.0
+    assert any(key.startswith('ttfb_') for key in metrics)
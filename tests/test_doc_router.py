@@ -0,0 +1,155 @@
+# test_doc_router.py - Локальный роутер документов: отсечение по отрыву, запасной путь через LLM
+import math
+
+import numpy as np
+import pytest
+
+from src import rag
+from src import doc_router
+from src.config import ROUTER_CONFIDENCE, ROUTER_MARGIN, ROUTER_MAX_DOCS, ROUTER_MIN_SCORE
+from src.doc_router import DESCRIPTION_WEIGHT, DocumentRouter, load_router
+from src.vector_index import VectorIndex
+
+
+def _unit(score: float, axis: int, dim: int) -> np.ndarray:
+    """Вектор с косинусом score к оси 0"""
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[0] = score
+    vector[axis] = math.sqrt(1 - score ** 2)
+    return vector
+
+
+def _router(scores, indexed=None, toc_scores=None) -> DocumentRouter:
+    """Роутер, у которого запрос QUERY(dim) получает оценки описаний scores"""
+    doc_ids = [f"DOC_{i}" for i in range(len(scores))]
+    dim = len(scores) + 2
+    index = VectorIndex()
+    index.doc_ids = [d for d in doc_ids if indexed is None or d in indexed]
+    index.toc_ranges = {d: (0, 0) for d in index.doc_ids}
+
+    toc_vectors, toc_doc = [], []
+    for doc_id, toc_score in (toc_scores or {}).items():
+        start = len(toc_vectors)
+        toc_vectors.append(_unit(toc_score, dim - 1, dim))
+        toc_doc.append(index.doc_ids.index(doc_id))
+        index.toc_ranges[doc_id] = (start, start + 1)
+        index.toc_sections.append({'doc_id': doc_id})
+    if toc_vectors:
+        index.toc_matrix = np.stack(toc_vectors)
+        index.toc_doc = np.asarray(toc_doc, dtype=np.int32)
+
+    desc = np.stack([_unit(s, i + 1, dim) for i, s in enumerate(scores)])
+    return DocumentRouter(doc_ids, desc, index)
+
+
+def _query(router: DocumentRouter) -> list:
+    query = [0.0] * router.desc_matrix.shape[1]
+    query[0] = 1.0
+    return query
+
+
+def test_best_document_returned_even_below_min_score():
+    router = _router([ROUTER_MIN_SCORE - 0.2, ROUTER_MIN_SCORE - 0.21])
+    doc_ids, best = router.route(_query(router))
+    assert doc_ids == ['DOC_0']
+    assert best == pytest.approx(ROUTER_MIN_SCORE - 0.2, abs=1e-5)
+
+
+def test_margin_selects_close_documents():
+    top = 0.9
+    router = _router([top - ROUTER_MARGIN / 2, top, top - ROUTER_MARGIN * 2])
+    doc_ids, best = router.route(_query(router))
+    assert doc_ids == ['DOC_1', 'DOC_0']
+    assert best == pytest.approx(top, abs=1e-5)
+
+
+def test_selection_capped_at_max_docs():
+    router = _router([0.9] * (ROUTER_MAX_DOCS + 2))
+    doc_ids, _ = router.route(_query(router))
+    assert len(doc_ids) == ROUTER_MAX_DOCS
+
+
+def test_documents_without_vectors_are_never_selected():
+    router = _router([0.9, 0.5], indexed={'DOC_1'})
+    assert router.route(_query(router))[0] == ['DOC_1']
+
+    router = _router([0.9, 0.5], indexed=set())
+    assert router.route(_query(router)) == ([], 0.0)
+
+
+def test_toc_headers_weighted_with_description():
+    router = _router([0.4, 0.6], toc_scores={'DOC_0': 1.0})
+    scores = router.score(_query(router))
+    assert scores[0] == pytest.approx(DESCRIPTION_WEIGHT * 0.4 + (1 - DESCRIPTION_WEIGHT) * 1.0, abs=1e-5)
+    assert scores[1] == pytest.approx(0.6, abs=1e-5)
+
+
+def test_confident_route_skips_llm():
+    router = _router([ROUTER_CONFIDENCE + 0.1])
+    assert rag._route_locally(router, _query(router)) == (['DOC_0'], False)
+
+
+def test_low_confidence_asks_llm(monkeypatch):
+    router = _router([ROUTER_CONFIDENCE - 0.1])
+    assert rag._route_locally(router, _query(router)) == (['DOC_0'], True)
+
+    monkeypatch.setattr(rag, 'ROUTER_LLM_FALLBACK', False)
+    assert rag._route_locally(router, _query(router)) == (['DOC_0'], False)
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    """route_query_to_docs с подменёнными роутером и LLM; возвращает вызовы LLM"""
+    llm_calls = []
+    llm_answer = []
+
+    def route_with_llm(query):
+        llm_calls.append(query)
+        return list(llm_answer)
+
+    monkeypatch.setattr(rag, '_route_with_llm', route_with_llm)
+    return llm_calls, llm_answer
+
+
+def test_llm_answer_preferred_when_router_unsure(monkeypatch, routed):
+    llm_calls, llm_answer = routed
+    router = _router([ROUTER_CONFIDENCE - 0.1])
+    monkeypatch.setattr(rag, 'get_document_router', lambda documents: router)
+
+    llm_answer.append('DOC_LLM')
+    assert rag.route_query_to_docs('вопрос', _query(router)) == ['DOC_LLM']
+    # LLM ничего не выбрал — остаётся выбор локального роутера
+    llm_answer.clear()
+    assert rag.route_query_to_docs('вопрос', _query(router)) == ['DOC_0']
+    assert len(llm_calls) == 2
+
+
+def test_llm_used_when_router_unavailable(monkeypatch, routed):
+    llm_calls, llm_answer = routed
+    monkeypatch.setattr(rag, 'get_document_router', lambda documents: None)
+    llm_answer.append('DOC_LLM')
+    assert rag.route_query_to_docs('вопрос', [1.0, 0.0]) == ['DOC_LLM']
+    assert llm_calls == ['вопрос']
+
+
+def test_load_router_embeds_only_changed_descriptions(monkeypatch, tmp_path):
+    embedded = []
+
+    def embed_texts(texts):
+        embedded.extend(texts)
+        return [[1.0, float(len(text))] for text in texts]
+
+    monkeypatch.setattr(doc_router, 'embed_texts', embed_texts)
+    manifest = [
+        {'id': '0', 'name': 'Все документы'},
+        {'id': 'A', 'name': 'Документ A', 'description': 'леса'},
+        {'id': 'B', 'name': 'Документ B', 'description': 'кровля'},
+    ]
+    router = load_router(manifest, VectorIndex(), tmp_path)
+    assert router.doc_ids == ['A', 'B']
+    assert len(embedded) == 2
+
+    embedded.clear()
+    manifest[2]['description'] = 'кровельные работы'
+    load_router(manifest, VectorIndex(), tmp_path)
+    assert embedded == ['Документ B. кровельные работы']
@@ -0,0 +1,171 @@
+# test_events.py - Отправка стрима по SSE: склейка частей ответа, heartbeat, остановка после отключения
+import json
+import time
+import asyncio
+import threading
+
+import pytest
+
+from src import events
+from src.events import HEARTBEAT, FrameWriter, PumpPool, asse_stream, sse_stream
+
+
+def _frames(chunks) -> list:
+    """Кадры SSE -> [(type, data)] и 'ping' для heartbeat"""
+    result = []
+    for chunk in chunks:
+        for frame in chunk.split('\n\n'):
+            if frame == HEARTBEAT.strip():
+                result.append('ping')
+            elif frame:
+                data = json.loads(frame[len('data: '):])
+                result.append((data['type'], data['data']))
+    return result
+
+
+def _events(parts, pause: float = 0.0, log=None):
+    for part in parts:
+        if log is not None:
+            log.append(part)
+        if pause:
+            time.sleep(pause)
+        yield events.content(part)
+    yield events.sources([{'id': 1}])
+
+
+@pytest.fixture(autouse=True)
+def pump_pool(monkeypatch):
+    pool = PumpPool(2)
+    monkeypatch.setattr(events, 'pump_pool', pool)
+    return pool
+
+
+# --- FrameWriter (время передаётся явно) ---
+
+def test_first_part_sent_immediately_rest_coalesced():
+    writer = FrameWriter(window=0.05, max_chars=100, heartbeat=0)
+    assert _frames([writer.event(events.content('a'), 0.0)]) == [('content', 'a')]
+    assert writer.event(events.content('b'), 0.01) == ''
+    assert writer.event(events.content('c'), 0.02) == ''
+    assert writer.timeout(0.02) == pytest.approx(0.03)
+    assert _frames([writer.idle(0.05)]) == [('content', 'bc')]
+
+
+def test_max_chars_flushes_early():
+    writer = FrameWriter(window=1.0, max_chars=3, heartbeat=0)
+    writer.event(events.content('a'), 0.0)
+    assert writer.event(events.content('bb'), 0.1) == ''
+    assert _frames([writer.event(events.content('c'), 0.2)]) == [('content', 'bbc')]
+
+
+def test_other_event_flushes_pending_parts_first():
+    writer = FrameWriter(window=1.0, max_chars=100, heartbeat=0)
+    writer.event(events.content('a'), 0.0)
+    writer.event(events.content('b'), 0.1)
+    chunk = writer.event(events.sources([]), 0.2)
+    assert _frames([chunk]) == [('content', 'b'), ('sources', [])]
+
+
+def test_heartbeat_only_after_silence():
+    writer = FrameWriter(window=0.05, max_chars=100, heartbeat=15)
+    start = writer._last_write
+    assert writer.idle(start + 14) == ''
+    assert writer.idle(start + 15) == HEARTBEAT
+    assert writer.timeout(start + 15) == pytest.approx(15)
+
+
+# --- sse_stream (WSGI) ---
+
+def test_without_coalescing_each_event_is_a_frame():
+    chunks = list(sse_stream(_events(['a', 'b']), coalesce_ms=0, heartbeat=0))
+    assert _frames(chunks) == [('content', 'a'), ('content', 'b'), ('sources', [{'id': 1}])]
+    assert len(chunks) == 3
+
+
+def test_coalesces_fast_parts():
+    chunks = list(sse_stream(_events(['a', 'b', 'c', 'd']), coalesce_ms=200, heartbeat=0))
+    assert _frames(chunks) == [('content', 'a'), ('content', 'bcd'), ('sources', [{'id': 1}])]
+
+
+def test_heartbeat_while_waiting_for_events():
+    chunks = list(sse_stream(_events(['a'], pause=0.25), coalesce_ms=10, heartbeat=0.1))
+    frames = _frames(chunks)
+    assert frames.count('ping') >= 1
+    assert frames[-2:] == [('content', 'a'), ('sources', [{'id': 1}])]
+
+
+def test_busy_pool_reads_stream_in_request_thread(pump_pool, monkeypatch):
+    monkeypatch.setattr(events, 'pump_pool', PumpPool(0))
+    names = []
+
+    def stream():
+        names.append(threading.current_thread().name)
+        yield from _events(['a', 'b'])
+
+    chunks = list(sse_stream(stream(), coalesce_ms=200, heartbeat=0.01))
+    assert names == [threading.current_thread().name]
+    assert _frames(chunks) == [('content', 'a'), ('content', 'b'), ('sources', [{'id': 1}])]
+
+
+def test_pump_threads_are_reused(pump_pool):
+    names = set()
+
+    def stream():
+        names.add(threading.current_thread().name)
+        yield events.content('a')
+
+    for _ in range(5):
+        list(sse_stream(stream(), coalesce_ms=10, heartbeat=0))
+    assert len(names) <= pump_pool.max_workers
+    assert all(name.startswith('sse-pump') for name in names)
+
+
+def test_disconnect_stops_generation_before_next_event():
+    log = []
+    closed = threading.Event()
+
+    def stream():
+        try:
+            yield from _events([str(i) for i in range(20)], pause=0.02, log=log)
+        finally:
+            closed.set()
+
+    chunks = sse_stream(stream(), coalesce_ms=10, heartbeat=0)
+    next(chunks)
+    chunks.close()
+    assert closed.wait(1)
+    assert len(log) < 5
+
+
+def test_pump_error_becomes_error_event():
+    def stream():
+        yield events.content('a')
+        raise RuntimeError('сбой')
+
+    frames = _frames(sse_stream(stream(), coalesce_ms=10, heartbeat=0))
+    assert frames == [('content', 'a'), ('error', 'Ошибка: сбой')]
+
+
+# --- asse_stream (ASGI) ---
+
+async def _aevents(parts, pause: float = 0.0):
+    for part in parts:
+        await asyncio.sleep(pause)
+        yield events.content(part)
+    yield events.sources([])
+
+
+async def _collect(stream) -> list:
+    return [chunk async for chunk in stream]
+
+
+def test_async_coalescing():
+    chunks = asyncio.run(_collect(asse_stream(_aevents(['a', 'b', 'c']), coalesce_ms=200, heartbeat=0)))
+    assert _frames(chunks) == [('content', 'a'), ('content', 'bc'), ('sources', [])]
+
+
+def test_async_heartbeat():
+    chunks = asyncio.run(_collect(asse_stream(_aevents(['a'], pause=0.25), coalesce_ms=10, heartbeat=0.1)))
+    frames = _frames(chunks)
+    assert frames.count('ping') >= 1
+    assert frames[-2:] == [('content', 'a'), ('sources', [])]
@@ -0,0 +1,61 @@
+# test_followup.py - Пороги локального определения уточняющих вопросов
+import math
+
+import pytest
+
+from src.config import FOLLOWUP_NEW_SIMILARITY, FOLLOWUP_REUSE_SIMILARITY
+from src.followup import is_short_followup, lexical_overlap, needs_new_search
+
+PREVIOUS = 'Требования к фундаментам зданий'
+
+
+def _vector(similarity: float) -> list:
+    """Единичный вектор с заданным косинусом к [1, 0]"""
+    return [similarity, math.sqrt(1 - similarity ** 2)]
+
+
+BASE = [1.0, 0.0]
+
+
+@pytest.mark.parametrize('query', ['а подробнее?', 'Почему?', 'объясни', 'а как для зданий?'])
+def test_short_followup(query):
+    assert is_short_followup(query, PREVIOUS)
+
+
+@pytest.mark.parametrize('query', [
+    'а что с кровлей?',  # новая тема в короткой реплике
+    'требования к ограждениям лестниц на высоте',  # нет маркера
+    'а подробнее про ограждения лестничных маршей и площадок',  # длиннее FOLLOWUP_SHORT_TOKENS
+    '',
+])
+def test_not_short_followup(query):
+    assert not is_short_followup(query, PREVIOUS)
+
+
+def test_short_followup_reuses_context_without_embeddings():
+    assert needs_new_search('а подробнее?', None, PREVIOUS, None) is False
+
+
+def test_unknown_without_previous_query_or_embeddings():
+    assert needs_new_search('требования к кровле', BASE, None, BASE) is None
+    assert needs_new_search('требования к кровле', None, PREVIOUS, BASE) is None
+
+
+def test_reuse_at_threshold():
+    query = 'какие требования к фундаментам'
+    assert needs_new_search(query, _vector(FOLLOWUP_REUSE_SIMILARITY), PREVIOUS, BASE) is False
+    assert needs_new_search(query, _vector(FOLLOWUP_REUSE_SIMILARITY - 0.01), PREVIOUS, BASE) is None
+
+
+def test_new_search_needs_low_similarity_and_no_common_words():
+    similarity = FOLLOWUP_NEW_SIMILARITY - 0.01
+    assert needs_new_search('ограждения кровли', _vector(similarity), PREVIOUS, BASE) is True
+    # Общее слово с прежним вопросом — решает LLM
+    assert needs_new_search('ограждения фундаментам', _vector(similarity), PREVIOUS, BASE) is None
+    # На пороге — тоже неоднозначно
+    assert needs_new_search('ограждения кровли', _vector(FOLLOWUP_NEW_SIMILARITY), PREVIOUS, BASE) is None
+
+
+def test_lexical_overlap_ignores_stop_words_and_punctuation():
+    assert lexical_overlap('А какие требования к фундаментам?', PREVIOUS) == pytest.approx(2 / 3)
+    assert lexical_overlap('и в на', PREVIOUS) == 0.0
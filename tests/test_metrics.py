@@ -0,0 +1,120 @@
+# test_metrics.py - Гистограммы этапов: корзины, формат Prometheus, сумма снимков воркеров
+import json
+import os
+import time
+
+import pytest
+
+from src.metrics import Counter, Histogram, MetricsRegistry, StageTimings
+
+
+def _registry(directory='', stale: float = 60.0):
+    registry = MetricsRegistry(str(directory) if directory else '', flush_interval=0, stale=stale)
+    histogram = Histogram(registry, 'stage_seconds', "Этап", labels=('stage',), buckets=(0.1, 0.5, 1.0))
+    counter = Counter(registry, 'requests_total', "Запросы", labels=('intent',))
+    return registry, histogram, counter
+
+
+def _samples(text: str) -> dict:
+    """Строки "имя{метки} значение" -> {"имя{метки}": значение}"""
+    result = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            result[name] = float(value)
+    return result
+
+
+def test_histogram_buckets_are_cumulative_with_inclusive_bounds():
+    registry, histogram, _ = _registry()
+    for value in (0.05, 0.1, 0.3, 1.0, 5.0):
+        histogram.observe(value, 'search')
+
+    samples = _samples(registry.render())
+    assert samples['stage_seconds_bucket{stage="search",le="0.1"}'] == 2
+    assert samples['stage_seconds_bucket{stage="search",le="0.5"}'] == 3
+    assert samples['stage_seconds_bucket{stage="search",le="1"}'] == 4
+    assert samples['stage_seconds_bucket{stage="search",le="+Inf"}'] == 5
+    assert samples['stage_seconds_count{stage="search"}'] == 5
+    assert samples['stage_seconds_sum{stage="search"}'] == pytest.approx(6.45)
+
+
+def test_render_has_help_type_and_escaped_labels():
+    registry, _, counter = _registry()
+    counter.inc('say "hi"\n')
+    counter.inc('rag', amount=2.5)
+
+    text = registry.render()
+    assert '# HELP requests_total Запросы\n# TYPE requests_total counter' in text
+    assert '# TYPE stage_seconds histogram' in text
+    assert 'requests_total{intent="say \\"hi\\"\\n"} 1\n' in text
+    assert 'requests_total{intent="rag"} 2.5\n' in text
+
+
+def test_flush_writes_own_snapshot(tmp_path):
+    registry, histogram, _ = _registry(tmp_path)
+    histogram.observe(0.2, 'embed')
+    registry.flush()
+
+    with open(tmp_path / f"{os.getpid()}.json", 'r', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    assert snapshot['stage_seconds'] == {'["embed"]': [0, 1, 0, 0, 0.2]}
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_collect_sums_fresh_snapshots_of_other_workers(tmp_path):
+    registry, histogram, counter = _registry(tmp_path)
+    histogram.observe(0.2, 'embed')
+    counter.inc('rag')
+
+    other, other_histogram, other_counter = _registry()
+    other_histogram.observe(0.7, 'embed')
+    other_histogram.observe(0.05, 'route')
+    other_counter.inc('rag', amount=3)
+    (tmp_path / '999991.json').write_text(json.dumps(other.snapshot()), encoding='utf-8')
+    # Свой снимок на диске не учитывается: свои ряды берутся из памяти
+    (tmp_path / f"{os.getpid()}.json").write_text(json.dumps(other.snapshot()), encoding='utf-8')
+
+    samples = _samples(registry.render())
+    assert samples['stage_seconds_count{stage="embed"}'] == 2
+    assert samples['stage_seconds_bucket{stage="embed",le="0.5"}'] == 1
+    assert samples['stage_seconds_sum{stage="embed"}'] == pytest.approx(0.9)
+    assert samples['stage_seconds_count{stage="route"}'] == 1
+    assert samples['requests_total{intent="rag"}'] == 4
+
+
+def test_stale_snapshots_are_ignored_and_removed(tmp_path):
+    registry, _, counter = _registry(tmp_path, stale=60)
+    other, _, other_counter = _registry()
+    other_counter.inc('rag', amount=5)
+
+    stale = tmp_path / '999992.json'
+    stale.write_text(json.dumps(other.snapshot()), encoding='utf-8')
+    old = time.time() - 120
+    os.utime(stale, (old, old))
+    broken = tmp_path / '999993.json'
+    broken.write_text('{', encoding='utf-8')
+
+    counter.inc('rag')
+    assert _samples(registry.render())['requests_total{intent="rag"}'] == 1
+    assert not stale.exists()
+    assert broken.exists()
+
+
+def test_metrics_reset_in_forked_worker():
+    registry, histogram, _ = _registry()
+    histogram.observe(0.2, 'embed')
+    # Так выглядит реестр мастера в воркере после fork
+    registry._pid = -1
+    registry.ensure_started()
+    assert registry.collect()['stage_seconds'] == {}
+
+
+def test_stage_timings_summary():
+    timings = StageTimings()
+    timings.record('embed', 0.0123)
+    with timings.stage('search'):
+        pass
+    assert timings.as_dict()['embed'] == pytest.approx(12.3)
+    assert 'search' in timings.as_dict()
+    assert timings.summary().startswith('embed=12мс')
@@ -0,0 +1,235 @@
+# test_resilience.py - Предохранитель и политика вызовов: переходы состояний, повторы, срок, хеджи
+import time
+import asyncio
+import threading
+
+import pytest
+
+from src import resilience
+from src.resilience import CallPolicy, CallPool, CircuitBreaker, CircuitOpen, DeadlineExceeded
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ApiError(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = CallPool(4)
+    monkeypatch.setattr(resilience, 'call_pool', pool)
+    return pool
+
+
+def _breaker(failures: int = 2, cooldown: float = 10.0):
+    clock = Clock()
+    return CircuitBreaker('test', failures, cooldown, clock=clock), clock
+
+
+def _policy(breaker=None, **kwargs):
+    options = dict(deadline=2.0, attempts=1, retry_base=0.001, hedge=False, hedge_after=0.05,
+                   hedge_min=0.01, hedge_budget=1.0)
+    options.update(kwargs)
+    return CallPolicy('test', breaker or CircuitBreaker('test', 0, 1.0), **options)
+
+
+def _slow_first(delay: float):
+    """fn: первый вызов отвечает через delay, следующие — сразу"""
+    calls = []
+    lock = threading.Lock()
+
+    def fn():
+        with lock:
+            calls.append(threading.current_thread().name)
+            first = len(calls) == 1
+        if first:
+            time.sleep(delay)
+            return 'slow'
+        return 'fast'
+    return fn, calls
+
+
+# --- CircuitBreaker ---
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker, _ = _breaker(failures=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.opened == 1
+
+
+def test_half_open_allows_single_probe_and_closes_on_success():
+    breaker, clock = _breaker(failures=1, cooldown=10)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens():
+    breaker, clock = _breaker(failures=1, cooldown=10)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 2
+    clock.now = 15
+    assert not breaker.allow()
+
+
+def test_hung_probe_replaced_after_cooldown():
+    breaker, clock = _breaker(failures=1, cooldown=10)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    clock.now = 19
+    assert not breaker.allow()
+    clock.now = 20
+    assert breaker.allow()
+
+
+def test_breaker_disabled_with_zero_threshold():
+    breaker, _ = _breaker(failures=0)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+
+# --- CallPolicy ---
+
+def test_optional_call_skipped_while_open(pool):
+    breaker, _ = _breaker(failures=1)
+    breaker.record_failure()
+    policy = _policy(breaker)
+
+    with pytest.raises(CircuitOpen):
+        policy.call(lambda: 'ok', optional=True)
+    # Обязательные вызовы (эмбеддинги) выполняются и при разомкнутом предохранителе
+    assert policy.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert policy.stats_dict()['skipped'] == 1
+
+
+def test_retryable_error_retried(pool):
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ApiError(503)
+        return 'ok'
+
+    policy = _policy(attempts=2)
+    assert policy.call(fn) == 'ok'
+    assert policy.stats_dict()['retries'] == 1
+
+
+def test_non_retryable_error_counts_as_failure(pool):
+    breaker, _ = _breaker(failures=1)
+    policy = _policy(breaker, attempts=3)
+
+    def fn():
+        raise ApiError(400)
+
+    with pytest.raises(ApiError):
+        policy.call(fn)
+    stats = policy.stats_dict()
+    assert stats['retries'] == 0 and stats['failures'] == 1
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_deadline_exceeded(pool):
+    policy = _policy(deadline=0.05)
+    with pytest.raises(DeadlineExceeded):
+        policy.call(lambda: time.sleep(0.3))
+    assert policy.stats_dict()['timeouts'] == 1
+    assert policy.http_options() == {'timeout': 50}
+
+
+def test_hedge_wins_over_slow_call(pool):
+    fn, calls = _slow_first(0.5)
+    policy = _policy(hedge=True)
+    started = time.monotonic()
+    assert policy.call(fn) == 'fast'
+    assert time.monotonic() - started < 0.4
+    stats = policy.stats_dict()
+    assert stats['hedges'] == 1 and stats['hedge_wins'] == 1
+    assert len(calls) == 2
+
+
+def test_hedge_budget_limits_hedges(pool):
+    fn, calls = _slow_first(0.2)
+    policy = _policy(hedge=True, hedge_budget=0.0)
+    assert policy.call(fn) == 'slow'
+    assert policy.stats_dict()['hedges'] == 0
+    assert len(calls) == 1
+
+
+def test_hedge_needs_free_thread(monkeypatch):
+    monkeypatch.setattr(resilience, 'call_pool', CallPool(1))
+    fn, calls = _slow_first(0.2)
+    policy = _policy(hedge=True)
+    assert policy.call(fn) == 'slow'
+    stats = policy.stats_dict()
+    assert stats['hedges'] == 0 and stats['hedges_no_thread'] == 1
+
+
+def test_pool_bounds_hedges_in_flight():
+    pool = CallPool(8, hedge_share=0.25)
+    release = threading.Event()
+    futures = [pool.submit(release.wait, hedge=True) for _ in range(3)]
+    assert futures[2] is None
+    assert pool.stats_dict()['hedges_in_flight'] == 2
+    release.set()
+    for future in futures[:2]:
+        future.result(timeout=1)
+    time.sleep(0.01)
+    assert pool.stats_dict() == {'workers': 8, 'in_flight': 0, 'hedges_in_flight': 0}
+
+
+def test_async_hedge_cancels_loser():
+    cancelled = []
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return 'slow'
+        return 'fast'
+
+    policy = _policy(hedge=True)
+
+    async def main():
+        result = await policy.acall(call)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 'fast'
+    assert policy.stats_dict()['hedge_wins'] == 1
+    assert cancelled == [1]